@@ -17,15 +17,26 @@ is supported, but you are expected to implement the workflow.
 import os
 import re
 import json
+import time
+import hashlib
+import random
+import threading
+from collections import deque
+from itertools import islice
 
 try:  # python 3
     from urllib.request import urlopen, FancyURLopener, Request  # noqa
-    from urllib.parse import urlencode, quote
+    from urllib.parse import urlencode, quote, urlsplit
     from urllib.error import HTTPError
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from queue import LifoQueue, Empty
     py3 = True
 except ImportError:  # python 2.7
     from urllib import urlencode, FancyURLopener, quote
     from urllib2 import HTTPError, urlopen, Request
+    from urlparse import urlsplit
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from Queue import LifoQueue, Empty
     py3 = False
 
 
@@ -166,6 +177,287 @@ class FreesoundClient():
         else:
             self.header = 'Token ' + token
 
+    def set_response_cache(self, response_cache):
+        """
+        Serve the GET requests from a ResponseCache
+
+        >>> c.set_response_cache(ResponseCache("/tmp/freesound_cache"))
+        """
+        self.response_cache = response_cache
+
+
+class BatchFreesoundClient(FreesoundClient):
+    """
+    FreesoundClient for bulk queries. The GET requests go through a pool of
+    persistent connections, limited by a token bucket to
+    requests_per_minute (the quota of the API key) and retried with jitter
+    on 429 and 5xx errors. get_sounds_by_id runs `workers` searches at a
+    time in a thread pool (python 3 only) and yields the sounds as they
+    arrive
+    >>> c = BatchFreesoundClient(workers=4, requests_per_minute=60)
+    >>> c.set_token("<your_api_key>")
+    >>> for snd in c.get_sounds_by_id(sound_ids, fields="id,name"):
+    >>>     print(snd.name)
+    """
+    def __init__(self, workers=4, requests_per_minute=60, max_retries=5,
+                 backoff=1.0, timeout=30):
+        self.workers = workers
+        self.connection_pool = ConnectionPool(
+            TokenBucket(requests_per_minute / 60.0, capacity=workers),
+            max_retries=max_retries, backoff=backoff, timeout=timeout)
+
+    def map(self, func, items):
+        """
+        Yields func(item) for each item in order, running `workers` calls at
+        a time with at most 2 * workers items taken from the iterable
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = deque(executor.submit(func, item)
+                            for item in islice(items, 2 * self.workers))
+            while futures:
+                result = futures.popleft().result()
+                for item in islice(items, 1):
+                    futures.append(executor.submit(func, item))
+                yield result
+
+    def get_sounds_by_id(self, sound_ids, chunk_size=50, **params):
+        """
+        Yields the sounds of sound_ids that exist in Freesound, searched
+        with a filter of chunk_size ids per request (150 at most)
+        Relevant params: fields, descriptors, normalized
+
+        >>> sounds = c.get_sounds_by_id([6, 7], fields="id,name")
+        """
+        def search(chunk):
+            id_filter = 'id:(' + ' OR '.join(str(i) for i in chunk) + ')'
+            return self.text_search(query="", filter=id_filter,
+                                    page_size=chunk_size, **params)
+
+        sound_ids = iter(sound_ids)
+        chunks = iter(lambda: list(islice(sound_ids, chunk_size)), [])
+        for pager in self.map(search, chunks):
+            for snd in pager.results:
+                yield Sound(snd, self)
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by threads. Each request takes a token and the
+    tokens are refilled at rate per second up to capacity, which is the
+    largest burst of requests allowed
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class ConnectionPool:
+    """
+    Persistent connections shared by threads: a request reuses an idle
+    connection to the host or opens a new one, and gives it back once the
+    response is read. Requests wait for a token of the rate limiter and
+    connection errors and RETRY_STATUSES are retried max_retries times,
+    waiting what the Retry-After header says or a random time up to
+    backoff * 2 ** attempt seconds
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate_limiter=None, max_retries=5, backoff=1.0,
+                 timeout=30):
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, headers):
+        """
+        Returns the status code, headers and body of a GET request
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, response_headers, body = self.get_once(url, headers)
+                if status not in self.RETRY_STATUSES or \
+                        attempt == self.max_retries:
+                    return status, response_headers, body
+                retry_after = response_headers.get('Retry-After')
+            except (HTTPException, IOError, OSError):
+                if attempt == self.max_retries:
+                    raise
+                retry_after = None
+            if retry_after is not None and retry_after.isdigit():
+                time.sleep(int(retry_after))
+            else:
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def get_once(self, url, headers):
+        parts = urlsplit(url)
+        with self.lock:
+            connections = self.idle_connections.setdefault(
+                (parts.scheme, parts.netloc), LifoQueue())
+        try:
+            connection = connections.get_nowait()
+        except Empty:
+            connection_class = HTTPSConnection \
+                if parts.scheme == 'https' else HTTPConnection
+            connection = connection_class(parts.netloc, timeout=self.timeout)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+        except Exception:
+            connection.close()
+            raise
+        connections.put(connection)
+        return response.status, response.msg, body
+
+
+class ResponseCache:
+    """
+    On-disk cache of the successful GET responses of the API, one file per
+    url (which includes the params) and Authorization header in directory,
+    so that responses are not shared across tokens. A response is served from
+    the cache for the TTL of its endpoint type (see endpoint_type), then it
+    is revalidated with If-None-Match / If-Modified-Since when the API gave
+    an ETag or a Last-Modified date. The fresh hits, the revalidations, the
+    misses (the responses that are cached), the errors (the responses that
+    are not) and the bytes not downloaded thanks to the cache are counted in
+    stats
+    >>> c = FreesoundClient()
+    >>> c.set_response_cache(ResponseCache("/tmp/freesound_cache"))
+    """
+    DEFAULT_TTLS = {
+        'search': 60 * 60,  # the results change with the uploads
+        'sound': 24 * 60 * 60,
+        'analysis': 30 * 24 * 60 * 60,  # the analysis of a sound is stable
+        'other': 60 * 60,
+    }
+
+    def __init__(self, directory, ttls=None):
+        self.directory = directory
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self.stats = {'hits': 0, 'revalidations': 0, 'misses': 0,
+                      'errors': 0, 'bytes_saved': 0}
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def endpoint_type(url):
+        path = urlsplit(url).path
+        if '/search/' in path:
+            return 'search'
+        if path.endswith('/analysis/'):
+            return 'analysis'
+        if re.search(r'/sounds/\d+/$', path):
+            return 'sound'
+        return 'other'
+
+    @staticmethod
+    def key(url, authorization=None):
+        """
+        Returns the cache key of url, with a hash of the Authorization header
+        (the token itself is not written to disk)
+        """
+        if not authorization:
+            return url
+        return '%s#%s' % (
+            url, hashlib.sha256(authorization.encode('utf-8')).hexdigest())
+
+    def entry_path(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def load(self, key):
+        """
+        Returns the metadata and body of the cached response of key or None
+        """
+        try:
+            with open(self.entry_path(key), 'rb') as f:
+                entry = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+        except (IOError, OSError, ValueError):
+            return None
+        return (entry, body) if entry.get('key') == key else None
+
+    def save(self, key, entry, body):
+        entry = dict(entry, key=key, stored_at=time.time())
+        path = self.entry_path(key)
+        temporary_path = '%s.%s.%s.tmp' % (
+            path, os.getpid(), threading.current_thread().ident)
+        with open(temporary_path, 'wb') as f:
+            f.write(json.dumps(entry).encode('utf-8') + b'\n')
+            f.write(body)
+        if py3:
+            os.replace(temporary_path, path)
+        else:  # no os.replace, rename also replaces the file on posix
+            os.rename(temporary_path, path)
+
+    def count(self, stat, bytes_saved=0):
+        with self.lock:
+            self.stats[stat] += 1
+            self.stats['bytes_saved'] += bytes_saved
+
+    def get(self, url, fetch, authorization=None):
+        """
+        Returns the status code and body of a GET of url with the given
+        Authorization header, from the cache or from fetch(validators), which
+        makes the request with the given conditional headers and returns its
+        status code, headers and body
+        """
+        key = self.key(url, authorization)
+        cached = self.load(key)
+        if cached is not None:
+            entry, body = cached
+            ttl = self.ttls[self.endpoint_type(url)]
+            if time.time() - entry['stored_at'] < ttl:
+                self.count('hits', len(body))
+                return 200, body
+            validators = {}
+            if entry.get('etag'):
+                validators['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                validators['If-Modified-Since'] = entry['last_modified']
+        else:
+            validators = {}
+
+        status, headers, body = fetch(validators)
+        if status == 304 and cached is not None:
+            entry, body = cached
+            self.save(key, entry, body)
+            self.count('revalidations', len(body))
+            return 200, body
+        if status != 200:
+            self.count('errors')
+            return status, body
+        self.count('misses')
+        self.save(key, {'etag': headers.get('ETag'),
+                        'last_modified': headers.get('Last-Modified')},
+                  body)
+        return status, body
+
 
 class FreesoundObject:
     """
@@ -237,20 +529,21 @@ class FSRequest:
         url = '%s?%s' % (uri, urlencode(p)) if params else uri
         d = urlencode(data) if data else None
         headers = {'Authorization': client.header}
-        req = Request(url, d, headers)
-        try:
-            f = urlopen(req)
-        except HTTPError as e:
-            resp = e.read()
-            if e.code >= 200 and e.code < 300:
-                return resp
-            else:
-                raise FreesoundException(e.code, json.loads(resp))
-        if py3:
-            resp = f.read().decode("utf-8")
+        response_cache = getattr(client, 'response_cache', None)
+        if response_cache is not None and method == 'GET' and not d:
+            code, resp = response_cache.get(url, lambda validators: cls.open(
+                url, None, dict(headers, **validators), client),
+                authorization=headers['Authorization'])
         else:
-            resp = f.read()
-        f.close()
+            code, _, resp = cls.open(url, d, headers, client)
+        if py3:
+            resp = resp.decode("utf-8")
+        if code < 200 or code >= 300:
+            try:
+                detail = json.loads(resp)
+            except ValueError:  # e.g. the html page of a 502
+                detail = resp
+            raise FreesoundException(code, detail)
         result = None
         try:
             result = json.loads(resp)
@@ -260,6 +553,25 @@ class FSRequest:
             return wrapper(result, client)
         return result
 
+    @classmethod
+    def open(cls, url, data, headers, client):
+        """
+        Returns the status code, headers and body of a request, made through
+        the connection pool of the client for the GET requests when it has
+        one
+        """
+        connection_pool = getattr(client, 'connection_pool', None)
+        if connection_pool is not None and not data:
+            return connection_pool.get(url, headers)
+        try:
+            f = urlopen(Request(url, data, headers))
+        except HTTPError as e:
+            return e.code, e.headers, e.read()
+        try:
+            return f.getcode(), f.info(), f.read()
+        finally:
+            f.close()
+
     @classmethod
     def retrieve(cls, url, client, path):
         r = Retriever()
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from datasets.models import Dataset
+from datasets.utils import run_and_measure
+
+
+def per_node_annotation_stats(dataset):
+    """ Previous way of computing the taxonomy stats: one group of count queries per taxonomy node """
+    annotation_numbers = {}
+    for node_id in dataset.taxonomy.get_all_node_ids():
+        num_annotations = dataset.num_annotations_per_taxonomy_node(node_id)
+        if num_annotations == 0:
+            continue
+        annotation_numbers[node_id] = {
+            'num_annotations': num_annotations,
+            'num_sounds': dataset.sounds_per_taxonomy_node(node_id).distinct().count(),
+            'num_missing_votes': dataset.num_non_validated_annotations_per_taxonomy_node(node_id),
+            'votes_stats': {
+                'num_present_and_predominant': dataset.num_votes_with_value(node_id, 1.0),
+                'num_present_not_predominant': dataset.num_votes_with_value(node_id, 0.5),
+                'num_not_present': dataset.num_votes_with_value(node_id, -1.0),
+                'num_unsure': dataset.num_votes_with_value(node_id, 0.0)
+            }
+        }
+    return annotation_numbers
+
+
+class Command(BaseCommand):
+    help = 'Compare the number of queries and time needed to compute the per taxonomy node annotation stats ' \
+           'of a dataset. Populate the dataset first, e.g. with python manage.py generate_fake_data. ' \
+           'Usage: python manage.py benchmark_dataset_taxonomy_stats fsd'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_short_name', type=str)
+
+    def handle(self, *args, **options):
+        dataset = Dataset.objects.get(short_name=options['dataset_short_name'])
+
+        old_stats, old_num_queries, old_time = run_and_measure(per_node_annotation_stats, dataset)
+        new_stats, new_num_queries, new_time = run_and_measure(dataset.annotation_stats_per_taxonomy_node)
+
+        print('Per node queries: {0} queries in {1:.3f} seconds'.format(old_num_queries, old_time))
+        print('Grouped query: {0} queries in {1:.3f} seconds'.format(new_num_queries, new_time))
+        print('Results are equal: {0}'.format(old_stats == new_stats))
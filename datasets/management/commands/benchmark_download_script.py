@@ -0,0 +1,181 @@
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+import importlib.util
+import threading
+import tempfile
+import hashlib
+import json
+import time
+import os
+import re
+
+
+def sound_content(sound_id, size):
+    """ Returns the deterministic fake audio file of a sound """
+    block = hashlib.sha256(str(sound_id).encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeFreesoundServer(object):
+    """
+    Local stand-in for the Freesound API, used as context manager, serving the endpoints used by the download script:
+    /apiv2/sounds/<id>/download/ redirects to /data/<id>.wav, and /apiv2/sounds/<id>/ and /apiv2/sounds/<id>/analysis/
+    return JSON, and /apiv2/search/text/ returns the sounds of the ids of its filter. Each response waits latency
+    seconds and the first num_errors requests of each url return a 503. The successful responses have an ETag and
+    If-None-Match is honoured. The requests and the client ports are counted
+    """
+
+    def __init__(self, sound_ids, sound_size=2 ** 16, latency=0, num_errors=0):
+        self.sound_ids = sound_ids
+        self.sound_ids_set = set(sound_ids)
+        self.sound_size = sound_size
+        self.latency = latency
+        self.num_errors = num_errors
+        self.num_requests = 0
+        self.client_ports = set()
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.request_handler_class())
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/'.format(self.server.server_address[1])
+
+    @property
+    def api_url(self):
+        return self.url + 'apiv2/'
+
+    @property
+    def dataset_url(self):
+        return self.url + 'dataset-sounds/'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path):
+        """ Returns the status, headers and body of the response to a GET of path """
+        parts = urlsplit(path)
+        match = re.match(r'^/apiv2/sounds/(\d+)/(download/|analysis/)?$', parts.path) or \
+            re.match(r'^/data/(\d+)\.wav$', parts.path)
+        if parts.path == '/dataset-sounds/':
+            return 200, {}, json.dumps({'sounds': self.sound_ids}).encode()
+        if parts.path != '/apiv2/search/text/' and (match is None or int(match.group(1)) not in self.sound_ids_set):
+            return 404, {}, b''
+        with self.lock:
+            self.errors[path] = self.errors.get(path, 0) + 1
+            if self.errors[path] <= self.num_errors:
+                return 503, {'Retry-After': '0'}, b''
+        if match is None:
+            # text search filtered by id, as in datasets.freesound.BatchFreesoundClient.get_sounds_by_id
+            id_filter = parse_qs(parts.query).get('filter', [''])[0]
+            results = [{'id': sound_id, 'name': 'Sound {0}'.format(sound_id)}
+                       for sound_id in map(int, re.findall(r'\d+', id_filter)) if sound_id in self.sound_ids_set]
+            return 200, {}, json.dumps({'count': len(results), 'results': results}).encode()
+        sound_id = int(match.group(1))
+        if path.startswith('/data/'):
+            return 200, {'Content-Disposition': 'attachment; filename="{0}.wav"'.format(sound_id)}, \
+                sound_content(sound_id, self.sound_size)
+        if path.endswith('/download/'):
+            return 302, {'Location': '/data/{0}.wav'.format(sound_id)}, b''
+        if path.endswith('/analysis/'):
+            return 200, {}, json.dumps({'lowlevel': {'average_loudness': 0.5}}).encode()
+        return 200, {}, json.dumps({'id': sound_id, 'name': 'Sound {0}'.format(sound_id)}).encode()
+
+    def request_handler_class(self):
+        fake_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with fake_server.lock:
+                    fake_server.num_requests += 1
+                    fake_server.client_ports.add(self.client_address[1])
+                time.sleep(fake_server.latency)
+                status, headers, body = fake_server.respond(self.path)
+                if status == 200:
+                    headers['ETag'] = '"{0}"'.format(hashlib.md5(body).hexdigest())
+                    if self.headers.get('If-None-Match') == headers['ETag']:
+                        status, body = 304, b''
+                self.send_response(status)
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return RequestHandler
+
+
+def load_download_script(path, dataset_url, api_url):
+    """ Renders the download script to path and imports it as a module that uses the given urls """
+    with open(path, 'w') as f:
+        f.write(render_to_string('datasets/download_script.py', {
+            'dataset_url': dataset_url,
+            'access_token_url': dataset_url,
+            'get_code_url': '',
+        }))
+    spec = importlib.util.spec_from_file_location('download_script', path)
+    download_script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(download_script)
+    download_script.api_url = api_url
+    return download_script
+
+
+class Command(BaseCommand):
+    help = 'Measures the sounds per second of the download script with a local stand-in of the Freesound API that ' \
+           'adds some latency to each response, downloading with one worker and with several ones. ' \
+           'Usage: python manage.py benchmark_download_script --num-sounds 200 --workers 8 --latency 0.02'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--num-sounds',
+            type=int,
+            dest='num_sounds',
+            default=200,
+            help='Number of fake sounds to download')
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=8,
+            help='Number of workers of the parallel download')
+
+        parser.add_argument(
+            '--latency',
+            type=float,
+            dest='latency',
+            default=0.02,
+            help='Seconds waited by the stand-in server before each response')
+
+    def handle(self, *args, **options):
+        sound_ids = list(range(1, options['num_sounds'] + 1))
+        with FakeFreesoundServer(sound_ids, latency=options['latency']) as server, \
+                tempfile.TemporaryDirectory() as folder:
+            download_script = load_download_script(os.path.join(folder, 'fs_download_script.py'),
+                                                   server.dataset_url, server.api_url)
+            for workers in (1, options['workers']):
+                download_path = os.path.join(folder, 'workers_{0}'.format(workers))
+                os.makedirs(download_path)
+                client = download_script.Client('token', download_script.RateLimiter(0))
+                downloader = download_script.Downloader(client, download_path, workers=workers)
+                num_downloaded, failed_sound_ids, elapsed_time = downloader.download(sound_ids)
+                print('{0} workers: {1} sounds in {2:.3f} seconds ({3:.1f} sounds/s)'
+                      .format(workers, num_downloaded, elapsed_time, num_downloaded / elapsed_time))
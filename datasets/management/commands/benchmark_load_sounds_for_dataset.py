@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from datasets.models import Dataset, Sound, SoundDataset, CandidateAnnotation, TaxonomyNode
+from datasets.management.commands.generate_fake_data import FAKE_LICENSES
+from datasets.management.commands.load_sounds_for_dataset import load_sounds
+from datasets.utils import stem, iter_json_object_items
+import tempfile
+import time
+import random
+import json
+
+FAKE_TAGS = ['dog', 'barking', 'bark', 'cat', 'meowing', 'field-recording', 'ambience', 'city', 'traffic', 'rain',
+             'thunder', 'storm', 'bird', 'birds', 'singing', 'guitar', 'piano', 'drums', 'voice', 'speech', 'footsteps',
+             'door', 'water', 'wind', 'engine', 'car', 'train', 'noise', 'electronic', 'synth']
+
+
+def generate_sounds_data(dataset, num_sounds):
+    """ Returns a dictionary of fake sounds in the format of the json files of load_sounds_for_dataset """
+    node_ids = list(dataset.taxonomy.taxonomynode_set.values_list('node_id', flat=True))
+    return {str(10 ** 7 + i): {
+        'name': 'Benchmark sound #{0}'.format(i),
+        'tags': random.sample(FAKE_TAGS, random.randint(2, 10)),
+        'duration': 40 * random.random(),
+        'username': 'username_{0}'.format(random.randint(0, 100)),
+        'license': random.choice(FAKE_LICENSES),
+        'description': 'Description of the benchmark sound #{0}'.format(i),
+        'previews': 'https://freesound.org/data/previews/{0}.mp3'.format(i),
+        'category_ids': random.sample(node_ids, random.randint(1, min(3, len(node_ids)))),
+    } for i in range(num_sounds)}
+
+
+def load_sounds_one_by_one(dataset, file_location, algorithm_name):
+    """ Previous way of loading the sounds: json.load and a few queries per sound and candidate annotation """
+    data = json.load(open(file_location))
+    for sound_id, sound_data in data.items():
+        sound = Sound.objects.create(
+            name=sound_data['name'][:200],
+            freesound_id=sound_id,
+            extra_data={
+                'tags': sound_data['tags'],
+                'stemmed_tags': [stem(tag) for tag in sound_data['tags']],
+                'duration': sound_data['duration'],
+                'username': sound_data['username'],
+                'license': sound_data['license'],
+                'description': sound_data['description'],
+                'previews': sound_data['previews'],
+                'analysis': sound_data['analysis'] if 'analysis' in sound_data.keys() else {},
+            }
+        )
+        sound_dataset = SoundDataset.objects.create(dataset=dataset, sound=sound)
+        for node_id in sound_data['category_ids']:
+            c = CandidateAnnotation.objects.create(
+                sound_dataset=sound_dataset,
+                type='AU',
+                algorithm=algorithm_name,
+                taxonomy_node=TaxonomyNode.objects.get(node_id=node_id)
+            )
+            c.update_priority_score()
+    return len(data), sum(len(sound_data['category_ids']) for sound_data in data.values())
+
+
+def load_sounds_in_batches(dataset, file_location, algorithm_name):
+    with open(file_location) as f:
+        return load_sounds(dataset, iter_json_object_items(f), algorithm_name)
+
+
+class Command(BaseCommand):
+    help = 'Compare the rows per second of the previous one by one sound loading and of the batched ' \
+           'load_sounds_for_dataset, with a json file of fake sounds. Each load runs in a transaction that is ' \
+           'rolled back. Usage: python manage.py benchmark_load_sounds_for_dataset fsd --num-sounds 10000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_short_name', type=str)
+
+        parser.add_argument(
+            '--num-sounds',
+            type=int,
+            dest='num_sounds',
+            default=10000,
+            help='Number of fake sounds in the json file')
+
+    def handle(self, *args, **options):
+        dataset = Dataset.objects.get(short_name=options['dataset_short_name'])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(generate_sounds_data(dataset, options['num_sounds']), f)
+            f.flush()
+
+            for name, func in (('One by one', load_sounds_one_by_one), ('Batches', load_sounds_in_batches)):
+                with transaction.atomic():
+                    start = time.time()
+                    num_sounds, num_candidate_annotations = func(dataset, f.name, 'Benchmark')
+                    elapsed_time = time.time() - start
+                    transaction.set_rollback(True)
+                num_rows = 2 * num_sounds + num_candidate_annotations
+                print('{0}: {1} rows in {2:.3f} seconds ({3:.0f} rows/s)'
+                      .format(name, num_rows, elapsed_time, num_rows / elapsed_time))
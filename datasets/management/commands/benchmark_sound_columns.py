@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from datasets.models import Dataset, Sound, SoundDataset, CandidateAnnotation
+from datasets.management.commands.generate_fake_data import FAKE_LICENSES
+from datasets.utils import run_and_measure, chunks
+from monitor.tasks import counts_per_taxonomy_node
+import random
+
+NC_LICENSES = ('http://creativecommons.org/licenses/by-nc/3.0/', 'http://creativecommons.org/licenses/sampling+/1.0/')
+
+
+def generate_sounds(dataset, num_sounds, chunk_size=10000):
+    """ Adds num_sounds fake sounds with one candidate annotation each to the dataset, with bulk inserts """
+    taxonomy_node_ids = list(dataset.taxonomy.taxonomynode_set.values_list('id', flat=True))
+    for chunk in chunks(range(num_sounds), chunk_size):
+        sounds = []
+        for i in chunk:
+            sound = Sound(name='Benchmark sound #{0}'.format(i), freesound_id=i,
+                          extra_data={'duration': 40 * random.random(), 'license': random.choice(FAKE_LICENSES)})
+            sound.update_extra_data_columns()
+            sounds.append(sound)
+        sounds = Sound.objects.bulk_create(sounds)
+        sound_datasets = SoundDataset.objects.bulk_create([SoundDataset(dataset=dataset, sound=sound)
+                                                           for sound in sounds])
+        CandidateAnnotation.objects.bulk_create([CandidateAnnotation(sound_dataset=sound_dataset, type='AU',
+                                                                     algorithm='Benchmark',
+                                                                     taxonomy_node_id=random.choice(taxonomy_node_ids))
+                                                 for sound_dataset in sound_datasets])
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE datasets_sound, datasets_sounddataset, datasets_candidateannotation')
+
+
+def remaining_annotations_with_duration(dataset, duration_field):
+    """ Grouped counts of compute_remaining_annotations_with_duration using the given duration lookup """
+    duration = 'sound_dataset__sound__{0}'.format(duration_field)
+    return counts_per_taxonomy_node(
+        dataset.candidate_annotations.filter(ground_truth=None),
+        'taxonomy_node_id',
+        num_non_gt=None,
+        num_non_gt_max_10_sec=Q(**{duration + '__lte': 10}),
+        num_non_gt_max_20_sec=Q(**{duration + '__lte': 20, duration + '__gt': 10}))
+
+
+def sounds_in_duration_range(duration_field):
+    """ Ids of the sounds whose duration is in the priority score range, as done in compute_priority_scores """
+    return set(Sound.objects.filter(**{duration_field + '__gte': 0.3, duration_field + '__lte': 30})
+               .values_list('id', flat=True))
+
+
+def candidate_annotations_without_nc_license(dataset, license_field):
+    """ Ids of the candidate annotations left by the license filter of the new annotations validation mode """
+    license = 'sound_dataset__sound__{0}'.format(license_field)
+    return set(dataset.candidate_annotations
+               .exclude(**{license: None})
+               .exclude(**{license + '__in': NC_LICENSES})
+               .values_list('id', flat=True))
+
+
+def count_short_sounds(duration_field):
+    return Sound.objects.filter(**{duration_field + '__lte': 1}).count()
+
+
+def count_nc_sounds(license_field):
+    return Sound.objects.filter(**{license_field + '__in': NC_LICENSES}).count()
+
+
+class Command(BaseCommand):
+    help = 'Compare the time needed by the hot Sound queries when filtering on the extra_data JSON fields and ' \
+           'on the duration and license columns. With --generate, fake sounds are added before the benchmark ' \
+           'in a transaction that is rolled back at the end. ' \
+           'Usage: python manage.py benchmark_sound_columns fsd --generate 500000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_short_name', type=str)
+
+        parser.add_argument(
+            '--generate',
+            type=int,
+            dest='generate',
+            default=0,
+            help='Number of fake sounds to add to the dataset for the benchmark')
+
+    def handle(self, *args, **options):
+        dataset = Dataset.objects.get(short_name=options['dataset_short_name'])
+
+        with transaction.atomic():
+            if options['generate']:
+                print('Generating {0} sounds...'.format(options['generate']))
+                generate_sounds(dataset, options['generate'])
+            print('Benchmarking with {0} sounds'.format(Sound.objects.count()))
+
+            for name, func, json_field, column in (
+                    ('Remaining annotations with duration', remaining_annotations_with_duration,
+                     'extra_data__duration', 'duration'),
+                    ('Sounds in priority score duration range', sounds_in_duration_range,
+                     'extra_data__duration', 'duration'),
+                    ('Short sounds count', count_short_sounds, 'extra_data__duration', 'duration'),
+                    ('Candidate annotations without NC license', candidate_annotations_without_nc_license,
+                     'extra_data__license', 'license'),
+                    ('NC sounds count', count_nc_sounds, 'extra_data__license', 'license')):
+                args = (dataset,) if func in (remaining_annotations_with_duration,
+                                              candidate_annotations_without_nc_license) else ()
+                old_result, _, old_time = run_and_measure(func, *args, json_field)
+                new_result, _, new_time = run_and_measure(func, *args, column)
+                print('{0}: extra_data {1:.3f} seconds, column {2:.3f} seconds, results are equal: {3}'
+                      .format(name, old_time, new_time, old_result == new_result))
+
+            transaction.set_rollback(True)
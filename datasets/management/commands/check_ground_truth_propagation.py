@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from datasets.models import Dataset
+from datasets.tasks import propagate_ground_truth_annotation, enqueue_ground_truth_propagation
+
+
+class Command(BaseCommand):
+    help = 'Find the ground truth annotations of a dataset whose propagation to the parent taxonomy nodes is ' \
+           'missing or incomplete and propagate them again. ' \
+           'Usage: python manage.py check_ground_truth_propagation fsd'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_short_name', type=str)
+
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Only print the ground truth annotations that are not propagated')
+
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='async',
+            default=False,
+            help='Enqueue the propagations to the Celery workers instead of running them here')
+
+    def handle(self, *args, **options):
+        dataset = Dataset.objects.get(short_name=options['dataset_short_name'])
+        unpropagated = dataset.get_unpropagated_ground_truth_annotations()\
+            .values_list('sound_dataset_id', 'taxonomy_node__node_id', 'taxonomy_node_id')
+
+        num_unpropagated = 0
+        for sound_dataset_id, node_id, taxonomy_node_id in unpropagated:
+            print('Sound dataset {0}: {1} not propagated'.format(sound_dataset_id, node_id))
+            num_unpropagated += 1
+            if options['dry_run']:
+                continue
+            if options['async']:
+                enqueue_ground_truth_propagation(sound_dataset_id, taxonomy_node_id)
+            else:
+                propagate_ground_truth_annotation(sound_dataset_id, taxonomy_node_id)
+
+        print('{0} ground truth annotations {1}'.format(num_unpropagated,
+                                                        'not propagated' if options['dry_run'] else
+                                                        'enqueued for propagation' if options['async'] else
+                                                        'propagated'))
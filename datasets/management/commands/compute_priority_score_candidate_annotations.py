@@ -4,10 +4,18 @@ from datasets.tasks import compute_priority_score_candidate_annotations
 
 class Command(BaseCommand):
     help = 'Compute the priority score for all the candidate annotations' \
-           'and store it in the database. This is applied to the fsd dataset'
+           'and store it in the database. This is applied to the fsd dataset. ' \
+           'Usage: python manage.py compute_priority_score_candidate_annotations [--incremental]'
     
     def add_arguments(self, parser):
-        pass
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help='Only rescore the sounds with new candidate annotations, votes or ground truth annotations since '
+                 'the previous run')
 
     def handle(self, *args, **options):
-        compute_priority_score_candidate_annotations()
+        num_updated = compute_priority_score_candidate_annotations(incremental=options['incremental'])
+        print('{0} priority scores updated'.format(num_updated))
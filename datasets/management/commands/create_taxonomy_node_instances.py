@@ -32,3 +32,5 @@ class Command(BaseCommand):
                     for node_id in taxonomy.data[taxonomy_node.node_id]['parent_ids']:
                         parent_node = TaxonomyNode.objects.get(node_id=node_id)
                         taxonomy_node.parents.add(parent_node)
+
+        taxonomy.rebuild_ancestry_closure()
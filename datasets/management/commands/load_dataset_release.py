@@ -1,14 +1,294 @@
-import sys
+import os
+import io
+import csv
 import json
-from django.core.management.base import BaseCommand
-from datasets.models import *
-from collections import defaultdict
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from datasets.models import Dataset, DatasetRelease, TaxonomyNode, CandidateAnnotation, GroundTruthAnnotation, \
+    CandidateAnnotationPools, increment_dataset_annotation_counters, refresh_nb_ground_truth
+from collections import Counter
+
+
+@contextmanager
+def stage(name):
+    """ Prints the time spent in the block """
+    start = time.time()
+    yield
+    print('{0}: {1:.3f} seconds'.format(name, time.time() - start))
+
+
+def copy_release_rows(cursor, ground_truth_in_file):
+    """
+    Copies the (category id, freesound sound id, partition) rows of the release file to the release_rows temporary
+    table. When the same annotation appears several times, the last row is kept, as it sets the partition.
+    Blank partitions are stored as NULL, other partitions than the GroundTruthAnnotation choices are refused
+    """
+    partitions = {partition for partition, _ in GroundTruthAnnotation.PARTITION_CHOICES}
+    invalid_rows = [row for row in ground_truth_in_file if row[2] not in partitions and row[2] not in (None, '')]
+    if invalid_rows:
+        raise CommandError('{0} annotations have an unknown partition, e.g. {1}'
+                           .format(len(invalid_rows), ', '.join('{0} {1} {2}'.format(*row)
+                                                                for row in invalid_rows[:10])))
+
+    cursor.execute("""
+            DROP TABLE IF EXISTS release_rows;
+            CREATE TEMPORARY TABLE release_rows (
+                row_number integer NOT NULL,
+                node_id text NOT NULL,
+                freesound_id integer NOT NULL,
+                partition varchar(4),
+                taxonomy_node_id integer,
+                sound_dataset_id integer,
+                candidate_annotation_id integer,
+                ground_truth_annotation_id integer,
+                created boolean NOT NULL DEFAULT false
+            ) ON COMMIT DROP
+                   """)
+    rows = io.StringIO()
+    writer = csv.writer(rows)
+    for row_number, (node_id, fs_id, partition) in enumerate(ground_truth_in_file):
+        writer.writerow((row_number, node_id, fs_id, partition))
+    rows.seek(0)
+    cursor.copy_expert('COPY release_rows (row_number, node_id, freesound_id, partition) FROM STDIN WITH CSV', rows)
+    cursor.execute("""
+            DELETE FROM release_rows
+             USING release_rows later_rows
+             WHERE later_rows.node_id = release_rows.node_id
+               AND later_rows.freesound_id = release_rows.freesound_id
+               AND later_rows.row_number > release_rows.row_number;
+            CREATE INDEX ON release_rows (taxonomy_node_id, sound_dataset_id);
+            ANALYZE release_rows
+                   """)
+
+
+def resolve_release_rows(cursor, dataset):
+    """
+    Sets the ids of the taxonomy node, sound in the dataset and existing ground truth annotation of each release row,
+    and the one of the first candidate annotation of the rows without ground truth annotation
+    """
+    cursor.execute("""
+            UPDATE release_rows
+               SET taxonomy_node_id = taxonomynode.id
+              FROM datasets_taxonomynode taxonomynode
+             WHERE taxonomynode.node_id = release_rows.node_id
+               AND taxonomynode.taxonomy_id = %(taxonomy_id)s;
+
+            UPDATE release_rows
+               SET sound_dataset_id = sounddatasets.id
+              FROM (
+                       SELECT sound.freesound_id
+                              , MIN(sounddataset.id) AS id
+                         FROM datasets_sounddataset sounddataset
+                   INNER JOIN datasets_sound sound
+                           ON sounddataset.sound_id = sound.id
+                        WHERE sounddataset.dataset_id = %(dataset_id)s
+                     GROUP BY sound.freesound_id
+                   ) sounddatasets
+             WHERE sounddatasets.freesound_id = release_rows.freesound_id;
+                   """, {'taxonomy_id': dataset.taxonomy_id, 'dataset_id': dataset.id})
+
+    cursor.execute("""
+            SELECT node_id, freesound_id
+              FROM release_rows
+             WHERE taxonomy_node_id IS NULL OR sound_dataset_id IS NULL
+          ORDER BY row_number
+                   """)
+    unresolved_rows = cursor.fetchall()
+    if unresolved_rows:
+        raise CommandError('{0} annotations refer to a category or a sound that is not in the dataset, e.g. {1}'
+                           .format(len(unresolved_rows), ', '.join('{0} {1}'.format(*row)
+                                                                   for row in unresolved_rows[:10])))
+
+    cursor.execute("""
+            UPDATE release_rows
+               SET ground_truth_annotation_id = groundtruthannotation.id
+              FROM datasets_groundtruthannotation groundtruthannotation
+             WHERE groundtruthannotation.taxonomy_node_id = release_rows.taxonomy_node_id
+               AND groundtruthannotation.sound_dataset_id = release_rows.sound_dataset_id
+                   """)
+    resolve_candidate_annotations(cursor)
+
+
+def resolve_candidate_annotations(cursor):
+    cursor.execute("""
+            UPDATE release_rows
+               SET candidate_annotation_id = candidateannotations.id
+              FROM (
+                       SELECT candidateannotation.sound_dataset_id
+                              , candidateannotation.taxonomy_node_id
+                              , MIN(candidateannotation.id) AS id
+                         FROM datasets_candidateannotation candidateannotation
+                   INNER JOIN release_rows
+                           ON release_rows.sound_dataset_id = candidateannotation.sound_dataset_id
+                          AND release_rows.taxonomy_node_id = candidateannotation.taxonomy_node_id
+                     GROUP BY candidateannotation.sound_dataset_id
+                              , candidateannotation.taxonomy_node_id
+                   ) candidateannotations
+             WHERE candidateannotations.sound_dataset_id = release_rows.sound_dataset_id
+               AND candidateannotations.taxonomy_node_id = release_rows.taxonomy_node_id
+               AND release_rows.ground_truth_annotation_id IS NULL
+               AND release_rows.candidate_annotation_id IS NULL
+                   """)
+
+
+def increment_counters_per_taxonomy_node(dataset, taxonomy_node_ids, **increments):
+    """ Adds the increments to the counters of each taxonomy node, once per occurrence of the node in the list """
+    for taxonomy_node_id, num in Counter(taxonomy_node_ids).items():
+        increment_dataset_annotation_counters(dataset.id, taxonomy_node_id,
+                                              **{field: value * num for field, value in increments.items()})
+
+
+def create_candidate_annotations(cursor, dataset):
+    """
+    Creates a verified candidate annotation for the release rows that have neither a ground truth annotation
+    nor a candidate annotation. Returns the number of candidate annotations created
+    """
+    cursor.execute("""
+            SELECT sound_dataset_id, taxonomy_node_id
+              FROM release_rows
+             WHERE ground_truth_annotation_id IS NULL
+               AND candidate_annotation_id IS NULL
+                   """)
+    candidate_annotations = CandidateAnnotation.objects.bulk_create([
+        CandidateAnnotation(sound_dataset_id=sound_dataset_id, taxonomy_node_id=taxonomy_node_id, ground_truth=1,
+                            type='MA')
+        for sound_dataset_id, taxonomy_node_id in cursor.fetchall()])
+    increment_counters_per_taxonomy_node(dataset, [candidate_annotation.taxonomy_node_id
+                                                   for candidate_annotation in candidate_annotations],
+                                         num_annotations=1, num_verified_annotations=1)
+    resolve_candidate_annotations(cursor)
+    return len(candidate_annotations)
+
+
+def create_ground_truth_annotations(cursor, dataset):
+    """
+    Creates the ground truth annotations of the release rows that do not have one, with the ground truth state and
+    from their candidate annotation. Returns the number of ground truth annotations created
+    """
+    cursor.execute("""
+            SELECT release_rows.sound_dataset_id
+                   , release_rows.taxonomy_node_id
+                   , release_rows.partition
+                   , candidateannotation.ground_truth
+              FROM release_rows
+        INNER JOIN datasets_candidateannotation candidateannotation
+                ON candidateannotation.id = release_rows.candidate_annotation_id
+             WHERE release_rows.ground_truth_annotation_id IS NULL
+                   """)
+    ground_truth_annotations = GroundTruthAnnotation.objects.bulk_create([
+        GroundTruthAnnotation(sound_dataset_id=sound_dataset_id, taxonomy_node_id=taxonomy_node_id,
+                              partition=partition, ground_truth=ground_truth)
+        for sound_dataset_id, taxonomy_node_id, partition, ground_truth in cursor.fetchall()])
+    increment_counters_per_taxonomy_node(dataset, [ground_truth_annotation.taxonomy_node_id
+                                                   for ground_truth_annotation in ground_truth_annotations],
+                                         num_ground_truth_annotations=1)
+    cursor.execute("""
+            UPDATE release_rows
+               SET ground_truth_annotation_id = groundtruthannotation.id
+                   , created = true
+              FROM datasets_groundtruthannotation groundtruthannotation
+             WHERE groundtruthannotation.taxonomy_node_id = release_rows.taxonomy_node_id
+               AND groundtruthannotation.sound_dataset_id = release_rows.sound_dataset_id
+               AND release_rows.ground_truth_annotation_id IS NULL;
+
+            INSERT INTO datasets_groundtruthannotation_from_candidate_annotations
+                        (groundtruthannotation_id, candidateannotation_id)
+                 SELECT ground_truth_annotation_id, candidate_annotation_id
+                   FROM release_rows
+                  WHERE created
+                   """)
+    return len(ground_truth_annotations)
+
+
+def update_created_ground_truth_dependents(cursor, dataset):
+    """
+    Does for the created ground truth annotations what GroundTruthAnnotation.save does: counts again the ground truth
+    annotations of their taxonomy nodes, rescores the candidate annotations of their sounds and updates these
+    candidate annotations in the candidate annotation pools
+    """
+    cursor.execute("""
+            SELECT DISTINCT taxonomy_node_id
+              FROM release_rows
+             WHERE created
+                   """)
+    taxonomy_node_ids = [taxonomy_node_id for taxonomy_node_id, in cursor.fetchall()]
+    if not taxonomy_node_ids:
+        return
+    refresh_nb_ground_truth(TaxonomyNode.objects.filter(id__in=taxonomy_node_ids))
+
+    cursor.execute("""
+            SELECT candidateannotation.id
+              FROM datasets_candidateannotation candidateannotation
+             WHERE candidateannotation.sound_dataset_id IN (
+                       SELECT sound_dataset_id
+                         FROM release_rows
+                        WHERE created
+                   )
+                   """)
+    candidate_annotation_ids = [candidate_annotation_id for candidate_annotation_id, in cursor.fetchall()]
+    dataset.compute_priority_scores(candidate_annotation_ids=candidate_annotation_ids)
+    pools = CandidateAnnotationPools(dataset.id)
+    if pools.is_built():
+        pools.update_candidate_annotations(CandidateAnnotation.objects.filter(id__in=candidate_annotation_ids)
+                                           .only('id', 'taxonomy_node_id', 'ground_truth', 'priority_score'))
+
+
+def import_release_annotations(dataset, dataset_release, ground_truth_in_file):
+    """
+    Adds the annotations of the release file to the release with a few set based queries, creating the candidate
+    annotations and ground truth annotations that do not exist and setting the partition of the existing ones.
+    The counters, priority scores and candidate annotation pools are updated as saving them one by one would do.
+    Returns the number of annotations in the release, of existing and created ground truth annotations and of
+    created candidate annotations
+    """
+    with connection.cursor() as cursor:
+        with stage('Copy the annotations to a temporary table'):
+            copy_release_rows(cursor, ground_truth_in_file)
+
+        with stage('Resolve the categories, sounds and annotations'):
+            resolve_release_rows(cursor, dataset)
+
+        with stage('Create the missing candidate annotations'):
+            num_created_candidates = create_candidate_annotations(cursor, dataset)
+
+        with stage('Create the missing ground truth annotations'):
+            num_created_gt = create_ground_truth_annotations(cursor, dataset)
+
+        with stage('Update the ground truth counts, priority scores and candidate pools'):
+            update_created_ground_truth_dependents(cursor, dataset)
+
+        with stage('Update the partitions'):
+            cursor.execute("""
+                    UPDATE datasets_groundtruthannotation groundtruthannotation
+                       SET partition = release_rows.partition
+                      FROM release_rows
+                     WHERE groundtruthannotation.id = release_rows.ground_truth_annotation_id
+                       AND NOT release_rows.created
+                       AND groundtruthannotation.partition IS DISTINCT FROM release_rows.partition
+                           """)
+
+        with stage('Add the annotations to the release'):
+            cursor.execute("""
+                    INSERT INTO datasets_groundtruthannotation_dataset_release
+                                (groundtruthannotation_id, datasetrelease_id)
+                         SELECT ground_truth_annotation_id, %(dataset_release_id)s
+                           FROM release_rows
+                           """, {'dataset_release_id': dataset_release.id})
+            num_annotations = cursor.rowcount
+
+    return num_annotations, num_annotations - num_created_gt, num_created_gt, num_created_candidates
 
 
 class Command(BaseCommand):
     help = '''Create release for FSD. Use it as python manage.py load_dataset_release <release_tag> <annotation file>.
         The annotation file corresponds to a json files containing a list of annotations expressed as a list of
-        category id (audioset id), freesound sound id, partition (dev or eval)'''
+        category id (audioset id), freesound sound id, partition (dev or eval). The annotations are imported in a
+        few set based stages whose timings are printed'''
 
     def add_arguments(self, parser):
         parser.add_argument('release_tag', type=str)
@@ -19,92 +299,62 @@ class Command(BaseCommand):
         input_file = options['input_file']
 
         dataset = Dataset.objects.get(short_name='fsd')
-        dataset_release = DatasetRelease.objects.create(
-            release_tag=release_tag,
-            dataset=dataset,
-        )
 
-        ground_truth_in_file = json.load(open(
-            os.path.join(settings.DATASET_RELEASE_FILES_FOLDER, input_file), 'r'
-        ))
-
-        ground_truth_annotation_ids = []
-        num_existing_gt = 0
-        num_created_gt = 0
-        num_created_candidates = 0
+        with stage('Read the annotation file'):
+            ground_truth_in_file = json.load(open(
+                os.path.join(settings.DATASET_RELEASE_FILES_FOLDER, input_file), 'r'
+            ))
 
         print('\nProcessing annotations...\n')
-        for idx, (node_id, fs_id, partition) in enumerate(ground_truth_in_file):
-            try:
-                gt = GroundTruthAnnotation.objects.get(taxonomy_node__node_id=node_id, sound_dataset__sound__freesound_id=fs_id)
-                gt.partition = partition
-                gt.save()
-                num_existing_gt += 1
-            except ObjectDoesNotExist:
-                taxonomy_node = TaxonomyNode.objects.get(node_id=node_id)
-                sound_dataset = SoundDataset.objects.get(sound__freesound_id=fs_id)
-                candidate, created = CandidateAnnotation.objects.get_or_create(
-                    taxonomy_node__node_id=node_id, sound_dataset__sound__freesound_id=fs_id,
-                    defaults={'ground_truth': 1, 'type': 'MA'},
-                )
-                if created:
-                    num_created_candidates += 1
-                gt = GroundTruthAnnotation.objects.create(
-                    taxonomy_node=taxonomy_node,
-                    sound_dataset=sound_dataset,
-                    partition=partition,
-                    ground_truth=candidate.ground_truth
-                )
-                gt.from_candidate_annotations.add(candidate)
-                gt.save()
-                num_created_gt += 1
-            sys.stdout.write('\r %i of %i' % (idx+1, len(ground_truth_in_file)))
-            sys.stdout.flush()
-            ground_truth_annotation_ids.append(gt.id)
-
-        ground_truth_annotations = GroundTruthAnnotation.objects.filter(id__in=ground_truth_annotation_ids)
-        dataset_release.ground_truth_annotations.add(*ground_truth_annotations)
+        with transaction.atomic():
+            dataset_release = DatasetRelease.objects.create(
+                release_tag=release_tag,
+                dataset=dataset,
+            )
+            num_annotations, num_existing_gt, num_created_gt, num_created_candidates = \
+                import_release_annotations(dataset, dataset_release, ground_truth_in_file)
 
         print('\nNumber of annotations: {} (existing: {}, created: {})\n'.format(
-            len(ground_truth_annotation_ids),
+            num_annotations,
             num_existing_gt,
             num_created_gt
         ))
         print('\nNumber candidate annotations created: {}'.format(num_created_candidates))
 
-        sounds_info = defaultdict(list)
-        for result in ground_truth_annotations.values_list('sound_dataset__sound__freesound_id', 'taxonomy_node__node_id'):
-            sounds_info[result[0]].append(result[1])
-
-        # Calculate stats
-        num_sounds = len(sounds_info)
-        num_taxonomy_nodes = len(set([j for i in list(sounds_info.values()) for j in i]))
-        num_annotations = ground_truth_annotations.count()
-
-        # Make data structure
-        release_data = {
-            'meta': {
-                'dataset': dataset.name,
-                'release': dataset_release.release_tag,
-                'num_sounds': num_sounds,
-                'num_taxonomy_nodes': num_taxonomy_nodes,
-                'num_annotations': num_annotations,
-            },
-            'sounds_info': list(sounds_info.items())
-        }
-
-        # Calculate taxonomy stats (num sounds per taxonomy node). We could avoid a db query here by counting in python
-        taxonomy_node_stats = TaxonomyNode.objects.filter(ground_truth_annotations__dataset_release=dataset_release)\
-            .annotate(num_sounds=Count('ground_truth_annotations',
-                                    filter=Q(ground_truth_annotations__dataset_release=dataset_release)))\
-            .values('name', 'num_sounds', 'node_id')
-        for node in taxonomy_node_stats:
-            node['url_id'] = quote(node['node_id'], safe='')
-
-        dataset_release.release_data = release_data
-        dataset_release.taxonomy_node_stats = list(taxonomy_node_stats)
-        dataset_release.num_annotations = num_annotations
-        dataset_release.num_sounds = num_sounds
-        dataset_release.num_nodes = num_taxonomy_nodes
-        dataset_release.is_processed = True
-        dataset_release.save()
\ No newline at end of file
+        with stage('Write the release index'):
+            num_sounds, num_taxonomy_nodes = dataset_release.write_index()
+
+        with stage('Compute the release stats'):
+            num_annotations = dataset_release.ground_truth_annotations.count()
+
+            # Only the meta data is stored in the row, the sounds are in the index file
+            release_data = {
+                'meta': {
+                    'dataset': dataset.name,
+                    'release': dataset_release.release_tag,
+                    'num_sounds': num_sounds,
+                    'num_taxonomy_nodes': num_taxonomy_nodes,
+                    'num_annotations': num_annotations,
+                },
+            }
+
+            # Calculate taxonomy stats (num sounds per taxonomy node). We could avoid a db query here by counting in
+            # python
+            taxonomy_node_stats = TaxonomyNode.objects\
+                .filter(ground_truth_annotations__dataset_release=dataset_release)\
+                .annotate(num_sounds=Count('ground_truth_annotations',
+                                           filter=Q(ground_truth_annotations__dataset_release=dataset_release)))\
+                .values('name', 'num_sounds', 'node_id')
+            for node in taxonomy_node_stats:
+                node['url_id'] = quote(node['node_id'], safe='')
+
+            dataset_release.release_data = release_data
+            dataset_release.taxonomy_node_stats = list(taxonomy_node_stats)
+            dataset_release.num_annotations = num_annotations
+            dataset_release.num_sounds = num_sounds
+            dataset_release.num_nodes = num_taxonomy_nodes
+            dataset_release.is_processed = True
+            dataset_release.save()
+
+        with stage('Write the release snapshot'):
+            dataset_release.write_snapshot()
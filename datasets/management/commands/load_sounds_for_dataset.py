@@ -1,25 +1,116 @@
-from django.core.management.base import BaseCommand
-from datasets.models import *
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datasets.models import Dataset, Sound, SoundDataset, CandidateAnnotation, CandidateAnnotationPools, \
+    increment_dataset_annotation_counters, invalidate_sound_tag_indexes, get_tag_stems
+from datasets.utils import iter_chunks, iter_json_object_items
+from collections import Counter
+from itertools import chain, islice
+import os
 import sys
 import json
-from datasets.utils import stem
+import time
 
 
-def chunks(l, n):
-    """Yield successive ``n``-sized chunks from ``l``.
-    Examples:
-        >>> chunks([1, 2, 3, 4, 5], 2) #doctest: +ELLIPSIS
-        <generator object chunks at 0x...>
-        >>> list(chunks([1, 2, 3, 4, 5], 2))
-        [[1, 2], [3, 4], [5]]
+def create_sounds(dataset, sounds_data, algorithm_name, taxonomy_node_ids):
     """
-    for i in range(0, len(l), n):
-        yield l[i:i+n]
+    Creates the sounds of a list of (freesound_id, sound_data) pairs together with their SoundDataset and their
+    candidate annotations (with a 0 priority score) using one bulk insert per table, and increments the annotation
+    counters. taxonomy_node_ids maps the node ids of the json file to TaxonomyNode ids.
+    Returns the number of candidate annotations created
+    """
+    stems = get_tag_stems(tag for _, sound_data in sounds_data for tag in sound_data['tags'])
+    sounds = []
+    for freesound_id, sound_data in sounds_data:
+        sound = Sound(
+            name=sound_data['name'][:200],
+            freesound_id=freesound_id,
+            extra_data={
+                'tags': sound_data['tags'],
+                'stemmed_tags': [stems[tag] for tag in sound_data['tags']],
+                'duration': sound_data['duration'],
+                'username': sound_data['username'],
+                'license': sound_data['license'],
+                'description': sound_data['description'],
+                'previews': sound_data['previews'],
+                'analysis': sound_data['analysis'] if 'analysis' in sound_data.keys() else {},
+            }
+        )
+        sound.update_extra_data_columns()
+        sounds.append(sound)
+    sounds = Sound.objects.bulk_create(sounds)
+    sound_datasets = SoundDataset.objects.bulk_create([SoundDataset(dataset=dataset, sound=sound) for sound in sounds])
+
+    candidate_annotations = []
+    for sound_dataset, (_, sound_data) in zip(sound_datasets, sounds_data):
+        for node_id in sound_data['category_ids']:
+            try:
+                taxonomy_node_id = taxonomy_node_ids[node_id]
+            except KeyError:
+                raise CommandError('Taxonomy node {0} does not exist in dataset {1}'.format(node_id, dataset))
+            candidate_annotations.append(CandidateAnnotation(sound_dataset=sound_dataset, type='AU',
+                                                             algorithm=algorithm_name, priority_score=0,
+                                                             taxonomy_node_id=taxonomy_node_id))
+    CandidateAnnotation.objects.bulk_create(candidate_annotations)
+
+    num_annotations_per_node = Counter(candidate_annotation.taxonomy_node_id
+                                       for candidate_annotation in candidate_annotations)
+    for taxonomy_node_id, num_annotations in num_annotations_per_node.items():
+        increment_dataset_annotation_counters(dataset.id, taxonomy_node_id, num_annotations=num_annotations)
+    return len(candidate_annotations)
+
+
+def load_sounds(dataset, sounds_data, algorithm_name, batch_size=5000, since=None, on_batch_loaded=None):
+    """
+    Adds the sounds of an iterable of (freesound_id, sound_data) pairs to the dataset, committing them in batches of
+    batch_size sounds. on_batch_loaded(num_sounds, num_candidate_annotations) is called after each batch with the
+    running totals. Once all are loaded, the priority scores of the candidate annotations created after since
+    (by default when the function is called) are computed in a single update and the candidate annotation pools and
+    sound tag indexes are refreshed, which the signals would do if the objects were saved one by one.
+    Returns the number of sounds and of candidate annotations created
+    """
+    since = since or timezone.now()
+    taxonomy_node_ids = dict(dataset.taxonomy.taxonomynode_set.values_list('node_id', 'id'))
+
+    num_sounds = 0
+    num_candidate_annotations = 0
+    for batch in iter_chunks(sounds_data, batch_size):
+        with transaction.atomic():
+            num_candidate_annotations += create_sounds(dataset, batch, algorithm_name, taxonomy_node_ids)
+        num_sounds += len(batch)
+        if on_batch_loaded is not None:
+            on_batch_loaded(num_sounds, num_candidate_annotations)
+
+    dataset.compute_priority_scores(since=since)
+    pools = CandidateAnnotationPools(dataset.id)
+    if pools.is_built():
+        pools.update_candidate_annotations(dataset.candidate_annotations.filter(created_at__gt=since)
+                                           .only('id', 'taxonomy_node_id', 'ground_truth', 'priority_score')
+                                           .iterator())
+    invalidate_sound_tag_indexes([dataset.id])
+    return num_sounds, num_candidate_annotations
+
+
+def skip_sounds_in_dataset(dataset, sounds_data, num_sounds):
+    """
+    Drops the sounds that are already in the dataset from the next num_sounds (freesound_id, sound_data) pairs.
+    Returns the remaining pairs and the number of sounds dropped
+    """
+    sounds_data = iter(sounds_data)
+    next_sounds_data = list(islice(sounds_data, num_sounds))
+    freesound_ids = set(dataset.sounds.filter(freesound_id__in=[int(freesound_id) for freesound_id, _
+                                                                in next_sounds_data])
+                        .values_list('freesound_id', flat=True))
+    new_sounds_data = [(freesound_id, sound_data) for freesound_id, sound_data in next_sounds_data
+                       if int(freesound_id) not in freesound_ids]
+    return chain(new_sounds_data, sounds_data), len(next_sounds_data) - len(new_sounds_data)
 
 
 class Command(BaseCommand):
-    help = 'Populates a dataset with information given in a json file. ' \
+    help = 'Populates a dataset with information given in a json file. The file is parsed incrementally and the ' \
+           'sounds are inserted in batches, each batch is committed and recorded in a checkpoint file so that an ' \
+           'interrupted load can be resumed by running the same command again. ' \
            'Use like python manage.py load_sounds_for_dataset short_ds_name filepath.json algorithm_name'
 
     def add_arguments(self, parser):
@@ -27,48 +118,67 @@ class Command(BaseCommand):
         parser.add_argument('filepath', type=str)
         parser.add_argument('algorithm_name', type=str)
 
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=5000,
+            help='Number of sounds inserted and committed together')
+
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            dest='checkpoint',
+            default=None,
+            help='File where the progress is saved, filepath.checkpoint by default')
+
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            dest='restart',
+            default=False,
+            help='Ignore an existing checkpoint and load the file from the start')
+
     def handle(self, *args, **options):
         file_location = options['filepath']
-        dataset_short_name = options['dataset_short_name']
-        algorithm_name = options['algorithm_name']
-        dataset = Dataset.objects.get(short_name=dataset_short_name)
-        print('Loading data...')
-        data = json.load(open(file_location))
-
-        count = 0
-        # Iterate all the sounds in chunks so we can do all transactions of a chunk atomically
-        for chunk in chunks(list(data.keys()), 5000):
-            with transaction.atomic():
-                for sound_id in chunk:
-                    sound_data = data[sound_id]
-                    count += 1
-                    sys.stdout.write('\rCreating sound %i of %i (%.2f%%)'
-                                     % (count + 1, len(data), 100.0 * (count + 1) / len(data)))
-                    sys.stdout.flush()
-                    sound = Sound.objects.create(
-                        name=sound_data['name'][:200],
-                        freesound_id=sound_id,
-                        extra_data={
-                            'tags': sound_data['tags'],
-                            'stemmed_tags': [stem(tag) for tag in sound_data['tags']],
-                            'duration': sound_data['duration'],
-                            'username': sound_data['username'],
-                            'license': sound_data['license'],
-                            'description': sound_data['description'],
-                            'previews': sound_data['previews'],
-                            'analysis': sound_data['analysis'] if 'analysis' in sound_data.keys() else {},
-                        }
-                    )
-                    sound_dataset = SoundDataset.objects.create(
-                        dataset=dataset,
-                        sound=sound
-                    )
-
-                    for node_id in sound_data['category_ids']:
-                        c = CandidateAnnotation.objects.create(
-                            sound_dataset=sound_dataset,
-                            type='AU',
-                            algorithm=algorithm_name,
-                            taxonomy_node=TaxonomyNode.objects.get(node_id=node_id)
-                        )
-                        c.update_priority_score()
+        dataset = Dataset.objects.get(short_name=options['dataset_short_name'])
+        checkpoint_location = options['checkpoint'] or file_location + '.checkpoint'
+
+        checkpoint = {'num_sounds': 0, 'num_candidate_annotations': 0, 'started_at': timezone.now().isoformat()}
+        if os.path.exists(checkpoint_location) and not options['restart']:
+            checkpoint = json.load(open(checkpoint_location))
+            print('Resuming from checkpoint, {0} sounds already loaded'.format(checkpoint['num_sounds']))
+        num_loaded_sounds = checkpoint['num_sounds']
+        num_loaded_candidate_annotations = checkpoint['num_candidate_annotations']
+        start = time.time()
+
+        def on_batch_loaded(num_sounds, num_candidate_annotations):
+            checkpoint['num_sounds'] = num_loaded_sounds + num_sounds
+            checkpoint['num_candidate_annotations'] = num_loaded_candidate_annotations + num_candidate_annotations
+            with open(checkpoint_location + '.tmp', 'w') as f:
+                json.dump(checkpoint, f)
+            os.replace(checkpoint_location + '.tmp', checkpoint_location)
+            sys.stdout.write('\rLoaded {0} sounds and {1} candidate annotations ({2:.0f} sounds/s)'
+                             .format(checkpoint['num_sounds'], checkpoint['num_candidate_annotations'],
+                                     num_sounds / (time.time() - start)))
+            sys.stdout.flush()
+
+        with open(file_location) as f:
+            sounds_data = iter_json_object_items(f)
+            for _ in range(num_loaded_sounds):
+                next(sounds_data, None)
+            if num_loaded_sounds:
+                # the batch after the checkpoint may have been committed right before the load stopped
+                sounds_data, num_skipped_sounds = skip_sounds_in_dataset(dataset, sounds_data,
+                                                                         options['batch_size'])
+                num_loaded_sounds += num_skipped_sounds
+            num_sounds, num_candidate_annotations = load_sounds(
+                dataset, sounds_data, options['algorithm_name'], batch_size=options['batch_size'],
+                since=parse_datetime(checkpoint['started_at']), on_batch_loaded=on_batch_loaded)
+
+        elapsed_time = time.time() - start
+        print('\nCreated {0} sounds and {1} candidate annotations in {2:.1f} seconds ({3:.0f} rows/s)'
+              .format(num_sounds, num_candidate_annotations, elapsed_time,
+                      (2 * num_sounds + num_candidate_annotations) / elapsed_time if elapsed_time else 0))
+        if os.path.exists(checkpoint_location):
+            os.remove(checkpoint_location)
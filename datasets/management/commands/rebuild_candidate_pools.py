@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from datasets.models import Dataset, CandidateAnnotationPools
+from datasets.tasks import rebuild_candidate_pools
+
+
+class Command(BaseCommand):
+    help = 'Fill the redis pools of candidate annotations to validate of a dataset from the database. Once they ' \
+           'are built the validation task is served from them and they are updated on each vote. ' \
+           'Usage: python manage.py rebuild_candidate_pools fsd [--delete]'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_short_name', type=str)
+
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            dest='delete',
+            default=False,
+            help='Delete the pools instead, the validation task then queries the database')
+
+    def handle(self, *args, **options):
+        dataset = Dataset.objects.get(short_name=options['dataset_short_name'])
+        if options['delete']:
+            CandidateAnnotationPools(dataset.id).delete()
+            print('Candidate annotation pools deleted')
+        else:
+            num_candidate_annotations = rebuild_candidate_pools(dataset.id)
+            print('{0} candidate annotations added to the pools'.format(num_candidate_annotations))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from datasets.models import Dataset, AnnotationCounter
+
+
+class Command(BaseCommand):
+    help = 'Count from scratch the annotations, votes and ground truth annotations of each taxonomy node of a ' \
+           'dataset and fix the AnnotationCounter rows that drifted. Run it after migrating and after bulk ' \
+           'operations that skip the counters. Usage: python manage.py reconcile_annotation_counters fsd'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_short_name', type=str)
+
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Only print the counters that drifted')
+
+    def handle(self, *args, **options):
+        dataset = Dataset.objects.get(short_name=options['dataset_short_name'])
+
+        with transaction.atomic():
+            expected_counters = dataset.compute_annotation_counters()
+            counters = {counter.taxonomy_node_id: counter
+                        for counter in dataset.annotation_counters.select_for_update()}
+
+            num_fixed = 0
+            for taxonomy_node_id in set(expected_counters) | set(counters):
+                expected = expected_counters.get(taxonomy_node_id,
+                                                 dict.fromkeys(AnnotationCounter.COUNTER_FIELDS, 0))
+                counter = counters.get(taxonomy_node_id, AnnotationCounter(dataset=dataset,
+                                                                           taxonomy_node_id=taxonomy_node_id))
+                drift = {field: getattr(counter, field) - value for field, value in expected.items()
+                         if getattr(counter, field) != value}
+                if not drift:
+                    continue
+
+                print('Node {0}: {1}'.format(taxonomy_node_id, ', '.join('{0} off by {1}'.format(field, value)
+                                                                         for field, value in drift.items())))
+                num_fixed += 1
+                if not options['dry_run']:
+                    for field, value in expected.items():
+                        setattr(counter, field, value)
+                    counter.save()
+
+        print('{0} counters {1}'.format(num_fixed, 'drifted' if options['dry_run'] else 'fixed'))
@@ -3,10 +3,17 @@ from datasets.tasks import stem_dataset_sound_tags
 
 
 class Command(BaseCommand):
-    help = 'Apply Porter Stemming to all sound tags and add it to extra_data.stemmed_tags'
+    help = 'Apply Porter Stemming to all sound tags and add it to extra_data.stemmed_tags. Only the sounds whose ' \
+           'stemmed tags are not up to date are written. Usage: python manage.py stem_dataset_sound_tags'
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            dest='chunk_size',
+            default=1000,
+            help='Number of sounds processed in each transaction')
 
     def handle(self, *args, **options):
-        stem_dataset_sound_tags()
+        num_updated = stem_dataset_sound_tags(chunk_size=options['chunk_size'])
+        print('{0} sounds updated'.format(num_updated))
@@ -30,4 +30,5 @@ class Command(BaseCommand):
         taxonomy = Taxonomy.objects.get(id=taxonomy_id)
         taxonomy.data = prepared_data
         taxonomy.save()
+        taxonomy.rebuild_ancestry_closure()
 
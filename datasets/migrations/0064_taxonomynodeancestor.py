@@ -0,0 +1,67 @@
+# Generated by Django 2.2.24 on 2026-10-18 08:48
+
+import collections
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def ancestry_closure(edges):
+    # Copy of datasets.models.ancestry_closure at the time of this migration
+    parents = collections.defaultdict(list)
+    for child, parent in edges:
+        parents[child].append(parent)
+
+    closure = dict()
+    for descendant in list(parents):
+        depths = {descendant: 0}
+        frontier = [descendant]
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                for parent in parents.get(node, []):
+                    if parent not in depths:
+                        depths[parent] = depths[node] + 1
+                        next_frontier.append(parent)
+            frontier = next_frontier
+        del depths[descendant]
+        for ancestor, depth in depths.items():
+            closure[(descendant, ancestor)] = depth
+    return closure
+
+
+def build_taxonomy_ancestry_closure(apps, schema_editor):
+    TaxonomyNode = apps.get_model('datasets', 'TaxonomyNode')
+    TaxonomyNodeAncestor = apps.get_model('datasets', 'TaxonomyNodeAncestor')
+
+    for relation, through in (('P', TaxonomyNode.parents.through),
+                              ('PP', TaxonomyNode.propagate_to_parents.through)):
+        edges = through.objects.values_list('from_taxonomynode_id', 'to_taxonomynode_id')
+        TaxonomyNodeAncestor.objects.bulk_create([
+            TaxonomyNodeAncestor(descendant_id=descendant_id, ancestor_id=ancestor_id, relation=relation, depth=depth)
+            for (descendant_id, ancestor_id), depth in ancestry_closure(edges).items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0063_auto_20200724_1544'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxonomyNodeAncestor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('relation', models.CharField(choices=[('P', 'Parents'), ('PP', 'Propagate to parents')], max_length=2)),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='datasets.TaxonomyNode')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='datasets.TaxonomyNode')),
+            ],
+            options={
+                'unique_together': {('descendant', 'relation', 'ancestor')},
+                'index_together': {('ancestor', 'relation')},
+            },
+        ),
+        migrations.RunPython(build_taxonomy_ancestry_closure, migrations.RunPython.noop)
+    ]
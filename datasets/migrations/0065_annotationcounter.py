@@ -0,0 +1,59 @@
+# Generated by Django 2.2.24 on 2026-10-18 09:26
+
+import collections
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def fill_annotation_counters(apps, schema_editor):
+    CandidateAnnotation = apps.get_model('datasets', 'CandidateAnnotation')
+    GroundTruthAnnotation = apps.get_model('datasets', 'GroundTruthAnnotation')
+    AnnotationCounter = apps.get_model('datasets', 'AnnotationCounter')
+
+    counters = collections.defaultdict(dict)
+    candidate_annotation_counts = CandidateAnnotation.objects.filter(taxonomy_node__isnull=False)\
+        .values('sound_dataset__dataset_id', 'taxonomy_node_id')\
+        .annotate(num_annotations=Count('id', distinct=True),
+                  num_validated_annotations=Count('id', distinct=True, filter=Q(votes__isnull=False)),
+                  num_verified_annotations=Count('id', distinct=True, filter=Q(ground_truth__isnull=False)),
+                  num_user_contributions=Count('votes'))
+    ground_truth_annotation_counts = GroundTruthAnnotation.objects.filter(taxonomy_node__isnull=False)\
+        .values('sound_dataset__dataset_id', 'taxonomy_node_id')\
+        .annotate(num_ground_truth_annotations=Count('id'),
+                  num_propagated_ground_truth_annotations=Count('id', filter=Q(from_propagation=True)))
+    for counts in list(candidate_annotation_counts) + list(ground_truth_annotation_counts):
+        counters[(counts.pop('sound_dataset__dataset_id'), counts.pop('taxonomy_node_id'))].update(counts)
+
+    AnnotationCounter.objects.bulk_create([
+        AnnotationCounter(dataset_id=dataset_id, taxonomy_node_id=taxonomy_node_id, **counts)
+        for (dataset_id, taxonomy_node_id), counts in counters.items() if dataset_id is not None
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0064_taxonomynodeancestor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_annotations', models.IntegerField(default=0)),
+                ('num_validated_annotations', models.IntegerField(default=0)),
+                ('num_verified_annotations', models.IntegerField(default=0)),
+                ('num_ground_truth_annotations', models.IntegerField(default=0)),
+                ('num_propagated_ground_truth_annotations', models.IntegerField(default=0)),
+                ('num_user_contributions', models.IntegerField(default=0)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_counters', to='datasets.Dataset')),
+                ('taxonomy_node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_counters', to='datasets.TaxonomyNode')),
+            ],
+            options={
+                'unique_together': {('dataset', 'taxonomy_node')},
+            },
+        ),
+        migrations.RunPython(fill_annotation_counters, migrations.RunPython.noop)
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.24 on 2026-10-18 10:04
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef
+
+
+def fill_num_open_annotations(apps, schema_editor):
+    CandidateAnnotation = apps.get_model('datasets', 'CandidateAnnotation')
+    TaxonomyNode = apps.get_model('datasets', 'TaxonomyNode')
+    AnnotationCounter = apps.get_model('datasets', 'AnnotationCounter')
+
+    # Same selection as filter_open_candidate_annotations
+    examples = TaxonomyNode.freesound_examples.through.objects.filter(
+        taxonomynode_id=OuterRef('taxonomy_node_id'), sound_id=OuterRef('sound_dataset__sound_id'))
+    verification_examples = TaxonomyNode.freesound_examples_verification.through.objects.filter(
+        taxonomynode_id=OuterRef('taxonomy_node_id'), sound_id=OuterRef('sound_dataset__sound_id'))
+    open_annotation_counts = CandidateAnnotation.objects\
+        .filter(taxonomy_node__isnull=False, ground_truth=None, priority_score__gt=0,
+                sound_dataset__sound__deleted_in_freesound=False)\
+        .annotate(is_example=Exists(examples), is_verification_example=Exists(verification_examples))\
+        .filter(is_example=False, is_verification_example=False)\
+        .values_list('sound_dataset__dataset_id', 'taxonomy_node_id')\
+        .annotate(num=Count('id'))
+
+    for dataset_id, taxonomy_node_id, num_open_annotations in open_annotation_counts:
+        if not AnnotationCounter.objects.filter(dataset_id=dataset_id, taxonomy_node_id=taxonomy_node_id)\
+                                        .update(num_open_annotations=num_open_annotations):
+            AnnotationCounter.objects.create(dataset_id=dataset_id, taxonomy_node_id=taxonomy_node_id,
+                                             num_open_annotations=num_open_annotations)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0065_annotationcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotationcounter',
+            name='num_open_annotations',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_num_open_annotations, migrations.RunPython.noop)
+    ]
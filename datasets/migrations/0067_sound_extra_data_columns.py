@@ -0,0 +1,35 @@
+# Generated by Django 2.2.24 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0066_annotationcounter_num_open_annotations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sound',
+            name='duration',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sound',
+            name='license',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='sound',
+            name='preview_url',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.RunSQL("""
+            UPDATE datasets_sound
+               SET duration = CASE WHEN jsonb_typeof(extra_data -> 'duration') = 'number'
+                                   THEN (extra_data ->> 'duration')::float END
+                   , license = extra_data ->> 'license'
+                   , preview_url = extra_data ->> 'previews'
+            """, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.24 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0067_sound_extra_data_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagStem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.TextField(unique=True)),
+                ('stem', models.TextField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+import os
+import gzip
+import json
+from django.conf import settings
+from django.db import migrations
+
+
+def index_file_path(release):
+    return os.path.join(settings.DATASET_RELEASE_FILES_FOLDER, '{0}.jsonl.gz'.format(release.id))
+
+
+def move_sounds_info_to_index_files(apps, schema_editor):
+    DatasetRelease = apps.get_model('datasets', 'DatasetRelease')
+    for release in DatasetRelease.objects.iterator():
+        sounds_info = release.release_data.pop('sounds_info', None)
+        if sounds_info is None:
+            continue
+        with gzip.open(index_file_path(release), 'wt') as f:
+            for freesound_id, node_ids in sounds_info:
+                f.write(json.dumps([freesound_id, node_ids]) + '\n')
+        release.save(update_fields=['release_data'])
+
+
+def move_index_files_to_sounds_info(apps, schema_editor):
+    DatasetRelease = apps.get_model('datasets', 'DatasetRelease')
+    for release in DatasetRelease.objects.iterator():
+        try:
+            with gzip.open(index_file_path(release), 'rt') as f:
+                release.release_data['sounds_info'] = [json.loads(line) for line in f]
+        except FileNotFoundError:
+            continue
+        release.save(update_fields=['release_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0068_tagstem'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_sounds_info_to_index_files, move_index_files_to_sounds_info),
+    ]
@@ -1,12 +1,23 @@
 from __future__ import unicode_literals
 
+import array
 import collections
-from django.db import models, transaction
-from django.db.models import Count, Q
+import itertools
+import gzip
+import json
+import mmap
+import struct
+import sys
+import time
+import zlib
+from django.db import models, transaction, connection
+from django.db.models import Count, Q, F, Sum, Subquery, Exists, OuterRef
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 from django.contrib.postgres.fields import JSONField
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_init, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 import os
 import markdown
@@ -17,6 +28,234 @@ from django.core.validators import RegexValidator
 from django.core.exceptions import ObjectDoesNotExist
 from urllib.parse import quote
 from functools import reduce
+from utils.redis_store import store, TAXONOMY_VERSION_KEY_TEMPLATE, CANDIDATE_POOLS_GENERATION_KEY_TEMPLATE, \
+    CANDIDATE_POOLS_VERSION_KEY_TEMPLATE, CANDIDATE_POOL_KEY_TEMPLATE, VOTED_CANDIDATES_KEY_TEMPLATE, \
+    SOUND_TAG_INDEX_VERSION_KEY_TEMPLATE
+from datasets.utils import chunks, stem_words
+
+
+def ancestry_closure(edges):
+    """
+        Given (child, parent) edges of a graph, returns {(descendant, ancestor): depth} for every ancestor reachable
+        from each node, where depth is the length of the shortest path (1 for a direct parent)
+    """
+    parents = collections.defaultdict(list)
+    for child, parent in edges:
+        parents[child].append(parent)
+
+    closure = dict()
+    for descendant in list(parents):
+        depths = {descendant: 0}
+        frontier = [descendant]
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                for parent in parents.get(node, []):
+                    if parent not in depths:
+                        depths[parent] = depths[node] + 1
+                        next_frontier.append(parent)
+            frontier = next_frontier
+        del depths[descendant]
+        for ancestor, depth in depths.items():
+            closure[(descendant, ancestor)] = depth
+    return closure
+
+
+def id_array(ids):
+    """
+        Right hand side of an id__in filter that sends the ids as a single array parameter instead of a literal list
+    """
+    return RawSQL('SELECT UNNEST(%s::integer[])', (sorted(ids),))
+
+
+class TaxonomyGraph(object):
+    """
+        Read-only in-memory snapshot of the nodes of a taxonomy and of their parents and propagate_to_parents
+        relations. Use get_taxonomy_graph() to get the one shared by the process, it is loaded again once the
+        taxonomy version stored in Redis is incremented by invalidate_taxonomy_graph().
+        Counters updated by the annotation workflow (VOLATILE_FIELDS) are not part of the snapshot: they are left
+        deferred in the node instances so that they are fetched from the database when accessed.
+    """
+    VOLATILE_FIELDS = ('nb_ground_truth',)
+
+    def __init__(self, taxonomy_id):
+        self.taxonomy_id = taxonomy_id
+        self._field_names = taxonomy_graph_field_names()
+        node_id_index = self._field_names.index('node_id')
+
+        rows = TaxonomyNode.objects.filter(taxonomy_id=taxonomy_id).values_list(*self._field_names)
+        self._nodes = {row[node_id_index]: row for row in rows}
+        self._node_ids_by_name = {row[self._field_names.index('name')]: node_id for node_id, row in self._nodes.items()}
+        node_ids_by_pk = {row[self._field_names.index('id')]: node_id for node_id, row in self._nodes.items()}
+
+        def edges(through):
+            pks = through.objects.filter(from_taxonomynode__taxonomy_id=taxonomy_id)\
+                                 .order_by('id')\
+                                 .values_list('from_taxonomynode_id', 'to_taxonomynode_id')
+            return [(node_ids_by_pk[child], node_ids_by_pk[parent]) for child, parent in pks
+                    if child in node_ids_by_pk and parent in node_ids_by_pk]
+
+        def closure(edges):
+            ancestors = collections.defaultdict(list)
+            descendants = collections.defaultdict(list)
+            for (descendant, ancestor), depth in sorted(ancestry_closure(edges).items(), key=lambda x: x[1]):
+                ancestors[descendant].append(ancestor)
+                descendants[ancestor].append(descendant)
+            return ({node_id: tuple(ids) for node_id, ids in ancestors.items()},
+                    {node_id: tuple(ids) for node_id, ids in descendants.items()})
+
+        parent_edges = edges(TaxonomyNode.parents.through)
+        propagate_edges = edges(TaxonomyNode.propagate_to_parents.through)
+        self._parents = self._adjacency(parent_edges)
+        self._children = self._adjacency([(parent, child) for child, parent in parent_edges])
+        self._propagate_to_parents = self._adjacency(propagate_edges)
+        self._propagate_from_children = self._adjacency([(parent, child) for child, parent in propagate_edges])
+        self._all_parents, self._all_children = closure(parent_edges)
+        self._all_propagate_to_parents, self._all_propagate_from_children = closure(propagate_edges)
+        self._hierarchy_paths = {node_id: self._compute_hierarchy_paths(node_id) for node_id in self._nodes}
+
+    @staticmethod
+    def _adjacency(edges):
+        adjacency = collections.defaultdict(list)
+        for source, target in edges:
+            adjacency[source].append(target)
+        return {node_id: tuple(ids) for node_id, ids in adjacency.items()}
+
+    def _compute_hierarchy_paths(self, node_id):
+        def paths(node_id, cur=tuple()):
+            parent_ids = self._parents.get(node_id, ())
+            if not parent_ids:
+                yield cur
+            else:
+                for parent_id in parent_ids:
+                    for path in paths(parent_id, (parent_id,) + cur):
+                        yield path
+
+        # Add root and current category to path
+        return tuple(path + (node_id,) for path in paths(node_id))
+
+    def _check_node_id(self, node_id):
+        if node_id not in self._nodes:
+            raise TaxonomyNode.DoesNotExist('No taxonomy node with node_id {0} in taxonomy {1}'
+                                            .format(node_id, self.taxonomy_id))
+
+    def node(self, node_id):
+        """ Returns a new TaxonomyNode instance for the node id, as if it had been fetched from the database """
+        self._check_node_id(node_id)
+        return TaxonomyNode.from_db(TaxonomyNode.objects.db, self._field_names, self._nodes[node_id])
+
+    def nodes(self, node_ids):
+        return [self.node(node_id) for node_id in node_ids]
+
+    def node_from_name(self, name):
+        if name not in self._node_ids_by_name:
+            raise TaxonomyNode.DoesNotExist('No taxonomy node with name {0} in taxonomy {1}'
+                                            .format(name, self.taxonomy_id))
+        return self.node(self._node_ids_by_name[name])
+
+    def node_ids(self):
+        return list(self._nodes)
+
+    def num_nodes(self):
+        return len(self._nodes)
+
+    def parent_ids(self, node_id):
+        self._check_node_id(node_id)
+        return list(self._parents.get(node_id, ()))
+
+    def child_ids(self, node_id):
+        self._check_node_id(node_id)
+        return list(self._children.get(node_id, ()))
+
+    def sibling_ids(self, node_id, parent_ids=None):
+        if parent_ids is None:
+            parent_ids = self.parent_ids(node_id)
+        sibling_ids = []
+        for parent_id in parent_ids:
+            for child_id in self._children.get(parent_id, ()):
+                if child_id != node_id and child_id not in sibling_ids:
+                    sibling_ids.append(child_id)
+        return sibling_ids
+
+    def propagate_to_parent_ids(self, node_id):
+        self._check_node_id(node_id)
+        return list(self._propagate_to_parents.get(node_id, ()))
+
+    def propagate_from_children_ids(self, node_id):
+        self._check_node_id(node_id)
+        return list(self._propagate_from_children.get(node_id, ()))
+
+    def all_parent_ids(self, node_id):
+        """ Ancestors of the node, closest first """
+        self._check_node_id(node_id)
+        return list(self._all_parents.get(node_id, ()))
+
+    def all_children_ids(self, node_id):
+        """ Descendants of the node, closest first """
+        self._check_node_id(node_id)
+        return list(self._all_children.get(node_id, ()))
+
+    def all_propagate_to_parent_ids(self, node_id):
+        self._check_node_id(node_id)
+        return list(self._all_propagate_to_parents.get(node_id, ()))
+
+    def all_propagate_from_children_ids(self, node_id):
+        self._check_node_id(node_id)
+        return list(self._all_propagate_from_children.get(node_id, ()))
+
+    def root_ids(self):
+        return [node_id for node_id in self._nodes if not self._parents.get(node_id)]
+
+    def hierarchy_paths(self, node_id):
+        self._check_node_id(node_id)
+        return [list(path) for path in self._hierarchy_paths[node_id]]
+
+
+def taxonomy_graph_field_names():
+    """ Attribute names of the TaxonomyNode fields kept in the TaxonomyGraph """
+    return tuple(field.attname for field in TaxonomyNode._meta.concrete_fields
+                 if field.attname not in TaxonomyGraph.VOLATILE_FIELDS)
+
+
+# {taxonomy_id: (version, time of the last version check, TaxonomyGraph)}, shared by the threads of the process
+_taxonomy_graphs = dict()
+TAXONOMY_GRAPH_VERSION_CHECK_INTERVAL = 1  # seconds
+
+
+def get_taxonomy_graph(taxonomy_id):
+    """
+        Returns the TaxonomyGraph of the taxonomy, loading it only if the taxonomy version stored in Redis
+        is not the one of the graph loaded by this process. The version is checked at most once every
+        TAXONOMY_GRAPH_VERSION_CHECK_INTERVAL seconds
+    """
+    now = time.monotonic()
+    cached = _taxonomy_graphs.get(taxonomy_id)
+    if cached is not None and now - cached[1] < TAXONOMY_GRAPH_VERSION_CHECK_INTERVAL:
+        return cached[2]
+    version = store.get_version(TAXONOMY_VERSION_KEY_TEMPLATE.format(taxonomy_id))
+    if cached is None or cached[0] != version:
+        cached = (version, now, TaxonomyGraph(taxonomy_id))
+    else:
+        cached = (version, now, cached[2])
+    _taxonomy_graphs[taxonomy_id] = cached
+    return cached[2]
+
+
+def invalidate_taxonomy_graph(taxonomy_id):
+    """
+        Increments the taxonomy version so that every process loads its graph again. The version is incremented
+        again when the current transaction commits so that no process keeps a graph loaded before the commit.
+        The graph of this process is dropped right away so that it does not wait for the next version check
+    """
+    key = TAXONOMY_VERSION_KEY_TEMPLATE.format(taxonomy_id)
+
+    def increment_version():
+        store.increment_version(key)
+        _taxonomy_graphs.pop(taxonomy_id, None)
+
+    increment_version()
+    if connection.in_atomic_block:
+        transaction.on_commit(increment_version)
 
 
 class Taxonomy(models.Model):
@@ -26,121 +265,83 @@ class Taxonomy(models.Model):
     def taxonomy(self):
         return self.data
 
+    @property
+    def graph(self):
+        return get_taxonomy_graph(self.id)
+
     def get_parents(self, node_id):
-        return self.get_element_at_id(node_id).parents.all()
+        return self.taxonomynode_set.filter(node_id__in=self.graph.parent_ids(node_id))
 
     def get_propagate_to_parents(self, node_id):
-        return self.get_element_at_id(node_id).propagate_to_parents.all()
+        return self.taxonomynode_set.filter(node_id__in=self.graph.propagate_to_parent_ids(node_id))
 
     def get_children(self, node_id):
-        return self.get_element_at_id(node_id).children.all()
+        return self.taxonomynode_set.filter(node_id__in=self.graph.child_ids(node_id))
 
     def get_propagate_from_children(self, node_id):
-        return self.get_element_at_id(node_id).propagate_from.all()
+        return self.taxonomynode_set.filter(node_id__in=self.graph.propagate_from_children_ids(node_id))
 
     def get_element_at_id(self, node_id):
-        return self.taxonomynode_set.get(node_id=node_id)
+        return self.graph.node(node_id)
 
     def get_element_from_name(self, name):
-        return self.taxonomynode_set.get(name=name)
+        return self.graph.node_from_name(name)
 
     def get_all_nodes(self):
-        return self.taxonomynode_set.all().order_by('name')
+        return sorted(self.graph.nodes(self.graph.node_ids()), key=lambda node: node.name)
 
     def get_all_node_ids(self):
-        return [node.node_id for node in self.taxonomynode_set.all()]
+        return self.graph.node_ids()
 
     def get_num_nodes(self):
-        return self.taxonomynode_set.count()
+        return self.graph.num_nodes()
 
     def get_hierarchy_paths(self, node_id):
-
-        def paths(node_id, cur=list()):
-            parents = self.get_parents(node_id)
-            if not parents:
-                yield cur
-            else:
-                for node in parents:
-                    for path in paths(node.node_id, [node.node_id] + cur):
-                        yield path
-
-        hierarchy_paths = list()
-        for path in paths(node_id):
-            # Add root and current category to path
-            hierarchy_paths.append(path + [self.get_element_at_id(node_id).node_id])
-
-        return hierarchy_paths
+        return self.graph.hierarchy_paths(node_id)
 
     def get_all_children(self, node_id):
         """
             Returns a list of all the children of the given node id
         """
-        node = self.taxonomynode_set.get(node_id=node_id)
-        return self.taxonomynode_set.filter(Q(parents=node) |
-                                            Q(parents__parents=node) |
-                                            Q(parents__parents__parents=node) |
-                                            Q(parents__parents__parents__parents=node) |
-                                            Q(parents__parents__parents__parents__parents=node) |
-                                            Q(parents__parents__parents__parents__parents__parents=node) |
-                                            Q(parents__parents__parents__parents__parents__parents__parents=node)
-                                            ).distinct()
+        return self.taxonomynode_set.filter(ancestor_links__ancestor__node_id=node_id,
+                                            ancestor_links__relation=TaxonomyNodeAncestor.PARENTS)
 
     def get_all_propagate_from_children(self, node_id):
         """
             Returns a list of all the children of the given node id that propagate to the parent
         """
-        def get_propagate_from_children(node_id, cur=list()):
-            children = self.get_propagate_from_children(node_id)
-            if not children:
-                yield cur
-            else:
-                for node in children:
-                    for child in get_propagate_from_children(node.node_id, [node] + cur):
-                        yield child
-        children_list = list(self.get_propagate_from_children(node_id))
-        for children in get_propagate_from_children(node_id):
-            for child in children:
-                if child.node_id not in [n.node_id for n in children_list]:
-                    children_list.append(child)
-
-        return children_list
+        return self.graph.nodes(self.graph.all_propagate_from_children_ids(node_id))
 
     def get_all_parents(self, node_id):
         """
-            Returns a list of all the children of the given node id
+            Returns a list of all the parents of the given node id
         """
-        node = self.taxonomynode_set.get(node_id=node_id)
-        return self.taxonomynode_set.filter(Q(children=node) |
-                                            Q(children__children=node) |
-                                            Q(children__children__children=node) |
-                                            Q(children__children__children__children=node) |
-                                            Q(children__children__children__children__children=node) |
-                                            Q(children__children__children__children__children__children=node) |
-                                            Q(children__children__children__children__children__children__children=node)
-                                            ).distinct()
+        return self.taxonomynode_set.filter(descendant_links__descendant__node_id=node_id,
+                                            descendant_links__relation=TaxonomyNodeAncestor.PARENTS)
 
     def get_all_propagate_to_parents(self, node_id):
         """
-            Returns a list of all the children of the given node id
+            Returns a list of all the parents of the given node id to which annotations are propagated
         """
-        def get_propagate_to_parents(node_id, cur=list()):
-            parents = self.get_propagate_to_parents(node_id)
-            if not parents:
-                yield cur
-            else:
-                for node in parents:
-                    for parent in get_propagate_to_parents(node.node_id, [node] + cur):
-                        yield parent
-
-        parents_list = list(self.get_propagate_to_parents(node_id))
-        # this double for loop is for checking if a parent is already in the list
-        # in this case, we do not append it to the list
-        for parents in get_propagate_to_parents(node_id):
-            for parent in parents:
-                if parent.node_id not in [n.node_id for n in parents_list]:
-                    parents_list.append(parent)
+        return self.graph.nodes(self.graph.all_propagate_to_parent_ids(node_id))
 
-        return parents_list
+    @transaction.atomic
+    def rebuild_ancestry_closure(self):
+        """
+            Recomputes the TaxonomyNodeAncestor rows of the taxonomy from its parents and propagate_to_parents
+            relations. Must be called every time these relations change.
+        """
+        TaxonomyNodeAncestor.objects.filter(descendant__taxonomy=self).delete()
+        for relation, through in ((TaxonomyNodeAncestor.PARENTS, TaxonomyNode.parents.through),
+                                  (TaxonomyNodeAncestor.PROPAGATE_TO_PARENTS, TaxonomyNode.propagate_to_parents.through)):
+            edges = through.objects.filter(from_taxonomynode__taxonomy=self)\
+                                   .values_list('from_taxonomynode_id', 'to_taxonomynode_id')
+            TaxonomyNodeAncestor.objects.bulk_create([
+                TaxonomyNodeAncestor(descendant_id=descendant_id, ancestor_id=ancestor_id,
+                                     relation=relation, depth=depth)
+                for (descendant_id, ancestor_id), depth in ancestry_closure(edges).items()
+            ])
+        invalidate_taxonomy_graph(self.id)
 
     def get_nodes_at_level(self, level):
         """
@@ -149,20 +350,23 @@ class Taxonomy(models.Model):
         def flat_list(l):
             return [item for sublist in l for item in sublist]
 
+        graph = self.graph
         if level == 0:
-            return list(self.taxonomynode_set.filter(parents=None))
+            return graph.nodes(graph.root_ids())
         else:
             parent_node_ids = self.get_nodes_at_level(level-1)
-            return flat_list([parent.children.all() for parent in parent_node_ids])
+            return flat_list([graph.nodes(graph.child_ids(parent.node_id)) for parent in parent_node_ids])
 
     def get_taxonomy_as_tree(self):
         """
             Returns a dictionary for the tree visualization
         """
         keys = [("name", "name"), ("mark", "restrictions")]
+        graph = self.graph
+
         def get_all_children(node_id):
             # recursive function for adding children in dict 
-            children = self.get_children(node_id)
+            children = graph.nodes(graph.child_ids(node_id))
             children_names = []
             for child in children:
                 child_name = {"name": child.name, "mark": [], "node_id": child.node_id}
@@ -173,13 +377,13 @@ class Taxonomy(models.Model):
                 if child.omitted_curation_task:
                     child_name["mark"].append("omittedCurationTask")
                 child_name["children"] = get_all_children(child.node_id)
-                child_name["parents_to_propagate_to"] = ', '.join(list(self.get_element_at_id(child.node_id)\
-                    .propagate_to_parents.values_list('name', flat=True)))
+                child_name["parents_to_propagate_to"] = ', '.join(
+                    [parent.name for parent in graph.nodes(graph.propagate_to_parent_ids(child.node_id))])
                 children_names.append(child_name)
             if children_names: 
                 return children_names
         
-        higher_categories = self.taxonomynode_set.filter(parents=None)
+        higher_categories = graph.nodes(graph.root_ids())
         output_dict = {"name": "Ontology", "children": []}
         for node in higher_categories:
             dict_level = {"name": node.name, "mark": [], "node_id": node.node_id, 
@@ -202,10 +406,28 @@ class Sound(models.Model):
     freesound_id = models.IntegerField(db_index=True)
     deleted_in_freesound = models.BooleanField(default=False, db_index=True)
     extra_data = JSONField(default=dict)
+    # copies of the extra_data fields used in filters and in the player, kept in sync by save()
+    duration = models.FloatField(null=True, blank=True, db_index=True)
+    license = models.CharField(max_length=200, null=True, blank=True, db_index=True)
+    preview_url = models.CharField(max_length=500, null=True, blank=True)
 
     app_label = 'datasets'
     model_name = 'sound'
 
+    def save(self, *args, **kwargs):
+        self.update_extra_data_columns()
+        super(Sound, self).save(*args, **kwargs)
+
+    def update_extra_data_columns(self):
+        """
+            Copies the duration, license and preview url of extra_data to their columns. save() calls it, code that
+            writes sounds without save() (bulk_create, bulk_update) must call it before
+        """
+        duration = self.extra_data.get('duration')
+        self.duration = float(duration) if isinstance(duration, (int, float)) else None
+        self.license = self.extra_data.get('license')
+        self.preview_url = self.extra_data.get('previews')
+
     def get_candidate_annotations(self, dataset):
         return CandidateAnnotation.objects.filter(sound_dataset__in=self.sounddataset_set.filter(dataset=dataset))
 
@@ -219,7 +441,7 @@ class Sound(models.Model):
             raise ValueError
         if size not in sizes:
             raise ValueError
-        url_parts = self.extra_data['previews'].split('previews')
+        url_parts = self.preview_url.split('previews')
         prefix = url_parts[0].replace('https:', '').replace('http:', '')   # remove 'https:' or 'http:'
         freesound_id_pref = url_parts[1].split('/')[1]
         user_id = url_parts[1].split('_')[-1].split('-')[0]
@@ -282,6 +504,120 @@ class Sound(models.Model):
         return 'Sound {0} (freesound {1})'.format(self.id, self.freesound_id)
 
 
+class SoundTagIndex(object):
+    """
+        Inverted index from the tags (or stemmed tags) of the sounds of a dataset to the ids of the sounds that have
+        them, used to evaluate tag mapping rules with set operations instead of scanning the extra_data of every sound.
+        The sound ids of each tag are kept sorted, delta encoded and compressed.
+    """
+    TAG_FIELDS = ('tags', 'stemmed_tags')
+
+    def __init__(self, dataset_id, tag_field):
+        if tag_field not in self.TAG_FIELDS:
+            raise ValueError
+        tag_sound_ids = collections.defaultdict(list)
+        sounds = Sound.objects.filter(sounddataset__dataset_id=dataset_id)\
+            .order_by('id')\
+            .values_list('id', 'extra_data__{0}'.format(tag_field))
+        for sound_id, tags in sounds.iterator():
+            if isinstance(tags, list):
+                for tag in set(tags):
+                    tag_sound_ids[tag].append(sound_id)
+        self._tag_sound_ids = {tag: self.compress(sound_ids) for tag, sound_ids in tag_sound_ids.items()}
+
+    @staticmethod
+    def compress(sorted_sound_ids):
+        deltas = array.array('I', [sound_id - previous for sound_id, previous
+                                   in zip(sorted_sound_ids, [0] + sorted_sound_ids[:-1])])
+        return zlib.compress(deltas.tobytes())
+
+    @staticmethod
+    def decompress(data):
+        deltas = array.array('I')
+        deltas.frombytes(zlib.decompress(data))
+        return itertools.accumulate(deltas)
+
+    def sound_ids(self, tag):
+        """ Returns the set of ids of the sounds with the tag """
+        data = self._tag_sound_ids.get(tag)
+        return set(self.decompress(data)) if data is not None else set()
+
+    def sound_ids_matching(self, tag_groups):
+        """ Returns the ids of the sounds that have all the tags of any of the groups """
+        sound_ids = set()
+        for tags in tag_groups:
+            sound_ids |= reduce(lambda x, y: x & y, [self.sound_ids(tag) for tag in tags])
+        return sound_ids
+
+    def sound_ids_with_any(self, tags):
+        """ Returns the ids of the sounds that have at least one of the tags """
+        return set().union(*[self.sound_ids(tag) for tag in tags])
+
+
+_sound_tag_indexes = dict()  # {(dataset_id, tag_field): (version, SoundTagIndex)}, shared by the threads of the process
+
+
+def get_sound_tag_index(dataset_id, tag_field):
+    """
+        Returns the SoundTagIndex of the dataset for the tag field, building it only if the version of the dataset
+        stored in Redis is not the one of the index built by this process
+    """
+    version = store.get_version(SOUND_TAG_INDEX_VERSION_KEY_TEMPLATE.format(dataset_id))
+    cached = _sound_tag_indexes.get((dataset_id, tag_field))
+    if cached is None or cached[0] != version:
+        cached = (version, SoundTagIndex(dataset_id, tag_field))
+        _sound_tag_indexes[(dataset_id, tag_field)] = cached
+    return cached[1]
+
+
+def invalidate_sound_tag_indexes(dataset_ids):
+    """
+        Increments the sound tag index version of the datasets so that every process builds their indexes again, also
+        when the current transaction commits (see invalidate_taxonomy_graph)
+    """
+    keys = [SOUND_TAG_INDEX_VERSION_KEY_TEMPLATE.format(dataset_id) for dataset_id in set(dataset_ids)
+            if dataset_id is not None]
+    for key in keys:
+        store.increment_version(key)
+    if keys and connection.in_atomic_block:
+        transaction.on_commit(lambda: [store.increment_version(key) for key in keys])
+
+
+def indexed_sound_tags(sound):
+    """
+        Returns a copy of the tag fields of the sound used by SoundTagIndex, None if its extra_data is not loaded
+    """
+    if 'extra_data' not in sound.__dict__ or not isinstance(sound.extra_data, dict):
+        return None
+    return json.dumps([sound.extra_data.get(tag_field) for tag_field in SoundTagIndex.TAG_FIELDS])
+
+
+class TagStem(models.Model):
+    """
+        Porter stem of each tag of the sounds, so that tags and stems can be joined in SQL. Filled by get_tag_stems
+    """
+    tag = models.TextField(unique=True)
+    stem = models.TextField(db_index=True)
+
+    def __str__(self):
+        return '{0} -> {1}'.format(self.tag, self.stem)
+
+
+def get_tag_stems(tags):
+    """
+        Returns a dictionary with the stem of each distinct tag of the iterable. The stems are read from the TagStem
+        table with one query, the tags that are not in it yet are stemmed and added
+    """
+    tags = set(tags)
+    stems = dict(TagStem.objects.filter(tag__in=tags).values_list('tag', 'stem'))
+    new_stems = stem_words(tags.difference(stems))
+    if new_stems:
+        TagStem.objects.bulk_create([TagStem(tag=tag, stem=tag_stem) for tag, tag_stem in new_stems.items()],
+                                    ignore_conflicts=True)
+        stems.update(new_stems)
+    return stems
+
+
 validator_list_examples = RegexValidator('^([0-9]+(?:,[0-9]+)*)*$', message='Enter a list of comma separated Freesound IDs.')
 
 class TaxonomyNode(models.Model):
@@ -343,8 +679,18 @@ class TaxonomyNode(models.Model):
                     [str(fsid) for fsid in list(self.freesound_examples_verification.values_list('freesound_id', flat=True))])
         super(TaxonomyNode, self).save(*args, **kwargs)
 
-    def as_dict(self):
+    def as_dict(self, counters=None):
+        """
+            Returns the node as a dict. If an AnnotationCounter is given, the numbers of ground truth annotations,
+            user contributions and verified annotations are taken from it instead of being counted
+        """
         parents = self.get_parents()
+        if counters is not None:
+            numbers = (counters.num_ground_truth_annotations, counters.num_propagated_ground_truth_annotations,
+                       counters.num_user_contributions, counters.num_verified_annotations)
+        else:
+            numbers = (self.num_ground_truth_annotations, self.num_propagated_ground_truth_annotations,
+                       self.num_user_contributions, self.num_verified_annotations)
         return {"name": self.name,
                 "node_id": self.node_id,
                 "id": self.id,
@@ -356,10 +702,10 @@ class TaxonomyNode(models.Model):
                 "parent_ids": [parent.node_id for parent in parents],
                 "child_ids": [child.node_id for child in self.get_children()],
                 "sibling_ids": [sibling.node_id for sibling in self.get_siblings(parents)],
-                "nb_ground_truth": self.num_ground_truth_annotations,
-                "nb_propagated_ground_truth": self.num_propagated_ground_truth_annotations,
-                "nb_user_contributions": self.num_user_contributions,
-                "nb_verified_annotations": self.num_verified_annotations,
+                "nb_ground_truth": numbers[0],
+                "nb_propagated_ground_truth": numbers[1],
+                "nb_user_contributions": numbers[2],
+                "nb_verified_annotations": numbers[3],
                 "faq": self.faq,
                 "url_id": self.url_id}
 
@@ -368,11 +714,15 @@ class TaxonomyNode(models.Model):
         # Used to return url for node ids
         return quote(self.node_id, safe='')
 
+    @property
+    def taxonomy_graph(self):
+        return get_taxonomy_graph(self.taxonomy_id)
+
     @property
     def name_with_parent(self):
         """ Used for printing the category name (with parent) in the choose table"""
-        parents = self.parents.all()
-        num_parents = parents.count()
+        parents = self.get_parents()
+        num_parents = len(parents)
         if num_parents == 0:  # no parent
             return self.name
         elif num_parents < 2:  # one parent
@@ -383,14 +733,14 @@ class TaxonomyNode(models.Model):
     @property
     def self_and_children_omitted(self):
         """ Returns True if the node and all its children are omitted """
-        all_children = self.taxonomy.get_all_children(self.node_id)
-        return not all_children.filter(omitted=False).exists() and self.omitted
+        all_children = self.taxonomy_graph.nodes(self.taxonomy_graph.all_children_ids(self.node_id))
+        return all(child.omitted for child in all_children) and self.omitted
 
     @property
     def self_and_children_advanced_task(self):
         """ Returns False if the node and all its children have advanced_task False """
-        all_children = self.taxonomy.get_all_children(self.node_id)
-        return all_children.filter(advanced_task=True).exists() or self.advanced_task
+        all_children = self.taxonomy_graph.nodes(self.taxonomy_graph.all_children_ids(self.node_id))
+        return any(child.advanced_task for child in all_children) or self.advanced_task
 
     @property
     def num_user_contributions(self):
@@ -409,15 +759,16 @@ class TaxonomyNode(models.Model):
         return self.ground_truth_annotations.filter(from_propagation=True).count()
 
     def get_parents(self):
-        return self.parents.all()
+        return self.taxonomy_graph.nodes(self.taxonomy_graph.parent_ids(self.node_id))
 
     def get_children(self):
-        return self.children.all()
+        return self.taxonomy_graph.nodes(self.taxonomy_graph.child_ids(self.node_id))
 
     def get_siblings(self, parents=None):
         if not parents:
             parents = self.get_parents()
-        return TaxonomyNode.objects.filter(parents__in=parents).exclude(node_id=self.node_id).distinct()
+        return self.taxonomy_graph.nodes(
+            self.taxonomy_graph.sibling_ids(self.node_id, parent_ids=[parent.node_id for parent in parents]))
 
     @property
     def siblings(self):
@@ -429,7 +780,7 @@ class TaxonomyNode(models.Model):
 
     @property
     def hierarchy_paths(self):
-        return self.taxonomy.get_hierarchy_paths(self.node_id)
+        return self.taxonomy_graph.hierarchy_paths(self.node_id)
 
     @property
     def quality_estimate(self):
@@ -460,6 +811,29 @@ class TaxonomyNode(models.Model):
         return '{0} ({1})'.format(self.name, self.node_id)
 
 
+class TaxonomyNodeAncestor(models.Model):
+    """
+        Closure of the parents and propagate_to_parents relations of the taxonomy nodes: one row for each
+        (descendant, ancestor) pair with the length of the shortest path between them. It allows getting
+        all the ancestors or descendants of a node with a single query. Rebuilt with
+        Taxonomy.rebuild_ancestry_closure().
+    """
+    PARENTS = 'P'
+    PROPAGATE_TO_PARENTS = 'PP'
+    RELATION_CHOICES = (
+        (PARENTS, 'Parents'),
+        (PROPAGATE_TO_PARENTS, 'Propagate to parents'),
+    )
+    descendant = models.ForeignKey(TaxonomyNode, related_name='ancestor_links', on_delete=models.CASCADE)
+    ancestor = models.ForeignKey(TaxonomyNode, related_name='descendant_links', on_delete=models.CASCADE)
+    relation = models.CharField(max_length=2, choices=RELATION_CHOICES)
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('descendant', 'relation', 'ancestor',)
+        index_together = ('ancestor', 'relation',)
+
+
 class Dataset(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=200)
@@ -536,6 +910,95 @@ class Dataset(models.Model):
     def num_user_contributions(self):
         return Vote.objects.filter(candidate_annotation__sound_dataset__dataset=self).count()
 
+    def get_annotation_counters(self):
+        """
+            Returns the dataset totals of the AnnotationCounter fields, summed over the counters of its nodes
+        """
+        return self.annotation_counters.aggregate(**{field: Coalesce(Sum(field), 0)
+                                                     for field in AnnotationCounter.COUNTER_FIELDS})
+
+    def get_annotation_counters_per_taxonomy_node(self):
+        return {counter.taxonomy_node_id: counter for counter in self.annotation_counters.all()}
+
+    def compute_annotation_counters(self):
+        """
+            Counts from scratch the values that the AnnotationCounter of each taxonomy node of the dataset should have.
+            Returns {taxonomy_node_id: {counter_field: value}}
+        """
+        counters = collections.defaultdict(lambda: dict.fromkeys(AnnotationCounter.COUNTER_FIELDS, 0))
+        candidate_annotation_counts = self.candidate_annotations.filter(taxonomy_node__isnull=False)\
+            .values('taxonomy_node_id')\
+            .annotate(num_annotations=Count('id', distinct=True),
+                      num_validated_annotations=Count('id', distinct=True, filter=Q(votes__isnull=False)),
+                      num_verified_annotations=Count('id', distinct=True, filter=Q(ground_truth__isnull=False)),
+                      num_user_contributions=Count('votes'))
+        ground_truth_annotation_counts = self.ground_truth_annotations.filter(taxonomy_node__isnull=False)\
+            .values('taxonomy_node_id')\
+            .annotate(num_ground_truth_annotations=Count('id'),
+                      num_propagated_ground_truth_annotations=Count('id', filter=Q(from_propagation=True)))
+        open_annotation_counts = filter_open_candidate_annotations(self.candidate_annotations)\
+            .filter(taxonomy_node__isnull=False)\
+            .values('taxonomy_node_id')\
+            .annotate(num_open_annotations=Count('id'))
+        for counts in list(candidate_annotation_counts) + list(ground_truth_annotation_counts) \
+                + list(open_annotation_counts):
+            counters[counts.pop('taxonomy_node_id')].update(counts)
+        return dict(counters)
+
+    def refresh_num_open_annotations(self, taxonomy_node_ids=None):
+        """
+            Counts again the open candidate annotations of the taxonomy nodes (all by default) after changes that do
+            not update the counters: SQL updates of the priority scores, deleted sounds and changes of the examples
+        """
+        candidate_annotations = self.candidate_annotations.filter(taxonomy_node__isnull=False)
+        counters = self.annotation_counters.all()
+        if taxonomy_node_ids is not None:
+            candidate_annotations = candidate_annotations.filter(taxonomy_node_id__in=taxonomy_node_ids)
+            counters = counters.filter(taxonomy_node_id__in=taxonomy_node_ids)
+        num_open_annotations = dict(filter_open_candidate_annotations(candidate_annotations)
+                                    .values_list('taxonomy_node_id')
+                                    .annotate(num=Count('id')))
+        counters = {counter.taxonomy_node_id: counter for counter in counters}
+        with transaction.atomic():
+            for taxonomy_node_id in set(num_open_annotations) - set(counters):
+                counters[taxonomy_node_id], _ = AnnotationCounter.objects.get_or_create(
+                    dataset=self, taxonomy_node_id=taxonomy_node_id)
+            changed_counters = []
+            for taxonomy_node_id, counter in counters.items():
+                if counter.num_open_annotations != num_open_annotations.get(taxonomy_node_id, 0):
+                    counter.num_open_annotations = num_open_annotations.get(taxonomy_node_id, 0)
+                    changed_counters.append(counter)
+            AnnotationCounter.objects.bulk_update(changed_counters, ['num_open_annotations'])
+
+    def get_unpropagated_ground_truth_annotations(self):
+        """
+            Returns the ground truth annotations of the dataset whose propagation is missing or incomplete: for
+            one of the nodes they propagate to, the sound has no ground truth annotation or has one that does not
+            include all their candidate annotations
+        """
+        propagate_to_parent_ids = collections.defaultdict(set)
+        for descendant_id, ancestor_id in TaxonomyNodeAncestor.objects\
+                .filter(descendant__taxonomy_id=self.taxonomy_id,
+                        relation=TaxonomyNodeAncestor.PROPAGATE_TO_PARENTS)\
+                .values_list('descendant_id', 'ancestor_id'):
+            propagate_to_parent_ids[descendant_id].add(ancestor_id)
+
+        candidate_annotation_ids = collections.defaultdict(set)
+        for gt_id, candidate_annotation_id in GroundTruthAnnotation.from_candidate_annotations.through.objects\
+                .filter(groundtruthannotation__sound_dataset__dataset=self)\
+                .values_list('groundtruthannotation_id', 'candidateannotation_id'):
+            candidate_annotation_ids[gt_id].add(candidate_annotation_id)
+
+        gt_ids = {(sound_dataset_id, taxonomy_node_id): gt_id for gt_id, sound_dataset_id, taxonomy_node_id in
+                  self.ground_truth_annotations.values_list('id', 'sound_dataset_id', 'taxonomy_node_id')}
+        unpropagated_gt_ids = [
+            gt_id for (sound_dataset_id, taxonomy_node_id), gt_id in gt_ids.items()
+            if any((sound_dataset_id, parent_id) not in gt_ids or
+                   not candidate_annotation_ids[gt_id] <= candidate_annotation_ids[gt_ids[(sound_dataset_id, parent_id)]]
+                   for parent_id in propagate_to_parent_ids[taxonomy_node_id])
+        ]
+        return GroundTruthAnnotation.objects.filter(id__in=unpropagated_gt_ids)
+
     @property
     def releases(self):
         return self.datasetrelease_set.all().order_by('-release_date')
@@ -569,17 +1032,19 @@ class Dataset(models.Model):
 
     def get_categories_to_validate(self, user):
         """
-        Returns a query set with the TaxonomyNode that can be validated by a user
-        Quite slow, should not be use often
+        Returns a query set with the TaxonomyNode that can be validated by a user: the nodes with more open candidate
+        annotations (AnnotationCounter.num_open_annotations) than open candidate annotations voted by the user
         """
-        taxonomy_node_pk = self.sounds.filter(sounddataset__candidate_annotations__ground_truth=None)\
-            .exclude(sounddataset__candidate_annotations__votes__created_by=user)\
-            .filter(taxonomy_node=None,
-                    taxonomy_node_verification=None,
-                    deleted_in_freesound=False,
-                    sounddataset__candidate_annotations__priority_score__gt=0)\
-            .values_list('sounddataset__candidate_annotations__taxonomy_node', flat=True)
-        return self.taxonomy.taxonomynode_set.filter(pk__in=set(taxonomy_node_pk))
+        num_open_annotations = dict(self.annotation_counters.filter(num_open_annotations__gt=0)
+                                    .values_list('taxonomy_node_id', 'num_open_annotations'))
+        num_voted_open_annotations = dict(
+            filter_open_candidate_annotations(self.candidate_annotations.filter(votes__created_by=user,
+                                                                                votes__test__in=Vote.PASSED_TESTS))
+            .values_list('taxonomy_node_id')
+            .annotate(num=Count('id', distinct=True)))
+        taxonomy_node_pk = [taxonomy_node_id for taxonomy_node_id, num in num_open_annotations.items()
+                            if num > num_voted_open_annotations.get(taxonomy_node_id, 0)]
+        return self.taxonomy.taxonomynode_set.filter(pk__in=taxonomy_node_pk)
 
     def user_can_annotate(self, node_id, user):
         """
@@ -588,6 +1053,11 @@ class Dataset(models.Model):
         """
         node = self.taxonomy.get_element_at_id(node_id)
 
+        candidate_annotation_pools = CandidateAnnotationPools(self.id)
+        if candidate_annotation_pools.is_built():
+            return bool(candidate_annotation_pools.get_candidate_annotation_ids_to_validate(node, user, 1,
+                                                                                            min_priority_score=0))
+
         sound_examples_verification = node.freesound_examples_verification.all()
         sound_examples = node.freesound_examples.all()
 
@@ -601,7 +1071,7 @@ class Dataset(models.Model):
         num_eligible_annotations = self.non_ground_truth_annotations_per_taxonomy_node(node_id) \
             .exclude(id__in=Vote.objects.filter(candidate_annotation__taxonomy_node=node,
                                                 created_by=user,
-                                                test__in=('UN', 'AP', 'PP', 'NA', 'NP'))
+                                                test__in=Vote.PASSED_TESTS)
                      .values('candidate_annotation_id')) \
             .exclude(id__in=annotation_examples_verification_ids) \
             .exclude(id__in=annotation_examples_ids) \
@@ -630,6 +1100,232 @@ class Dataset(models.Model):
             .exclude(test='FA')\
             .count()
 
+    def annotation_stats_per_taxonomy_node(self):
+        """
+        Returns a dict keyed by node_id with the number of annotations, sounds, non validated annotations and the
+        vote value counts of every taxonomy node of the dataset, computed in a single grouped query.
+        Equivalent to calling num_annotations_per_taxonomy_node, num_sounds_per_taxonomy_node,
+        num_non_validated_annotations_per_taxonomy_node and num_votes_with_value for each node.
+        Nodes without candidate annotations are not included.
+        """
+        with connection.cursor() as cursor:
+            # Votes are first aggregated per candidate annotation so that the join with candidate annotations
+            # does not multiply rows before grouping by node
+            cursor.execute("""
+                    WITH vote_counts AS (
+                        SELECT vote.candidate_annotation_id
+                               , COUNT(vote.id) AS num_votes
+                               , COUNT(vote.id) FILTER (WHERE vote.vote = 1.0 AND vote.test != 'FA') AS num_pp
+                               , COUNT(vote.id) FILTER (WHERE vote.vote = 0.5 AND vote.test != 'FA') AS num_pnp
+                               , COUNT(vote.id) FILTER (WHERE vote.vote = -1.0 AND vote.test != 'FA') AS num_np
+                               , COUNT(vote.id) FILTER (WHERE vote.vote = 0.0 AND vote.test != 'FA') AS num_u
+                          FROM datasets_vote vote
+                    INNER JOIN datasets_candidateannotation candidateannotation
+                            ON candidateannotation.id = vote.candidate_annotation_id
+                    INNER JOIN datasets_sounddataset sounddataset
+                            ON candidateannotation.sound_dataset_id = sounddataset.id
+                         WHERE sounddataset.dataset_id = %s
+                      GROUP BY vote.candidate_annotation_id
+                    )
+                    SELECT taxonomynode.node_id
+                           , COUNT(candidateannotation.id)
+                           , COUNT(DISTINCT sounddataset.sound_id)
+                           , COUNT(candidateannotation.id) FILTER (WHERE vote_counts.num_votes IS NULL)
+                           , COALESCE(SUM(vote_counts.num_pp), 0)
+                           , COALESCE(SUM(vote_counts.num_pnp), 0)
+                           , COALESCE(SUM(vote_counts.num_np), 0)
+                           , COALESCE(SUM(vote_counts.num_u), 0)
+                        FROM datasets_candidateannotation candidateannotation
+                  INNER JOIN datasets_sounddataset sounddataset
+                          ON candidateannotation.sound_dataset_id = sounddataset.id
+                  INNER JOIN datasets_taxonomynode taxonomynode
+                          ON taxonomynode.id = candidateannotation.taxonomy_node_id
+                   LEFT JOIN vote_counts
+                          ON vote_counts.candidate_annotation_id = candidateannotation.id
+                       WHERE sounddataset.dataset_id = %s
+                    GROUP BY taxonomynode.node_id
+                           """, (self.id, self.id)
+            )
+            rows = cursor.fetchall()
+
+        return {node_id: {'num_annotations': num_ann,
+                          'num_sounds': num_sounds,
+                          'num_missing_votes': num_missing_votes,
+                          'votes_stats': {
+                              'num_present_and_predominant': int(num_pp),
+                              'num_present_not_predominant': int(num_pnp),
+                              'num_not_present': int(num_np),
+                              'num_unsure': int(num_u),
+                          }}
+                for node_id, num_ann, num_sounds, num_missing_votes, num_pp, num_pnp, num_np, num_u in rows}
+
+    def compute_priority_scores(self, since=None, candidate_annotation_ids=None):
+        """
+        Recomputes the priority score of all the candidate annotations of the dataset without ground truth in a single
+        UPDATE, with the same formula as CandidateAnnotation.return_priority_score. If since is given, only the
+        candidate annotations of the sounds that got new candidate annotations, votes or ground truth annotations
+        after that date are rescored. If candidate_annotation_ids is given, only these candidate annotations are
+        rescored. Returns the (id, taxonomy_node_id, priority_score) of the candidate annotations whose score changed.
+        """
+        scope = ''
+        if candidate_annotation_ids is not None:
+            scope += """
+                         AND candidateannotation.id = ANY(%(candidate_annotation_ids)s)"""
+        if since is not None:
+            scope += """
+                         AND candidateannotation.sound_dataset_id IN (
+                                 SELECT candidateannotation.sound_dataset_id
+                                   FROM datasets_candidateannotation candidateannotation
+                                  WHERE candidateannotation.created_at > %(since)s
+                                  UNION
+                                 SELECT candidateannotation.sound_dataset_id
+                                   FROM datasets_vote vote
+                             INNER JOIN datasets_candidateannotation candidateannotation
+                                     ON candidateannotation.id = vote.candidate_annotation_id
+                                  WHERE vote.created_at > %(since)s
+                                  UNION
+                                 SELECT groundtruthannotation.sound_dataset_id
+                                   FROM datasets_groundtruthannotation groundtruthannotation
+                                  WHERE groundtruthannotation.created_at > %(since)s
+                             )"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                    WITH present_votes AS (
+                        SELECT vote.candidate_annotation_id
+                               , COUNT(vote.id) AS num_present_votes
+                          FROM datasets_vote vote
+                    INNER JOIN datasets_candidateannotation candidateannotation
+                            ON candidateannotation.id = vote.candidate_annotation_id
+                    INNER JOIN datasets_sounddataset sounddataset
+                            ON candidateannotation.sound_dataset_id = sounddataset.id
+                         WHERE sounddataset.dataset_id = %(dataset_id)s
+                           AND vote.test != 'FA'
+                           AND vote.vote IN (1.0, 0.5)
+                      GROUP BY vote.candidate_annotation_id
+                    ), ground_truth_counts AS (
+                        SELECT groundtruthannotation.sound_dataset_id
+                               , COUNT(groundtruthannotation.id) AS num_ground_truth
+                          FROM datasets_groundtruthannotation groundtruthannotation
+                    INNER JOIN datasets_sounddataset sounddataset
+                            ON groundtruthannotation.sound_dataset_id = sounddataset.id
+                         WHERE sounddataset.dataset_id = %(dataset_id)s
+                           AND NOT groundtruthannotation.from_propagation
+                      GROUP BY groundtruthannotation.sound_dataset_id
+                    ), scores AS (
+                        SELECT candidateannotation.id
+                               , COALESCE(present_votes.num_present_votes, 0) AS num_present_votes
+                               , COALESCE(ground_truth_counts.num_ground_truth, 0) AS num_ground_truth
+                               , sound.duration
+                          FROM datasets_candidateannotation candidateannotation
+                    INNER JOIN datasets_sounddataset sounddataset
+                            ON candidateannotation.sound_dataset_id = sounddataset.id
+                    INNER JOIN datasets_sound sound
+                            ON sounddataset.sound_id = sound.id
+                     LEFT JOIN present_votes
+                            ON present_votes.candidate_annotation_id = candidateannotation.id
+                     LEFT JOIN ground_truth_counts
+                            ON ground_truth_counts.sound_dataset_id = candidateannotation.sound_dataset_id
+                         WHERE sounddataset.dataset_id = %(dataset_id)s
+                           AND candidateannotation.ground_truth IS NULL{scope}
+                    ), priority_scores AS (
+                        SELECT scores.id
+                               , CASE WHEN scores.duration BETWEEN 0.3 AND 30
+                                      THEN 1000 * scores.num_present_votes
+                                         + 100 * CASE WHEN scores.duration <= 10 THEN 3
+                                                      WHEN scores.duration <= 20 THEN 2
+                                                      ELSE 1 END
+                                         + scores.num_ground_truth
+                                      ELSE scores.num_present_votes
+                                 END AS priority_score
+                          FROM scores
+                    )
+                    UPDATE datasets_candidateannotation candidateannotation
+                       SET priority_score = priority_scores.priority_score
+                      FROM priority_scores
+                     WHERE candidateannotation.id = priority_scores.id
+                       AND candidateannotation.priority_score != priority_scores.priority_score
+                 RETURNING candidateannotation.id
+                           , candidateannotation.taxonomy_node_id
+                           , candidateannotation.priority_score
+                           """.format(scope=scope), {'dataset_id': self.id, 'since': since,
+                                                     'candidate_annotation_ids': list(candidate_annotation_ids or [])}
+            )
+            rescored = cursor.fetchall()
+        if rescored:
+            # a score that goes from or to 0 opens or closes the candidate annotation
+            self.refresh_num_open_annotations({taxonomy_node_id for _, taxonomy_node_id, _ in rescored
+                                               if taxonomy_node_id is not None})
+        return rescored
+
+    def add_candidate_annotations(self, taxonomy_node, sounds, skip_taxonomy_nodes=(), **fields):
+        """
+            Creates a candidate annotation of the taxonomy node for each of the sounds (a queryset) with the given
+            fields (type, algorithm, created_by...), except for the sounds that already have a candidate annotation
+            of one of skip_taxonomy_nodes. Works with a few set based queries: the candidate annotations are created
+            with bulk_create and scored with compute_priority_scores, and the counters and candidate annotation pools
+            are updated as the signals of CandidateAnnotation.save would do.
+            Returns the number of candidate annotations created
+        """
+        sound_datasets = SoundDataset.objects.filter(dataset=self, sound__in=sounds)
+        skip_taxonomy_node_ids = [node.id for node in skip_taxonomy_nodes]
+        if skip_taxonomy_node_ids:
+            annotated_in_skipped_nodes = CandidateAnnotation.objects.filter(
+                taxonomy_node_id__in=skip_taxonomy_node_ids, sound_dataset__sound_id=OuterRef('sound_id'))
+            sound_datasets = sound_datasets.annotate(annotated_in_skipped_nodes=Exists(annotated_in_skipped_nodes))\
+                .filter(annotated_in_skipped_nodes=False)
+        # the first SoundDataset of each sound in the dataset
+        sound_dataset_ids = sound_datasets.order_by('sound_id', 'id').distinct('sound_id').values_list('id', flat=True)
+
+        # created with a 0 score (not open for validation), compute_priority_scores updates the open counters
+        candidate_annotations = CandidateAnnotation.objects.bulk_create([
+            CandidateAnnotation(sound_dataset_id=sound_dataset_id, taxonomy_node=taxonomy_node, priority_score=0,
+                                **fields)
+            for sound_dataset_id in sound_dataset_ids])
+        if not candidate_annotations:
+            return 0
+        candidate_annotation_ids = [candidate_annotation.id for candidate_annotation in candidate_annotations]
+        increment_dataset_annotation_counters(self.id, taxonomy_node.id, num_annotations=len(candidate_annotations))
+        self.compute_priority_scores(candidate_annotation_ids=candidate_annotation_ids)
+
+        pools = CandidateAnnotationPools(self.id)
+        if pools.is_built():
+            pools.update_candidate_annotations(CandidateAnnotation.objects.filter(id__in=candidate_annotation_ids)
+                                               .only('id', 'taxonomy_node_id', 'ground_truth', 'priority_score'))
+        return len(candidate_annotations)
+
+    def delete_candidate_annotations(self, candidate_annotations):
+        """
+            Deletes the candidate annotations of the queryset that have no votes with a few set based queries: the
+            counters are decremented once per taxonomy node and the candidate annotations are removed from the
+            candidate annotation pools in one batch, as the signals of CandidateAnnotation.delete would do.
+            Returns the number of candidate annotations deleted
+        """
+        candidate_annotations = candidate_annotations.filter(sound_dataset__dataset=self, votes=None).order_by()
+        deleted = list(candidate_annotations.only('id', 'taxonomy_node_id', 'ground_truth'))
+        if not deleted:
+            return 0
+        open_ids = set(filter_open_candidate_annotations(candidate_annotations).values_list('id', flat=True))
+        candidate_annotation_ids = [candidate_annotation.id for candidate_annotation in deleted]
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                    DELETE FROM datasets_groundtruthannotation_from_candidate_annotations
+                          WHERE candidateannotation_id = ANY(%(candidate_annotation_ids)s);
+                    DELETE FROM datasets_candidateannotation
+                          WHERE id = ANY(%(candidate_annotation_ids)s)
+                           """, {'candidate_annotation_ids': candidate_annotation_ids})
+
+        increments = collections.defaultdict(collections.Counter)
+        for candidate_annotation in deleted:
+            node_increments = increments[candidate_annotation.taxonomy_node_id]
+            node_increments['num_annotations'] -= 1
+            node_increments['num_verified_annotations'] -= int(candidate_annotation.ground_truth is not None)
+            node_increments['num_open_annotations'] -= int(candidate_annotation.id in open_ids)
+        for taxonomy_node_id, node_increments in increments.items():
+            increment_dataset_annotation_counters(self.id, taxonomy_node_id, **node_increments)
+
+        CandidateAnnotationPools(self.id).remove_candidate_annotations(deleted)
+        return len(deleted)
+
     def get_comments_per_taxonomy_node(self, node_id):
         return CategoryComment.objects.filter(dataset=self, category_id=node_id)
 
@@ -658,60 +1354,58 @@ class Dataset(models.Model):
     @property
     def num_categories_reached_goal(self):
         num_nodes_reached_goal = self.taxonomy.taxonomynode_set.filter(omitted=False, nb_ground_truth__gte=100).count()
-        nodes_pk = self.sounds.filter(sounddataset__candidate_annotations__ground_truth=None,
-                                      taxonomy_node=None,
-                                      taxonomy_node_verification=None,
-                                      deleted_in_freesound=False,
-                                      sounddataset__candidate_annotations__priority_score__gt=0)\
-            .values_list('sounddataset__candidate_annotations__taxonomy_node', flat=True)
+        nodes_pk = self.annotation_counters.filter(num_open_annotations__gt=0).values('taxonomy_node_id')
         num_nodes_finished_verifying = self.taxonomy.taxonomynode_set.filter(omitted=False, nb_ground_truth__lt=100)\
-            .exclude(pk__in=set(nodes_pk)).count()
+            .exclude(pk__in=nodes_pk).count()
         return num_nodes_reached_goal + num_nodes_finished_verifying
 
     def retrieve_sound_by_tags(self, positive_tags, negative_tags, preproc_positive=True, preproc_negative=False):
+        """
+            Returns the sounds of the dataset that have all the tags of any of the groups of positive_tags (a group
+            can also be a single tag) and none of negative_tags. Stemmed tags are used with preproc_positive and
+            preproc_negative. The matching is done with the sound tag indexes
+        """
         r = self.sounds.all()
+        sound_ids = None
         if positive_tags:
-            if preproc_positive:
-                r = r.filter(reduce(lambda x, y: x | y,
-                                    [reduce(lambda w, z: w & z, [Q(extra_data__stemmed_tags__contains=item)
-                                                                 if type(items) == list
-                                                                 else Q(extra_data__stemmed_tags__contains=items)
-                                                                 for item in items])
-                                     for items in positive_tags]))
-            else:
-                r = r.filter(reduce(lambda x, y: x | y,
-                                    [reduce(lambda w, z: w & z, [Q(extra_data__tags__contains=item)
-                                                                 if type(items) == list
-                                                                 else Q(extra_data__tags__contains=items)
-                                                                 for item in items])
-                                     for items in positive_tags]))
+            index = get_sound_tag_index(self.id, 'stemmed_tags' if preproc_positive else 'tags')
+            sound_ids = index.sound_ids_matching([items if type(items) == list else [items]
+                                                  for items in positive_tags])
 
         if negative_tags:
-            if preproc_negative:
-                for negative_tag in negative_tags:
-                    r = r.exclude(extra_data__stemmed_tags__contains=negative_tag)
-            else:
-                for negative_tag in negative_tags:
-                    r = r.exclude(extra_data__tags__contains=negative_tag)
+            index = get_sound_tag_index(self.id, 'stemmed_tags' if preproc_negative else 'tags')
+            negative_sound_ids = index.sound_ids_with_any(negative_tags)
+            if sound_ids is None:
+                return r.exclude(id__in=id_array(negative_sound_ids))
+            sound_ids -= negative_sound_ids
+
+        if sound_ids is not None:
+            r = r.filter(id__in=id_array(sound_ids))
         return r
 
     def quality_estimate_mapping(self, results, node_id):
+        # votes of the node on the retrieved sounds, counted in the database
         votes = Vote.objects.filter(candidate_annotation__sound_dataset__dataset=self,
                                     candidate_annotation__taxonomy_node__node_id=node_id,
-                                    candidate_annotation__sound_dataset__sound__in=results.values_list('id', flat=True))\
-                            .exclude(test='FA')
-        votes_values = list(votes.values_list('vote', flat=True))
-        num_votes = len(votes_values)
-
-        num_PP = votes_values.count(1.0)
-        num_PNP = votes_values.count(0.5)
-        num_NP = votes_values.count(-1)
-        num_U = votes_values.count(0)
-
-        tags_in_NP = [tag
-                      for v in votes if v.vote == -1
-                      for tag in v.candidate_annotation.sound_dataset.sound.extra_data['tags']]
-        tags_with_count = sorted(list(set([(i, tags_in_NP.count(i)) for i in tags_in_NP])),
+                                    candidate_annotation__sound_dataset__sound__in=results.values('id'))\
+                            .exclude(test='FA')\
+                            .order_by()
+        num_votes_with_value = dict(votes.values_list('vote').annotate(num=Count('id')))
+        num_votes = sum(num_votes_with_value.values())
+
+        num_PP = num_votes_with_value.get(1.0, 0)
+        num_PNP = num_votes_with_value.get(0.5, 0)
+        num_NP = num_votes_with_value.get(-1.0, 0)
+        num_U = num_votes_with_value.get(0.0, 0)
+
+        tags_in_NP = collections.Counter()
+        NP_votes_per_tags = votes.filter(vote=-1)\
+                                 .values_list('candidate_annotation__sound_dataset__sound__extra_data__tags')\
+                                 .annotate(num=Count('id'))
+        for tags, num in NP_votes_per_tags:
+            for tag in tags or []:
+                tags_in_NP[tag] += num
+        tags_with_count = sorted(tags_in_NP.items(),
                                  key=lambda x: x[1],
                                  reverse=True)
 
@@ -771,7 +1465,79 @@ class DatasetRelease(models.Model):
 
     @property
     def index_file_path(self):
-        return os.path.join(settings.DATASET_RELEASE_FILES_FOLDER, '{0}.json'.format(self.id))
+        return os.path.join(settings.DATASET_RELEASE_FILES_FOLDER, '{0}.jsonl.gz'.format(self.id))
+
+    def write_index(self):
+        """
+            Writes the sounds of the release with the node ids of their ground truth annotations to the index file: a
+            gzip compressed file with one [freesound_id, [node_id, ...]] JSON array per line, so that the release is
+            streamed from disk instead of being stored in the row. The file is replaced once complete.
+            Returns the number of sounds and of taxonomy nodes written
+        """
+        annotations = self.ground_truth_annotations\
+            .order_by('sound_dataset__sound__freesound_id', 'id')\
+            .values_list('sound_dataset__sound__freesound_id', 'taxonomy_node__node_id')\
+            .iterator()
+        num_sounds = 0
+        node_ids = set()
+        with gzip.open(self.index_file_path + '.tmp', 'wt') as f:
+            for freesound_id, sound_annotations in itertools.groupby(annotations, key=lambda x: x[0]):
+                sound_node_ids = [node_id for _, node_id in sound_annotations]
+                f.write(json.dumps([freesound_id, sound_node_ids]) + '\n')
+                num_sounds += 1
+                node_ids.update(sound_node_ids)
+        os.replace(self.index_file_path + '.tmp', self.index_file_path)
+        return num_sounds, len(node_ids)
+
+    def iter_index(self):
+        """ Yields the (freesound_id, node_ids) pairs of the index file one by one """
+        with gzip.open(self.index_file_path, 'rt') as f:
+            for line in f:
+                freesound_id, node_ids = json.loads(line)
+                yield freesound_id, node_ids
+
+    @property
+    def snapshot_file_path(self):
+        return os.path.join(settings.DATASET_RELEASE_FILES_FOLDER, '{0}.snapshot'.format(self.id))
+
+    def write_snapshot(self):
+        """
+            Writes the ground truth annotations of the release to its snapshot file (see ReleaseSnapshot), sorted by
+            taxonomy node and id. The file is replaced once complete. Partitions left blank are stored as None, a
+            ValueError is raised for the ones that are not in ReleaseSnapshot.PARTITIONS
+        """
+        partition_indexes = {partition: index for index, partition in enumerate(ReleaseSnapshot.PARTITIONS)}
+        partition_indexes[''] = partition_indexes[None]
+        node_ids = []
+        node_offsets = array.array('I', [0])
+        ground_truth_annotation_ids = array.array('I')
+        freesound_ids = array.array('I')
+        partitions = array.array('B')
+        annotations = self.ground_truth_annotations\
+            .order_by('taxonomy_node__node_id', 'id')\
+            .values_list('taxonomy_node__node_id', 'id', 'sound_dataset__sound__freesound_id', 'partition')\
+            .iterator()
+        for node_id, node_annotations in itertools.groupby(annotations, key=lambda x: x[0]):
+            for _, ground_truth_annotation_id, freesound_id, partition in node_annotations:
+                ground_truth_annotation_ids.append(ground_truth_annotation_id)
+                freesound_ids.append(freesound_id)
+                if partition not in partition_indexes:
+                    raise ValueError('Ground truth annotation {0} of release {1} has an unknown partition {2!r}'
+                                     .format(ground_truth_annotation_id, self.release_tag, partition))
+                partitions.append(partition_indexes[partition])
+            node_ids.append(node_id)
+            node_offsets.append(len(ground_truth_annotation_ids))
+
+        header = json.dumps({'node_ids': node_ids, 'byteorder': sys.byteorder}).encode()
+        header += b' ' * (-(len(header) + 4) % 4)  # align the columns to 4 bytes
+        # the file can be written by several processes at once when it is missing (see get_release_snapshot)
+        temporary_file_path = '{0}.{1}.tmp'.format(self.snapshot_file_path, os.getpid())
+        with open(temporary_file_path, 'wb') as f:
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for column in (node_offsets, ground_truth_annotation_ids, freesound_ids, partitions):
+                column.tofile(f)
+        os.replace(temporary_file_path, self.snapshot_file_path)
 
     @property
     def last_processing_progress_is_old(self):
@@ -783,11 +1549,137 @@ class DatasetRelease(models.Model):
         return self.ground_truth_annotations.filter(taxonomy_node__node_id=node_id)
 
 
+class ReleaseSnapshot(object):
+    """
+        Read only columnar copy of the ground truth annotations of a processed release, memory mapped so that the
+        processes share it and the release pages are served without querying the release tables. Columns, in native
+        byte order after a json header: node_offsets (the annotations of the i-th node are the rows node_offsets[i]
+        to node_offsets[i + 1]), ground_truth_annotation_ids, freesound_ids and partitions (index in PARTITIONS).
+    """
+    PARTITIONS = (None, 'dev', 'eval')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        header_length, = struct.unpack_from('<I', buffer)
+        header = json.loads(bytes(buffer[4:4 + header_length]).decode())
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('Release snapshot {0} was written with another byte order'.format(path))
+        self.node_ids = header['node_ids']
+        self._node_indexes = {node_id: i for i, node_id in enumerate(self.node_ids)}
+
+        position = 4 + header_length
+        self.node_offsets = buffer[position:position + 4 * (len(self.node_ids) + 1)].cast('I')
+        position += self.node_offsets.nbytes
+        num_annotations = self.node_offsets[-1]
+        self.ground_truth_annotation_ids = buffer[position:position + 4 * num_annotations].cast('I')
+        position += self.ground_truth_annotation_ids.nbytes
+        self.freesound_ids = buffer[position:position + 4 * num_annotations].cast('I')
+        position += self.freesound_ids.nbytes
+        self.partitions = buffer[position:position + num_annotations]
+
+    def node_rows(self, node_id):
+        """ Returns the range of rows of the annotations of the node, empty if it has none in the release """
+        i = self._node_indexes.get(node_id)
+        if i is None:
+            return range(0)
+        return range(self.node_offsets[i], self.node_offsets[i + 1])
+
+    def num_annotations(self, node_id):
+        return len(self.node_rows(node_id))
+
+    def ground_truth_annotations(self, node_id):
+        """
+            Returns a sequence with the ground truth annotations of the node as dictionaries of pk, partition and
+            sound_dataset__sound__freesound_id, ordered by pk. It can be sliced (e.g. by a Paginator) without reading
+            the rows outside the slice
+        """
+        return ReleaseSnapshotAnnotations(self, self.node_rows(node_id))
+
+
+class ReleaseSnapshotAnnotations(object):
+    def __init__(self, snapshot, rows):
+        self.snapshot = snapshot
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.annotation(row) for row in self.rows[key]]
+        return self.annotation(self.rows[key])
+
+    def annotation(self, row):
+        return {
+            'pk': self.snapshot.ground_truth_annotation_ids[row],
+            'partition': ReleaseSnapshot.PARTITIONS[self.snapshot.partitions[row]],
+            'sound_dataset__sound__freesound_id': self.snapshot.freesound_ids[row],
+        }
+
+
+_release_snapshots = dict()  # {release_id: (file modification time, ReleaseSnapshot)}, shared by the threads
+
+
+def get_release_snapshot(release):
+    """
+        Returns the memory mapped ReleaseSnapshot of a processed release, writing its file first if needed, or None
+        if the release is not processed yet
+    """
+    if not release.is_processed:
+        return None
+    try:
+        modification_time = os.stat(release.snapshot_file_path).st_mtime_ns
+    except FileNotFoundError:
+        release.write_snapshot()
+        modification_time = os.stat(release.snapshot_file_path).st_mtime_ns
+    cached = _release_snapshots.get(release.id)
+    if cached is None or cached[0] != modification_time:
+        cached = (modification_time, ReleaseSnapshot(release.snapshot_file_path))
+        _release_snapshots[release.id] = cached
+    return cached[1]
+
+
 class SoundDataset(models.Model):
     sound = models.ForeignKey(Sound, null=True, blank=True, on_delete=models.SET_NULL)
     dataset = models.ForeignKey(Dataset, null=True, blank=True, on_delete=models.SET_NULL)
 
 
+def request_ground_truth_propagation(sound_dataset_id, taxonomy_node_id):
+    """
+        Propagates the ground truth annotation of a sound for a taxonomy node, or unpropagates it if it does not exist
+        anymore, in a Celery task enqueued when the current transaction commits so that the annotators do not wait
+        for it
+    """
+    from datasets.tasks import enqueue_ground_truth_propagation  # the tasks module imports the models
+    transaction.on_commit(lambda: enqueue_ground_truth_propagation(sound_dataset_id, taxonomy_node_id))
+
+
+def ground_truth_state_from_votes(votes):
+    """
+        Returns the ground truth state given the (vote value, from_expert) pairs of the votes of a candidate
+        annotation that did not fail the quality control test, in creation order. Returns None if there is no
+        agreement yet
+    """
+    vote_values_non_expert = [v[0] for v in votes if not v[1]]
+    vote_values_expert = [v[0] for v in votes if v[1]]
+
+    if vote_values_expert:
+        return vote_values_expert[-1]
+    else:
+        if vote_values_non_expert.count(1) > 1:
+            return 1
+        if vote_values_non_expert.count(0.5) > 1:
+            return 0.5
+        if vote_values_non_expert.count(0) > 1:
+            return 0
+        if vote_values_non_expert.count(-1) > 1:
+            return -1
+        else:
+            return None
+
+
 class CandidateAnnotation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     TYPE_CHOICES = (
@@ -822,22 +1714,7 @@ class CandidateAnnotation(models.Model):
         """
         # all the test cases are considered valid except the Failed one
         votes = self.votes.exclude(test='FA').values_list('vote', 'from_expert').order_by('created_at')
-        vote_values_non_expert = [v[0] for v in votes if not v[1]]
-        vote_values_expert = [v[0] for v in votes if v[1]]
-
-        if vote_values_expert:
-            return vote_values_expert[-1]
-        else:
-            if vote_values_non_expert.count(1) > 1:
-                return 1
-            if vote_values_non_expert.count(0.5) > 1:
-                return 0.5
-            if vote_values_non_expert.count(0) > 1:
-                return 0
-            if vote_values_non_expert.count(-1) > 1:
-                return -1
-            else:
-                return None
+        return ground_truth_state_from_votes(votes)
 
     @property
     def freesound_id(self):
@@ -863,15 +1740,16 @@ class CandidateAnnotation(models.Model):
     def num_NP(self):
         return self.num_vote_value(-1)
 
-    def return_priority_score(self):
-        sound_duration = self.sound_dataset.sound.extra_data['duration']
+    def return_priority_score(self, num_gt_same_sound=None):
+        sound_duration = self.sound_dataset.sound.duration
         num_present_votes = self.num_present_votes if hasattr(self, 'num_present_votes') \
                             else self.votes.exclude(test='FA').filter(vote__in=('1', '0.5')).count()
-        if not 0.3 <= sound_duration <= 30:
+        if sound_duration is None or not 0.3 <= sound_duration <= 30:
             return num_present_votes
         else:
             duration_score = 3 if sound_duration <= 10 else 2 if sound_duration <= 20 else 1
-            num_gt_same_sound = self.sound_dataset.ground_truth_annotations.filter(from_propagation=False).count()
+            if num_gt_same_sound is None:
+                num_gt_same_sound = self.sound_dataset.ground_truth_annotations.filter(from_propagation=False).count()
             return 1000 * num_present_votes \
                  +  100 * duration_score \
                  +        num_gt_same_sound
@@ -914,7 +1792,8 @@ class GroundTruthAnnotation(models.Model):
         return 'Annotation for sound {0}'.format(self.sound_dataset.sound.id)
 
     def propagate_annotation(self):
-        propagate_to_parents = self.taxonomy_node.taxonomy.get_all_propagate_to_parents(self.taxonomy_node.node_id)
+        graph = self.taxonomy_node.taxonomy_graph
+        propagate_to_parents = graph.nodes(graph.all_propagate_to_parent_ids(self.taxonomy_node.node_id))
         for parent in propagate_to_parents:
             gt_annotation, created = GroundTruthAnnotation.objects.get_or_create(
                     sound_dataset=self.sound_dataset,
@@ -936,6 +1815,13 @@ class GroundTruthAnnotation(models.Model):
             ground_truth = self.ground_truth
 
             # set ground truth state of candidate annotations
+            increment_annotation_counters_per_candidate_annotation(
+                gt_annotation.from_candidate_annotations.filter(ground_truth__isnull=ground_truth is not None),
+                'num_verified_annotations', 1 if ground_truth is not None else -1)
+            increment_annotation_counters_per_candidate_annotation(
+                exclude_unavailable_sounds(gt_annotation.from_candidate_annotations
+                                           .filter(ground_truth__isnull=ground_truth is not None, priority_score__gt=0)),
+                'num_open_annotations', -1 if ground_truth is not None else 1)
             gt_annotation.from_candidate_annotations.all().update(ground_truth=ground_truth)
 
             # modify ground truth state of possibly existing candidate annotation
@@ -944,7 +1830,7 @@ class GroundTruthAnnotation(models.Model):
                                                                        taxonomy_node=parent)
                 candidate_annotation.ground_truth = ground_truth
                 candidate_annotation.save()
-            except:
+            except (CandidateAnnotation.DoesNotExist, CandidateAnnotation.MultipleObjectsReturned):
                 pass
 
             if not created:
@@ -952,8 +1838,12 @@ class GroundTruthAnnotation(models.Model):
                 gt_annotation.ground_truth = ground_truth
                 gt_annotation.save()
 
+    def request_propagation(self):
+        request_ground_truth_propagation(self.sound_dataset_id, self.taxonomy_node_id)
+
     def unpropagate_annotation(self, origin_candidate_annotation):
-        propagate_to_parents = self.taxonomy_node.taxonomy.get_all_propagate_to_parents(self.taxonomy_node.node_id)
+        graph = self.taxonomy_node.taxonomy_graph
+        propagate_to_parents = graph.nodes(graph.all_propagate_to_parent_ids(self.taxonomy_node.node_id))
 
         propagated_annotations = GroundTruthAnnotation.objects.filter(sound_dataset=self.sound_dataset,
                                                                       taxonomy_node__in=propagate_to_parents)
@@ -980,12 +1870,14 @@ class GroundTruthAnnotation(models.Model):
                                                                            taxonomy_node=node)
                     candidate_annotation.ground_truth = -1
                     candidate_annotation.save()
-                except:
+                except (CandidateAnnotation.DoesNotExist, CandidateAnnotation.MultipleObjectsReturned):
                     pass
 
-                # update taxonomy_node nb ground truth
-                node.nb_ground_truth = node.num_ground_truth_annotations
-                node.save()
+            # update taxonomy_node nb ground truth
+            num_deleted_per_node = collections.Counter(node.id for node in taxonomy_nodes_to_update)
+            for taxonomy_node_id, num_deleted in num_deleted_per_node.items():
+                TaxonomyNode.objects.filter(pk=taxonomy_node_id)\
+                                    .update(nb_ground_truth=F('nb_ground_truth') - num_deleted)
 
     # Update number of ground truth annotations per taxonomy node each time a ground truth annotations is generated
     # Update priority score of candidate annotations associated to the same sound (only for non propagated gt annotations)
@@ -996,13 +1888,19 @@ class GroundTruthAnnotation(models.Model):
             is_new = False
         super(GroundTruthAnnotation, self).save(*args, **kwargs)
         if is_new:
-            self.taxonomy_node.nb_ground_truth = self.taxonomy_node.num_ground_truth_annotations
-            self.taxonomy_node.save()
+            TaxonomyNode.objects.filter(pk=self.taxonomy_node_id).update(nb_ground_truth=F('nb_ground_truth') + 1)
             if not self.from_propagation:
                 for candidate_annotation in self.sound_dataset.candidate_annotations.all():
                     candidate_annotation.update_priority_score()
 
 
+def refresh_nb_ground_truth(taxonomy_nodes):
+    """ Counts again the ground truth annotations of the given taxonomy nodes, in a single UPDATE """
+    num_ground_truth_annotations = GroundTruthAnnotation.objects.filter(taxonomy_node=OuterRef('pk'))\
+        .order_by().values('taxonomy_node').annotate(count=Count('id')).values('count')
+    taxonomy_nodes.update(nb_ground_truth=Coalesce(Subquery(num_ground_truth_annotations), 0))
+
+
 # choices for quality control test used in Vote and User Profile
 TEST_CHOICES = (
     ('UN', 'Unknown'),  # Test was not implemented when user contributed
@@ -1031,6 +1929,7 @@ class Vote(models.Model):
     )
     from_task = models.CharField(max_length=2, choices=TASK_TYPES, default='AD')  # store from which validation task
     from_expert = models.BooleanField(default=False)
+    PASSED_TESTS = ('UN', 'AP', 'PP', 'NA', 'NP')  # the annotations voted with these are not shown again to the user
 
     def __str__(self):
         return 'Vote for annotation {0}'.format(self.candidate_annotation.id)
@@ -1061,8 +1960,10 @@ class Vote(models.Model):
                 if existing_annotation:
                     if self.from_expert:
                         associated_sound_dataset = existing_annotation.sound_dataset
-                        existing_annotation.unpropagate_annotation(candidate_annotation)
                         existing_annotation.delete()
+                        # with no ground truth annotation left the propagation task unpropagates the annotation
+                        request_ground_truth_propagation(existing_annotation.sound_dataset_id,
+                                                         existing_annotation.taxonomy_node_id)
                         for candidate_annotation in associated_sound_dataset.candidate_annotations.all():
                             candidate_annotation.update_priority_score()
 
@@ -1075,7 +1976,7 @@ class Vote(models.Model):
                     if self.from_expert:  # a ground truth could be modified when voted by an expert
                         existing_annotation.ground_truth = ground_truth_state
                         existing_annotation.save()
-                    existing_annotation.propagate_annotation()
+                    existing_annotation.request_propagation()
 
                 else:
                     # normal agreement reached -> create a ground truth annotation
@@ -1088,7 +1989,7 @@ class Vote(models.Model):
                         taxonomy_node=candidate_annotation.taxonomy_node,
                         from_propagation=False)
                     ground_truth_annotation.from_candidate_annotations.add(candidate_annotation)
-                    ground_truth_annotation.propagate_annotation()
+                    ground_truth_annotation.request_propagation()
 
         else:  # no change on the ground truth state
             if existing_annotation:
@@ -1100,10 +2001,446 @@ class Vote(models.Model):
                         existing_annotation.save()
 
                 # update the priority score which depends on his number of votes
-                existing_annotation.propagate_annotation()
+                existing_annotation.request_propagation()
             candidate_annotation.update_priority_score()
 
 
+def save_votes(votes):
+    """
+        Saves a list of new votes with the same results as calling Vote.save() on each of them in order. The affected
+        candidate annotations, their votes and their ground truth annotations are loaded at once, the new ground
+        truth states and priority scores are computed in memory and written with bulk_create/bulk_update. Only the
+        candidate annotations that reach a present state or that already have a ground truth annotation go through
+        the propagation of GroundTruthAnnotation one by one.
+        Falls back to Vote.save() when the result could depend on the order of the votes: expert votes, which can
+        delete ground truth annotations, or several votes for candidate annotations of the same sound, whose
+        propagation and priority scores affect each other.
+    """
+    candidate_annotations = CandidateAnnotation.objects.select_related('sound_dataset__sound')\
+        .in_bulk([vote.candidate_annotation_id for vote in votes])
+    sound_dataset_ids = [candidate_annotations[vote.candidate_annotation_id].sound_dataset_id for vote in votes
+                         if vote.candidate_annotation_id in candidate_annotations]
+    if any(vote.from_expert or vote.pk is not None for vote in votes) \
+            or len(set(sound_dataset_ids)) != len(votes) or None in sound_dataset_ids:
+        for vote in votes:
+            vote.save()
+        return votes
+
+    was_open = {candidate_annotation.id: is_open_state(candidate_annotation.ground_truth,
+                                                       candidate_annotation.priority_score)
+                for candidate_annotation in candidate_annotations.values()}
+    previous_votes = collections.defaultdict(list)
+    for candidate_annotation_id, value, test, from_expert in Vote.objects\
+            .filter(candidate_annotation_id__in=candidate_annotations)\
+            .order_by('created_at')\
+            .values_list('candidate_annotation_id', 'vote', 'test', 'from_expert'):
+        previous_votes[candidate_annotation_id].append((value, test, from_expert))
+    ground_truth_annotations = {(gt.sound_dataset_id, gt.taxonomy_node_id): gt for gt in
+                                GroundTruthAnnotation.objects.filter(sound_dataset_id__in=sound_dataset_ids)}
+
+    for vote in votes:
+        vote.candidate_annotation = candidate_annotations[vote.candidate_annotation_id]
+    Vote.objects.bulk_create(votes)
+
+    # bulk_create and bulk_update skip the signal receivers that maintain the annotation counters
+    counter_increments = collections.defaultdict(collections.Counter)
+    changed_candidate_annotations = []
+    candidate_annotations_to_score = []
+    for vote in votes:
+        candidate_annotation = candidate_annotations[vote.candidate_annotation_id]
+        counter_key = (candidate_annotation.sound_dataset.dataset_id, candidate_annotation.taxonomy_node_id)
+        counter_increments[counter_key]['num_user_contributions'] += 1
+        counter_increments[counter_key]['num_validated_annotations'] += int(not previous_votes[candidate_annotation.id])
+
+        all_votes = previous_votes[candidate_annotation.id] + [(vote.vote, vote.test, vote.from_expert)]
+        valid_votes = [(value, from_expert) for value, test, from_expert in all_votes if test != 'FA']
+        ground_truth_state = ground_truth_state_from_votes(valid_votes)
+        if candidate_annotation.ground_truth != ground_truth_state:
+            if ground_truth_state in (-1.0, 0, 0.5, 1.0):  # annotation reach NP, U, PNP or PP state
+                if candidate_annotation.ground_truth is None:
+                    counter_increments[counter_key]['num_verified_annotations'] += 1
+                candidate_annotation.ground_truth = ground_truth_state
+                changed_candidate_annotations.append(candidate_annotation)
+        else:  # no change on the ground truth state, the priority score depends on the number of votes
+            candidate_annotation.num_present_votes = len([value for value, from_expert in valid_votes
+                                                          if value in (1, 0.5)])
+            candidate_annotations_to_score.append(candidate_annotation)
+
+    CandidateAnnotation.objects.bulk_update(changed_candidate_annotations, ['ground_truth'])
+    increment_open_annotation_counters(changed_candidate_annotations, was_open)
+    for (dataset_id, taxonomy_node_id), increments in counter_increments.items():
+        increment_dataset_annotation_counters(dataset_id, taxonomy_node_id, **increments)
+
+    for candidate_annotation in changed_candidate_annotations:
+        if candidate_annotation.ground_truth in (0.5, 1.0):
+            existing_annotation = ground_truth_annotations.get((candidate_annotation.sound_dataset_id,
+                                                                candidate_annotation.taxonomy_node_id))
+            if existing_annotation:
+                existing_annotation.from_candidate_annotations.add(candidate_annotation)
+                existing_annotation.request_propagation()
+            else:
+                # normal agreement reached -> create a ground truth annotation
+                ground_truth_annotation = GroundTruthAnnotation.objects.create(
+                    start_time=candidate_annotation.start_time,
+                    end_time=candidate_annotation.end_time,
+                    ground_truth=candidate_annotation.ground_truth,
+                    created_by=candidate_annotation.created_by,
+                    sound_dataset=candidate_annotation.sound_dataset,
+                    taxonomy_node=candidate_annotation.taxonomy_node,
+                    from_propagation=False)
+                ground_truth_annotation.from_candidate_annotations.add(candidate_annotation)
+                ground_truth_annotation.request_propagation()
+
+    for candidate_annotation in candidate_annotations_to_score:
+        existing_annotation = ground_truth_annotations.get((candidate_annotation.sound_dataset_id,
+                                                            candidate_annotation.taxonomy_node_id))
+        if existing_annotation:
+            existing_annotation.request_propagation()
+
+    num_gt_per_sound_dataset = dict(GroundTruthAnnotation.objects
+                                    .filter(sound_dataset_id__in=[candidate_annotation.sound_dataset_id for
+                                                                  candidate_annotation in candidate_annotations_to_score],
+                                            from_propagation=False)
+                                    .values_list('sound_dataset_id')
+                                    .annotate(num=Count('id')))
+    for candidate_annotation in candidate_annotations_to_score:
+        candidate_annotation.priority_score = candidate_annotation.return_priority_score(
+            num_gt_same_sound=num_gt_per_sound_dataset.get(candidate_annotation.sound_dataset_id, 0))
+    # Like CandidateAnnotation.save() does in Vote.save(), the ground truth state loaded above is written back
+    CandidateAnnotation.objects.bulk_update(candidate_annotations_to_score, ['ground_truth', 'priority_score'])
+    increment_open_annotation_counters(candidate_annotations_to_score, was_open)
+
+    votes_per_dataset = collections.defaultdict(list)
+    for vote in votes:
+        votes_per_dataset[vote.candidate_annotation.sound_dataset.dataset_id].append(vote)
+    for dataset_id, dataset_votes in votes_per_dataset.items():
+        pools = CandidateAnnotationPools(dataset_id)
+        pools.add_votes(dataset_votes)
+        pools.update_candidate_annotations([vote.candidate_annotation for vote in dataset_votes])
+
+    return votes
+
+
+class AnnotationCounter(models.Model):
+    """
+        Numbers of annotations, votes and ground truth annotations of a taxonomy node in a dataset. They are updated
+        by the signal receivers at the end of this module in the transaction that creates, changes or deletes the
+        objects, so that dashboards can read them instead of counting. Bulk operations skip the receivers, the
+        reconcile_annotation_counters command fixes the counters afterwards.
+        There is no row for a whole dataset: totals are summed over the rows of its nodes (see
+        Dataset.get_annotation_counters) so that concurrent votes do not all wait for the lock of a single row.
+    """
+    dataset = models.ForeignKey(Dataset, related_name='annotation_counters', on_delete=models.CASCADE)
+    taxonomy_node = models.ForeignKey(TaxonomyNode, related_name='annotation_counters', on_delete=models.CASCADE)
+    num_annotations = models.IntegerField(default=0)
+    num_validated_annotations = models.IntegerField(default=0)  # candidate annotations with at least one vote
+    num_verified_annotations = models.IntegerField(default=0)  # candidate annotations with a ground truth state
+    num_ground_truth_annotations = models.IntegerField(default=0)
+    num_propagated_ground_truth_annotations = models.IntegerField(default=0)
+    num_user_contributions = models.IntegerField(default=0)  # number of votes
+    # candidate annotations still to validate (see filter_open_candidate_annotations)
+    num_open_annotations = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = ('num_annotations', 'num_validated_annotations', 'num_verified_annotations',
+                      'num_ground_truth_annotations', 'num_propagated_ground_truth_annotations',
+                      'num_user_contributions', 'num_open_annotations')
+
+    class Meta:
+        unique_together = ('dataset', 'taxonomy_node',)
+
+    def __str__(self):
+        return 'Annotation counters of node {0} in dataset {1}'.format(self.taxonomy_node_id, self.dataset_id)
+
+
+def annotation_counter_values(annotation_counters):
+    """
+        Returns {taxonomy_node_id: {counter_field: value}} for the AnnotationCounter queryset, as returned by
+        Dataset.compute_annotation_counters
+    """
+    return {counter['taxonomy_node_id']: {field: counter[field] for field in AnnotationCounter.COUNTER_FIELDS}
+            for counter in annotation_counters.values('taxonomy_node_id', *AnnotationCounter.COUNTER_FIELDS)}
+
+
+def increment_annotation_counters(sound_dataset_id, taxonomy_node_id, **increments):
+    """
+        Adds the given increments (e.g. num_annotations=1) to the counters of the taxonomy node in the dataset
+        of the sound_dataset, creating them if needed
+    """
+    updates = {field: F(field) + value for field, value in increments.items() if value}
+    if sound_dataset_id is None or taxonomy_node_id is None or not updates:
+        return
+    dataset_id = Subquery(SoundDataset.objects.filter(id=sound_dataset_id).values('dataset_id'))
+    if not AnnotationCounter.objects.filter(dataset_id=dataset_id, taxonomy_node_id=taxonomy_node_id)\
+                                    .update(**updates):
+        dataset_id = SoundDataset.objects.filter(id=sound_dataset_id).values_list('dataset_id', flat=True).first()
+        increment_dataset_annotation_counters(dataset_id, taxonomy_node_id, **increments)
+
+
+def increment_dataset_annotation_counters(dataset_id, taxonomy_node_id, **increments):
+    """
+        Same as increment_annotation_counters when the dataset id is already known
+    """
+    updates = {field: F(field) + value for field, value in increments.items() if value}
+    if dataset_id is None or taxonomy_node_id is None or not updates:
+        return
+    if not AnnotationCounter.objects.filter(dataset_id=dataset_id, taxonomy_node_id=taxonomy_node_id)\
+                                    .update(**updates):
+        counter, _ = AnnotationCounter.objects.get_or_create(dataset_id=dataset_id, taxonomy_node_id=taxonomy_node_id)
+        AnnotationCounter.objects.filter(id=counter.id).update(**updates)
+
+
+def increment_annotation_counters_per_candidate_annotation(candidate_annotations, field, value):
+    """
+        Adds value to the counter field once per candidate annotation of the queryset. Must be called before
+        updating the candidate annotations in a way that removes them from the queryset
+    """
+    counts = candidate_annotations.values('sound_dataset_id', 'taxonomy_node_id').annotate(num=Count('id'))
+    for count in counts:
+        increment_annotation_counters(count['sound_dataset_id'], count['taxonomy_node_id'],
+                                      **{field: value * count['num']})
+
+
+def exclude_unavailable_sounds(candidate_annotations):
+    """
+        Excludes the candidate annotations of sounds deleted in Freesound or used as examples of their taxonomy node
+    """
+    examples = TaxonomyNode.freesound_examples.through.objects.filter(
+        taxonomynode_id=OuterRef('taxonomy_node_id'), sound_id=OuterRef('sound_dataset__sound_id'))
+    verification_examples = TaxonomyNode.freesound_examples_verification.through.objects.filter(
+        taxonomynode_id=OuterRef('taxonomy_node_id'), sound_id=OuterRef('sound_dataset__sound_id'))
+    return candidate_annotations.filter(sound_dataset__sound__deleted_in_freesound=False)\
+        .annotate(is_example=Exists(examples), is_verification_example=Exists(verification_examples))\
+        .filter(is_example=False, is_verification_example=False)
+
+
+def filter_open_candidate_annotations(candidate_annotations):
+    """
+        Keeps the candidate annotations still open for validation: without ground truth, with a positive priority
+        score and not excluded by exclude_unavailable_sounds
+    """
+    return exclude_unavailable_sounds(candidate_annotations.filter(ground_truth=None, priority_score__gt=0))
+
+
+def is_open_state(ground_truth, priority_score):
+    return ground_truth is None and priority_score is not None and priority_score > 0
+
+
+def increment_open_annotation_counters(candidate_annotations, was_open):
+    """
+        Updates num_open_annotations for candidate annotations whose ground truth or priority score changed.
+        was_open maps their ids to is_open_state() before the change
+    """
+    changed = [candidate_annotation for candidate_annotation in candidate_annotations
+               if was_open[candidate_annotation.id] !=
+               is_open_state(candidate_annotation.ground_truth, candidate_annotation.priority_score)]
+    if not changed:
+        return
+    available_ids = set(exclude_unavailable_sounds(CandidateAnnotation.objects.filter(
+        id__in=[candidate_annotation.id for candidate_annotation in changed])).values_list('id', flat=True))
+    for candidate_annotation in changed:
+        if candidate_annotation.id in available_ids:
+            increment_annotation_counters(candidate_annotation.sound_dataset_id, candidate_annotation.taxonomy_node_id,
+                                          num_open_annotations=-1 if was_open[candidate_annotation.id] else 1)
+
+
+class CandidateAnnotationPools(object):
+    """
+        Candidate annotations of a dataset that can be validated, kept in Redis: one sorted set per taxonomy node
+        with the candidate annotations without ground truth scored by priority score, and one set per user and
+        taxonomy node with the candidate annotations the user already voted.
+        Choosing the annotations to validate and checking if a user can annotate a node are done with these sets.
+        Only the few selected annotations are checked against the database, and the ones that are not eligible
+        anymore are removed from the pool.
+        The pools are filled with build() and updated by the signals of the candidate annotations and votes.
+        Until they are built is_built() is False and the callers query the database.
+    """
+    PAGE_SIZE = 100
+    # annotations with the same priority score are chosen at random among the first TIE_WINDOW * N of them
+    TIE_WINDOW = 10
+
+    def __init__(self, dataset_id):
+        self.dataset_id = dataset_id
+        # the database name keeps apart the pools of databases sharing the redis server (e.g. the tests one)
+        self.key_prefix = '{0}_{1}'.format(connection.settings_dict['NAME'], dataset_id)
+        generation = store.r.get(CANDIDATE_POOLS_GENERATION_KEY_TEMPLATE.format(self.key_prefix))
+        self.generation = int(generation) if generation is not None else None
+
+    def is_built(self):
+        return self.generation is not None
+
+    def pool_key(self, taxonomy_node_id, generation=None):
+        return CANDIDATE_POOL_KEY_TEMPLATE.format(self.key_prefix, generation or self.generation, taxonomy_node_id)
+
+    def voted_key(self, user_id, taxonomy_node_id, generation=None):
+        return VOTED_CANDIDATES_KEY_TEMPLATE.format(self.key_prefix, generation or self.generation, user_id,
+                                                    taxonomy_node_id)
+
+    def build(self):
+        """
+            Fills new pools from the database and switches to them. Returns the number of candidate annotations added
+        """
+        generation = store.increment_version(CANDIDATE_POOLS_VERSION_KEY_TEMPLATE.format(self.key_prefix))
+        examples = set(TaxonomyNode.freesound_examples.through.objects.values_list('taxonomynode_id', 'sound_id'))
+        examples |= set(TaxonomyNode.freesound_examples_verification.through.objects
+                        .values_list('taxonomynode_id', 'sound_id'))
+
+        candidate_annotations = CandidateAnnotation.objects\
+            .filter(sound_dataset__dataset_id=self.dataset_id, ground_truth=None, taxonomy_node__isnull=False,
+                    sound_dataset__sound__deleted_in_freesound=False)\
+            .values_list('id', 'taxonomy_node_id', 'priority_score', 'sound_dataset__sound_id')
+        num_candidate_annotations = 0
+        pipe = store.r.pipeline(transaction=False)
+        for candidate_annotation_id, taxonomy_node_id, priority_score, sound_id in candidate_annotations.iterator():
+            if (taxonomy_node_id, sound_id) not in examples:
+                pipe.zadd(self.pool_key(taxonomy_node_id, generation), {candidate_annotation_id: priority_score})
+                num_candidate_annotations += 1
+                if num_candidate_annotations % 10000 == 0:
+                    pipe.execute()
+
+        votes = Vote.objects.filter(candidate_annotation__sound_dataset__dataset_id=self.dataset_id,
+                                    test__in=Vote.PASSED_TESTS, created_by__isnull=False)\
+            .values_list('created_by_id', 'candidate_annotation__taxonomy_node_id', 'candidate_annotation_id')
+        for count, (user_id, taxonomy_node_id, candidate_annotation_id) in enumerate(votes.iterator()):
+            pipe.sadd(self.voted_key(user_id, taxonomy_node_id, generation), candidate_annotation_id)
+            if count % 10000 == 0:
+                pipe.execute()
+        pipe.execute()
+
+        previous_generation = self.generation
+        store.r.set(CANDIDATE_POOLS_GENERATION_KEY_TEMPLATE.format(self.key_prefix), generation)
+        self.generation = generation
+        if previous_generation is not None:
+            self.delete(previous_generation)
+        return num_candidate_annotations
+
+    def delete(self, generation=None):
+        generation = generation or self.generation
+        if generation is None:
+            return
+        for pattern in (CANDIDATE_POOL_KEY_TEMPLATE.format(self.key_prefix, generation, '*'),
+                        VOTED_CANDIDATES_KEY_TEMPLATE.format(self.key_prefix, generation, '*', '*')):
+            keys = list(store.r.scan_iter(match=pattern, count=1000))
+            for chunk in chunks(keys, 1000):
+                store.r.delete(*chunk)
+        if generation == self.generation:
+            store.r.delete(CANDIDATE_POOLS_GENERATION_KEY_TEMPLATE.format(self.key_prefix))
+            self.generation = None
+
+    def update_candidate_annotations(self, candidate_annotations):
+        """ Adds the candidate annotations without ground truth to their pool with their priority score and removes
+        the others """
+        if not self.is_built():
+            return
+        pipe = store.r.pipeline(transaction=False)
+        for candidate_annotation in candidate_annotations:
+            if candidate_annotation.taxonomy_node_id is None:
+                continue
+            pool_key = self.pool_key(candidate_annotation.taxonomy_node_id)
+            if candidate_annotation.ground_truth is None:
+                pipe.zadd(pool_key, {candidate_annotation.id: candidate_annotation.priority_score})
+            else:
+                pipe.zrem(pool_key, candidate_annotation.id)
+        pipe.execute()
+
+    def update_priority_scores(self, rescored):
+        """ Updates the score of the candidate annotations rescored by Dataset.compute_priority_scores, given as
+        (id, taxonomy_node_id, priority_score) """
+        if not self.is_built():
+            return
+        pipe = store.r.pipeline(transaction=False)
+        for candidate_annotation_id, taxonomy_node_id, priority_score in rescored:
+            if taxonomy_node_id is not None:
+                pipe.zadd(self.pool_key(taxonomy_node_id), {candidate_annotation_id: priority_score})
+        pipe.execute()
+
+    def remove_candidate_annotation(self, candidate_annotation):
+        if self.is_built() and candidate_annotation.taxonomy_node_id is not None:
+            store.r.zrem(self.pool_key(candidate_annotation.taxonomy_node_id), candidate_annotation.id)
+
+    def remove_candidate_annotations(self, candidate_annotations):
+        if not self.is_built():
+            return
+        pipe = store.r.pipeline(transaction=False)
+        for candidate_annotation in candidate_annotations:
+            if candidate_annotation.taxonomy_node_id is not None:
+                pipe.zrem(self.pool_key(candidate_annotation.taxonomy_node_id), candidate_annotation.id)
+        pipe.execute()
+
+    def add_votes(self, votes):
+        """ Adds the candidate annotations of the votes to the sets of annotations voted by their user """
+        if not self.is_built():
+            return
+        pipe = store.r.pipeline(transaction=False)
+        for vote in votes:
+            if vote.test in Vote.PASSED_TESTS and vote.created_by_id is not None:
+                pipe.sadd(self.voted_key(vote.created_by_id, vote.candidate_annotation.taxonomy_node_id),
+                          vote.candidate_annotation_id)
+        pipe.execute()
+
+    def get_candidate_annotation_ids_to_validate(self, taxonomy_node, user, num_annotations, min_priority_score=None):
+        """
+            Returns the ids of up to num_annotations candidate annotations of the node that the user can validate,
+            with the highest priority score first and annotations with the same score in random order.
+            min_priority_score excludes the annotations with a lower or equal score
+        """
+        pool_key = self.pool_key(taxonomy_node.id)
+        voted_key = self.voted_key(user.id, taxonomy_node.id)
+        min_score = '({0}'.format(min_priority_score) if min_priority_score is not None else '-inf'
+        voted_ids = {int(candidate_annotation_id) for candidate_annotation_id in store.r.smembers(voted_key)}
+
+        # stale annotations are removed from the pool, so the selection is retried until it only has eligible ones
+        while True:
+            candidates = []  # (candidate annotation id, priority score), by decreasing score
+            offset = 0
+            while True:
+                page = store.r.zrevrangebyscore(pool_key, '+inf', min_score, start=offset, num=self.PAGE_SIZE,
+                                                withscores=True)
+                offset += len(page)
+                for candidate_annotation_id, priority_score in page:
+                    if len(candidates) >= num_annotations and \
+                            (priority_score < candidates[num_annotations - 1][1] or
+                             len(candidates) >= num_annotations * self.TIE_WINDOW):
+                        break
+                    if int(candidate_annotation_id) not in voted_ids:
+                        candidates.append((int(candidate_annotation_id), priority_score))
+                else:
+                    if len(page) == self.PAGE_SIZE:
+                        continue
+                break
+
+            eligible = dict(CandidateAnnotation.objects
+                            .filter(id__in=[candidate_annotation_id for candidate_annotation_id, _ in candidates],
+                                    taxonomy_node=taxonomy_node,
+                                    sound_dataset__dataset_id=self.dataset_id,
+                                    ground_truth=None,
+                                    sound_dataset__sound__deleted_in_freesound=False)
+                            .exclude(sound_dataset__sound__in=taxonomy_node.freesound_examples.all())
+                            .exclude(sound_dataset__sound__in=taxonomy_node.freesound_examples_verification.all())
+                            .annotate(voted=Exists(Vote.objects.filter(candidate_annotation_id=OuterRef('pk'),
+                                                                       created_by=user,
+                                                                       test__in=Vote.PASSED_TESTS)))
+                            .values_list('id', 'voted'))
+            stale_ids = [candidate_annotation_id for candidate_annotation_id, _ in candidates
+                         if candidate_annotation_id not in eligible]
+            newly_voted_ids = [candidate_annotation_id for candidate_annotation_id, voted in eligible.items() if voted]
+            if stale_ids:
+                store.r.zrem(pool_key, *stale_ids)
+            if newly_voted_ids:
+                store.r.sadd(voted_key, *newly_voted_ids)
+                voted_ids.update(newly_voted_ids)
+            if not stale_ids and not newly_voted_ids:
+                break
+
+        candidates_per_score = collections.defaultdict(list)
+        for candidate_annotation_id, priority_score in candidates:
+            candidates_per_score[priority_score].append(candidate_annotation_id)
+        candidate_annotation_ids = []
+        for priority_score in sorted(candidates_per_score, reverse=True):
+            random.shuffle(candidates_per_score[priority_score])
+            candidate_annotation_ids += candidates_per_score[priority_score]
+        return candidate_annotation_ids[:num_annotations]
+
+
 class CategoryComment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, related_name='comments', null=True, on_delete=models.SET_NULL)
@@ -1182,3 +2519,174 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+
+def taxonomy_graph_values(taxonomy_node):
+    return tuple(taxonomy_node.__dict__.get(field_name) for field_name in taxonomy_graph_field_names())
+
+
+@receiver(post_init, sender=TaxonomyNode)
+def remember_taxonomy_graph_values(sender, instance, **kwargs):
+    instance._taxonomy_graph_values = taxonomy_graph_values(instance)
+
+
+@receiver(post_save, sender=TaxonomyNode)
+def invalidate_taxonomy_graph_on_node_save(sender, instance, created, **kwargs):
+    # Saving only the counters of a node (see TaxonomyGraph.VOLATILE_FIELDS) keeps the loaded graphs
+    graph_values = taxonomy_graph_values(instance)
+    if instance.taxonomy_id is not None and (created or graph_values != instance._taxonomy_graph_values):
+        invalidate_taxonomy_graph(instance.taxonomy_id)
+    instance._taxonomy_graph_values = graph_values
+
+
+@receiver(post_delete, sender=TaxonomyNode)
+def invalidate_taxonomy_graph_on_node_delete(sender, instance, **kwargs):
+    if instance.taxonomy_id is not None:
+        invalidate_taxonomy_graph(instance.taxonomy_id)
+
+
+@receiver(m2m_changed, sender=TaxonomyNode.parents.through)
+@receiver(m2m_changed, sender=TaxonomyNode.propagate_to_parents.through)
+def invalidate_taxonomy_graph_on_relation_change(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and instance.taxonomy_id is not None:
+        invalidate_taxonomy_graph(instance.taxonomy_id)
+
+
+@receiver(post_init, sender=Sound)
+def remember_sound_tags(sender, instance, **kwargs):
+    instance._indexed_tags = indexed_sound_tags(instance)
+
+
+@receiver(post_save, sender=Sound)
+def invalidate_sound_tag_indexes_on_tags_change(sender, instance, created, **kwargs):
+    # A new sound is in no dataset yet, adding it to one saves a SoundDataset
+    tags = indexed_sound_tags(instance)
+    if not created and tags != instance._indexed_tags:
+        invalidate_sound_tag_indexes(SoundDataset.objects.filter(sound_id=instance.id)
+                                     .values_list('dataset_id', flat=True))
+    instance._indexed_tags = tags
+
+
+@receiver(pre_delete, sender=Sound)
+def invalidate_sound_tag_indexes_on_sound_delete(sender, instance, **kwargs):
+    # Before the delete, which sets the sound of its SoundDataset rows to null
+    invalidate_sound_tag_indexes(SoundDataset.objects.filter(sound_id=instance.id)
+                                 .values_list('dataset_id', flat=True))
+
+
+@receiver(post_init, sender=SoundDataset)
+def remember_sound_dataset_dataset(sender, instance, **kwargs):
+    instance._indexed_dataset_id = instance.__dict__.get('dataset_id')
+
+
+@receiver(post_save, sender=SoundDataset)
+@receiver(post_delete, sender=SoundDataset)
+def invalidate_sound_tag_indexes_on_sound_dataset_change(sender, instance, **kwargs):
+    invalidate_sound_tag_indexes([instance.dataset_id, instance._indexed_dataset_id])
+    instance._indexed_dataset_id = instance.dataset_id
+
+
+@receiver(post_init, sender=CandidateAnnotation)
+def remember_candidate_annotation_ground_truth(sender, instance, **kwargs):
+    # Read from __dict__ so that a deferred ground_truth field is not loaded
+    instance._counted_ground_truth = instance.__dict__.get('ground_truth')
+    instance._counted_priority_score = instance.__dict__.get('priority_score')
+
+
+@receiver(post_save, sender=CandidateAnnotation)
+def update_counters_on_candidate_annotation_save(sender, instance, created, **kwargs):
+    verified = instance.ground_truth is not None
+    if created:
+        increment_annotation_counters(instance.sound_dataset_id, instance.taxonomy_node_id,
+                                      num_annotations=1, num_verified_annotations=int(verified))
+    elif 'ground_truth' in instance.__dict__ and (instance._counted_ground_truth is not None) != verified:
+        increment_annotation_counters(instance.sound_dataset_id, instance.taxonomy_node_id,
+                                      num_verified_annotations=1 if verified else -1)
+    if created or ('ground_truth' in instance.__dict__ and 'priority_score' in instance.__dict__):
+        was_open = not created and is_open_state(instance._counted_ground_truth, instance._counted_priority_score)
+        increment_open_annotation_counters([instance], {instance.id: was_open})
+    instance._counted_ground_truth = instance.ground_truth
+    instance._counted_priority_score = instance.priority_score
+
+
+@receiver(pre_delete, sender=CandidateAnnotation)
+def remember_candidate_annotation_votes(sender, instance, **kwargs):
+    # Votes are deleted in cascade before the post_delete signal of the candidate annotation
+    instance._counted_has_votes = instance.votes.exists()
+    instance._counted_open = filter_open_candidate_annotations(CandidateAnnotation.objects.filter(id=instance.id))\
+        .exists()
+
+
+@receiver(post_delete, sender=CandidateAnnotation)
+def update_counters_on_candidate_annotation_delete(sender, instance, **kwargs):
+    increment_annotation_counters(instance.sound_dataset_id, instance.taxonomy_node_id,
+                                  num_annotations=-1,
+                                  num_verified_annotations=-int(instance.ground_truth is not None),
+                                  num_validated_annotations=-int(getattr(instance, '_counted_has_votes', False)),
+                                  num_open_annotations=-int(getattr(instance, '_counted_open', False)))
+
+
+@receiver(post_save, sender=Vote)
+def update_counters_on_vote_save(sender, instance, created, **kwargs):
+    if created and instance.candidate_annotation_id is not None:
+        candidate_annotation = instance.candidate_annotation
+        first_vote = not Vote.objects.filter(candidate_annotation_id=candidate_annotation.id)\
+                                     .exclude(id=instance.id).exists()
+        increment_annotation_counters(candidate_annotation.sound_dataset_id, candidate_annotation.taxonomy_node_id,
+                                      num_user_contributions=1, num_validated_annotations=int(first_vote))
+
+
+@receiver(pre_delete, sender=Vote)
+def update_counters_on_vote_delete(sender, instance, **kwargs):
+    # pre_delete because a candidate annotation deleted in cascade may already be gone at post_delete
+    candidate_annotation = CandidateAnnotation.objects.filter(id=instance.candidate_annotation_id)\
+                                                      .values_list('sound_dataset_id', 'taxonomy_node_id').first()
+    if candidate_annotation is not None:
+        increment_annotation_counters(*candidate_annotation, num_user_contributions=-1)
+
+
+@receiver(post_save, sender=GroundTruthAnnotation)
+def update_counters_on_ground_truth_annotation_save(sender, instance, created, **kwargs):
+    if created:
+        increment_annotation_counters(instance.sound_dataset_id, instance.taxonomy_node_id,
+                                      num_ground_truth_annotations=1,
+                                      num_propagated_ground_truth_annotations=int(instance.from_propagation))
+
+
+@receiver(post_delete, sender=GroundTruthAnnotation)
+def update_counters_on_ground_truth_annotation_delete(sender, instance, **kwargs):
+    increment_annotation_counters(instance.sound_dataset_id, instance.taxonomy_node_id,
+                                  num_ground_truth_annotations=-1,
+                                  num_propagated_ground_truth_annotations=-int(instance.from_propagation))
+
+
+@receiver(post_save, sender=CandidateAnnotation)
+def update_candidate_pools_on_candidate_annotation_save(sender, instance, **kwargs):
+    if instance.sound_dataset_id is not None:
+        CandidateAnnotationPools(instance.sound_dataset.dataset_id).update_candidate_annotations([instance])
+
+
+@receiver(post_delete, sender=CandidateAnnotation)
+def update_candidate_pools_on_candidate_annotation_delete(sender, instance, **kwargs):
+    dataset_id = SoundDataset.objects.filter(id=instance.sound_dataset_id).values_list('dataset_id', flat=True).first()
+    if dataset_id is not None:
+        CandidateAnnotationPools(dataset_id).remove_candidate_annotation(instance)
+
+
+@receiver(post_save, sender=Vote)
+def update_candidate_pools_on_vote_save(sender, instance, created, **kwargs):
+    if created and instance.candidate_annotation_id is not None and \
+            instance.candidate_annotation.sound_dataset_id is not None:
+        CandidateAnnotationPools(instance.candidate_annotation.sound_dataset.dataset_id).add_votes([instance])
+
+
+@receiver(m2m_changed, sender=TaxonomyNode.freesound_examples.through)
+@receiver(m2m_changed, sender=TaxonomyNode.freesound_examples_verification.through)
+def refresh_open_annotation_counters_on_examples_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # pk_set is None when the examples are cleared from the sound side, reconcile_annotation_counters fixes that case
+    taxonomy_nodes = [instance] if not reverse else TaxonomyNode.objects.filter(pk__in=pk_set or [])
+    for taxonomy_node in taxonomy_nodes:
+        for dataset in Dataset.objects.filter(taxonomy_id=taxonomy_node.taxonomy_id):
+            dataset.refresh_num_open_annotations([taxonomy_node.id])
@@ -1,23 +1,28 @@
-from datasets.models import Dataset, DatasetRelease, CandidateAnnotation, Vote, TaxonomyNode, Sound
-from django.db.models import Count, Q
-from django.contrib.auth.models import User
+from datasets.models import Dataset, DatasetRelease, CandidateAnnotation, Vote, TaxonomyNode, Sound, \
+    AnnotationCounter, GroundTruthAnnotation, CandidateAnnotationPools, get_tag_stems, invalidate_sound_tag_indexes, \
+    refresh_nb_ground_truth
+from django.db.models import Count, Q, F, Window
 from django.db import transaction
 from celery import shared_task
 import pytz
 from django.utils import timezone
 from urllib.parse import quote
-from utils.redis_store import store
+from utils.redis_store import store, GROUND_TRUTH_PROPAGATION_PENDING_KEY_TEMPLATE, \
+    PRIORITY_SCORE_WATERMARK_KEY_TEMPLATE
 from datasets.templatetags.dataset_templatetags import calculate_taxonomy_node_stats
-from datasets.utils import query_freesound_by_id, chunks
-import sys
+from datasets.utils import query_freesound_by_id, get_freesound_response_cache, chunks, iter_chunks
 import json
 import math
 import logging
 import datetime
 from collections import defaultdict
-from datasets.utils import stem
 logger = logging.getLogger('tasks')
 
+# a pending propagation flag that was not cleared (e.g. worker lost) stops coalescing after this many seconds
+GROUND_TRUTH_PROPAGATION_PENDING_TIMEOUT = 60 * 10
+# rows committed late by transactions open during the previous incremental priority score run are still rescored
+PRIORITY_SCORE_WATERMARK_OVERLAP = datetime.timedelta(minutes=5)
+
 
 @shared_task
 def generate_release_index(dataset_id, release_id, max_sounds=None):
@@ -31,16 +36,10 @@ def generate_release_index(dataset_id, release_id, max_sounds=None):
     ground_truth_annotations = dataset.ground_truth_annotations
     dataset_release.ground_truth_annotations.add(*ground_truth_annotations)
 
-    sounds_info = defaultdict(list)
-    for result in ground_truth_annotations.values_list('sound_dataset__sound__freesound_id', 'taxonomy_node__node_id'):
-        sounds_info[result[0]].append(result[1])
-
-    # Calculate stats
-    num_sounds = len(sounds_info)
-    num_taxonomy_nodes = len(set([j for i in list(sounds_info.values()) for j in i]))
+    num_sounds, num_taxonomy_nodes = dataset_release.write_index()
     num_annotations = ground_truth_annotations.count()
 
-    # Make data structure
+    # Only the meta data is stored in the row, the sounds are in the index file
     release_data = {
         'meta': {
             'dataset': dataset.name,
@@ -49,7 +48,6 @@ def generate_release_index(dataset_id, release_id, max_sounds=None):
             'num_taxonomy_nodes': num_taxonomy_nodes,
             'num_annotations': num_annotations,
         },
-        'sounds_info': list(sounds_info.items())
     }
 
     # Calculate taxonomy stats (num sounds per taxonomy node). We could avoid a db query here by counting in python
@@ -68,6 +66,8 @@ def generate_release_index(dataset_id, release_id, max_sounds=None):
     dataset_release.processing_progress = 100  # REMOVE
     dataset_release.processing_last_updated = timezone.now()
     dataset_release.is_processed = True  # REMOVE
+    # refuses unknown partitions before the release is marked as processed
+    dataset_release.write_snapshot()
     dataset_release.save()
 
 
@@ -76,16 +76,22 @@ def compute_dataset_basic_stats(store_key, dataset_id):
     logger.info('Start computing data for {0}'.format(store_key))
     try:
         dataset = Dataset.objects.get(id=dataset_id)
+        # Annotation numbers come from the counters updated on write (see AnnotationCounter)
+        counters = dataset.get_annotation_counters()
+        num_annotations = counters['num_annotations']
+        num_sounds = dataset.num_sounds
         store.set(store_key, {
             'num_taxonomy_nodes': dataset.taxonomy.get_num_nodes(),
             'num_sounds': dataset.num_sounds_with_candidate,
-            'num_annotations': dataset.num_annotations,
-            'avg_annotations_per_sound': dataset.avg_annotations_per_sound,
-            'percentage_validated_annotations': dataset.percentage_validated_annotations,
-            'num_ground_truth_annotations': dataset.num_ground_truth_annotations,
-            'num_verified_annotations': dataset.num_verified_annotations,
-            'num_user_contributions': dataset.num_user_contributions,
-            'percentage_verified_annotations': dataset.percentage_verified_annotations,
+            'num_annotations': num_annotations,
+            'avg_annotations_per_sound': num_annotations * 1.0 / num_sounds if num_sounds else 0,
+            'percentage_validated_annotations':
+                counters['num_validated_annotations'] * 100.0 / num_annotations if num_annotations else 0,
+            'num_ground_truth_annotations': counters['num_ground_truth_annotations'],
+            'num_verified_annotations': counters['num_verified_annotations'],
+            'num_user_contributions': counters['num_user_contributions'],
+            'percentage_verified_annotations':
+                counters['num_verified_annotations'] * 100.0 / num_annotations if num_annotations else 0,
             'num_categories_reached_goal': dataset.num_categories_reached_goal,
             'num_non_omitted_nodes': dataset.num_non_omitted_nodes
         })
@@ -111,47 +117,12 @@ def compute_dataset_taxonomy_stats(store_key, dataset_id):
     logger.info('Start computing data for {0}'.format(store_key))
     try:
         dataset = Dataset.objects.get(id=dataset_id)
-        node_ids = dataset.taxonomy.get_all_node_ids()
-        from django.db import connection
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                    SELECT taxonomynode.node_id
-                           , COUNT(candidateannotation.id)
-                           , COUNT(DISTINCT(sound.id))
-                        FROM datasets_candidateannotation candidateannotation
-                  INNER JOIN datasets_sounddataset sounddataset
-                          ON candidateannotation.sound_dataset_id = sounddataset.id
-                  INNER JOIN datasets_sound sound
-                          ON sound.id = sounddataset.sound_id
-                  INNER JOIN datasets_taxonomynode taxonomynode
-                          ON taxonomynode.id = candidateannotation.taxonomy_node_id
-                       WHERE taxonomynode.node_id IN %s
-                         AND sounddataset.dataset_id = %s
-                    GROUP BY taxonomynode.node_id
-                           """, (tuple(node_ids), dataset.id)
-            )
-            node_n_annotations_n_sounds = cursor.fetchall()
-
-        annotation_numbers = {}
-        for node_id, num_ann, num_sounds in node_n_annotations_n_sounds:
-            # In commit https://github.com/MTG/freesound-datasets/commit/0a748ec3e8481cc1ca4625bced24e0aee9d059d0 we
-            # introduced a single SQL query that go num_ann, num_sounds and num_missing_votes in one go.
-            # However when tested in production we saw the query took hours to complete with full a sized dataset.
-            # To make it work in a reasonable amount of time we now do a query to get nun validated annotations
-            # for each node in the taxonomy. This should be refactored and use a single query to get all non
-            # validated annotation counts for all nodes.
-            num_missing_votes = dataset.num_non_validated_annotations_per_taxonomy_node(node_id)
-            votes_stats = {
-                'num_present_and_predominant': dataset.num_votes_with_value(node_id, 1.0),
-                'num_present_not_predominant': dataset.num_votes_with_value(node_id, 0.5),
-                'num_not_present': dataset.num_votes_with_value(node_id, -1.0),
-                'num_unsure': dataset.num_votes_with_value(node_id, 0.0)
-            }
-
-            annotation_numbers[node_id] = {'num_annotations': num_ann,
-                                           'num_sounds': num_sounds,
-                                           'num_missing_votes': num_missing_votes,
-                                           'votes_stats': votes_stats}
+        # In commit https://github.com/MTG/freesound-datasets/commit/0a748ec3e8481cc1ca4625bced24e0aee9d059d0 we
+        # introduced a single SQL query that got num_ann, num_sounds and num_missing_votes in one go, but joining
+        # votes directly made it take hours on a full sized dataset. Votes are now pre-aggregated per candidate
+        # annotation before grouping by node (see Dataset.annotation_stats_per_taxonomy_node).
+        annotation_numbers = dataset.annotation_stats_per_taxonomy_node()
+        counters = dataset.get_annotation_counters_per_taxonomy_node()
 
         nodes_data = []
         for node in dataset.taxonomy.get_all_nodes():
@@ -165,7 +136,8 @@ def compute_dataset_taxonomy_stats(store_key, dataset_id):
                     'num_missing_votes': 0,
                     'votes_stats': None,
                 }
-            node_stats = calculate_taxonomy_node_stats(dataset, node.as_dict(),
+            node_counters = counters.get(node.id, AnnotationCounter(dataset=dataset, taxonomy_node=node))
+            node_stats = calculate_taxonomy_node_stats(dataset, node.as_dict(counters=node_counters),
                                                        counts['num_sounds'],
                                                        counts['num_annotations'],
                                                        counts['num_missing_votes'],
@@ -184,6 +156,44 @@ def compute_dataset_taxonomy_stats(store_key, dataset_id):
         pass
 
 
+def contributions_per_user(queryset, reference_date, current_day_date):
+    """ Group the given annotations or votes by user and count them for all time, last week and today.
+        Contributions without a user are ignored. Returns {username: (n_all, n_last_week, n_today)} """
+    counts = queryset.filter(created_by__isnull=False)\
+        .values('created_by__username')\
+        .annotate(n_all=Count('id'),
+                  n_last_week=Count('id', filter=Q(created_at__gt=reference_date)),
+                  n_today=Count('id', filter=Q(created_at__gt=current_day_date)))
+    return {c['created_by__username']: (c['n_all'], c['n_last_week'], c['n_today']) for c in counts}
+
+
+def agreement_scores_per_user(dataset, current_day_date):
+    """ Agreement score of the votes made today by each user: a vote scores 1 if another vote of the same
+        candidate annotation has the same value, 0 if the other votes disagree and 0.5 if it is the only vote.
+        The sibling votes are counted with window functions over the candidate annotations voted today,
+        so that a single query is made. Returns {username: agreement_score} for users who voted today """
+    candidate_annotations_voted_today = Vote.objects.filter(
+        candidate_annotation__sound_dataset__dataset=dataset,
+        created_at__gt=current_day_date).values('candidate_annotation_id')
+    votes = Vote.objects.filter(candidate_annotation_id__in=candidate_annotations_voted_today)\
+        .annotate(n_same_value=Window(Count('id'), partition_by=[F('candidate_annotation_id'), F('vote')]),
+                  n_votes=Window(Count('id'), partition_by=[F('candidate_annotation_id')]))\
+        .values_list('created_by__username', 'created_at', 'n_same_value', 'n_votes')
+
+    agreement_score = defaultdict(float)
+    n_votes_today = defaultdict(int)
+    for username, created_at, n_same_value, n_votes in votes:
+        # sibling votes from previous days are only needed inside the windows
+        if username is None or created_at <= current_day_date:
+            continue
+        n_votes_today[username] += 1
+        if n_same_value > 1:
+            agreement_score[username] += 1
+        elif n_votes == 1:
+            agreement_score[username] += 0.5
+    return {username: agreement_score[username]/float(n) for username, n in n_votes_today.items()}
+
+
 @shared_task
 def compute_annotators_ranking(store_key, dataset_id, N=10):
     logger.info('Start computing data for {0}'.format(store_key))
@@ -191,96 +201,68 @@ def compute_annotators_ranking(store_key, dataset_id, N=10):
         dataset = Dataset.objects.get(id=dataset_id)
         reference_date = timezone.now() - datetime.timedelta(days=7)
         current_day_date = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        ranking = list()
-        ranking_last_week = list()
-        ranking_today = list()
-        ranking_agreement_today = list()
-        for user in User.objects.all():
-            # all time
-            n_annotations = CandidateAnnotation.objects.filter(created_by=user, sound_dataset__dataset=dataset, type='MA').count()
-            n_votes = Vote.objects.filter(created_by=user, candidate_annotation__sound_dataset__dataset=dataset).count()
-            ranking.append(
-                (user.username, n_annotations + n_votes)
-            )
-
-            # last week
-            n_annotations_last_week = CandidateAnnotation.objects.filter(
-                created_at__gt=reference_date, created_by=user, sound_dataset__dataset=dataset, type='MA').count()
-            n_votes_last_week = Vote.objects.filter(
-                created_at__gt=reference_date, created_by=user, candidate_annotation__sound_dataset__dataset=dataset).count()
-            ranking_last_week.append(
-                (user.username, n_annotations_last_week + n_votes_last_week)
-            )
-
-            # today
-            agreement_score = 0
-            n_annotations_today = CandidateAnnotation.objects.filter(
-                created_at__gt=current_day_date, created_by=user, sound_dataset__dataset=dataset, type='MA').count()
-            n_votes_today = Vote.objects.filter(
-                created_at__gt=current_day_date, created_by=user, candidate_annotation__sound_dataset__dataset=dataset).count()
-
-            ranking_today.append(
-                (user.username, n_annotations_today + n_votes_today)
-            )
-
-            # agreement score today
-            votes = Vote.objects.filter(created_by=user,
-                                        candidate_annotation__sound_dataset__dataset=dataset,
-                                        created_at__gt=current_day_date)
-            for vote in votes:
-                all_vote_values = [v.vote for v in vote.candidate_annotation.votes.all()]
-                if all_vote_values.count(vote.vote) > 1:
-                    agreement_score += 1
-                elif len(all_vote_values) > 1:
-                    pass
-                else:
-                    agreement_score += 0.5
-            try:
-                ranking_agreement_today.append(
-                    (user.username, agreement_score/float(n_votes_today))
-                )
-            except ZeroDivisionError:
-                ranking_agreement_today.append(
-                    (user.username, 0)
-                )
-
-        ranking = sorted(ranking, key=lambda x: x[1], reverse=True)  # Sort by number of annotations
-        ranking_last_week = sorted(ranking_last_week, key=lambda x: x[1], reverse=True)
-        ranking_today = sorted(ranking_today, key=lambda x: x[1], reverse=True)
-        ranking_agreement_today = sorted(ranking_agreement_today, key=lambda x: x[1], reverse=True)
+
+        # Only users who contributed to the dataset appear in the grouped counts
+        annotation_counts = contributions_per_user(
+            CandidateAnnotation.objects.filter(sound_dataset__dataset=dataset, type='MA'),
+            reference_date, current_day_date)
+        vote_counts = contributions_per_user(
+            Vote.objects.filter(candidate_annotation__sound_dataset__dataset=dataset),
+            reference_date, current_day_date)
+
+        contributions = defaultdict(lambda: [0, 0, 0])
+        for counts in (annotation_counts, vote_counts):
+            for username, user_counts in counts.items():
+                for i, count in enumerate(user_counts):
+                    contributions[username][i] += count
+        usernames = sorted(contributions)
+
+        def sorted_ranking(scores):
+            return sorted([(username, score) for username, score in scores if score > 0],
+                          key=lambda x: x[1], reverse=True)
+
+        ranking = sorted_ranking((u, contributions[u][0]) for u in usernames)  # Sort by number of annotations
+        ranking_last_week = sorted_ranking((u, contributions[u][1]) for u in usernames)
+        ranking_today = sorted_ranking((u, contributions[u][2]) for u in usernames)
+        agreement_scores = agreement_scores_per_user(dataset, current_day_date)
+        ranking_agreement_today = sorted(sorted(agreement_scores.items()), key=lambda x: x[1], reverse=True)
 
         store.set(store_key, {'ranking': ranking[:N], 'ranking_last_week': ranking_last_week[:N],
                               'ranking_today': ranking_today, 'ranking_agreement_today': ranking_agreement_today})
         logger.info('Finished computing data for {0}'.format(store_key))
     except Dataset.DoesNotExist:
         pass
-    except User.DoesNotExist:
-        pass
 
 
 @shared_task
 def compute_gt_taxonomy_node():
     logger.info('Start computing number of ground truth annotation')
     dataset = Dataset.objects.get(short_name='fsd')
-    taxonomy = dataset.taxonomy
-    for node_id in taxonomy.get_all_node_ids():
-        taxonomy_node = taxonomy.get_element_at_id(node_id)
-        taxonomy_node.nb_ground_truth = taxonomy_node.num_ground_truth_annotations
-        taxonomy_node.save()
+    refresh_nb_ground_truth(dataset.taxonomy.taxonomynode_set.all())
     logger.info('Finished computing number of ground truth annotation')
 
 
+def log_freesound_response_cache_stats():
+    response_cache = get_freesound_response_cache()
+    if response_cache is not None:
+        logger.info('Freesound API response cache: {hits} hits, {revalidations} revalidations, {misses} misses, '
+                    '{errors} errors, {bytes_saved} bytes saved'.format(**response_cache.stats))
+
+
 @shared_task
 def refresh_sound_deleted_state():
     logger.info('Start refreshing freesound sound deleted state')
-    sound_ids = Sound.objects.all().values_list('freesound_id', flat=True)
-    results = query_freesound_by_id(sound_ids)
-    deleted_sound_ids = set(sound_ids) - set([s.id for s in results])
+    sound_ids = set(Sound.objects.all().values_list('freesound_id', flat=True))
+    deleted_sound_ids = sound_ids - set(s.id for s in query_freesound_by_id(sorted(sound_ids)))
     with transaction.atomic():
         for fs_sound_id in deleted_sound_ids:
             sound = Sound.objects.get(freesound_id=fs_sound_id)
             sound.deleted_in_freesound = True
             sound.save()
+    if deleted_sound_ids:
+        for dataset in Dataset.objects.all():
+            dataset.refresh_num_open_annotations()
+    log_freesound_response_cache_stats()
     logger.info('Finished refreshing freesound sound deleted state')
 
 
@@ -289,46 +271,148 @@ def refresh_sound_extra_data():
     logger.info('Start refreshing freesound sound extra data')
     sound_ids = Sound.objects.all().values_list('freesound_id', flat=True)
     results = query_freesound_by_id(sound_ids, fields="id,name,analysis,images", descriptors="lowlevel.average_loudness")
+    # the sounds are updated as the results arrive, in a single transaction so that a failed refresh changes nothing
     with transaction.atomic():
-        for freesound_sound in results:
-            sound = Sound.objects.get(freesound_id=freesound_sound.id)
-            sound.extra_data.update(freesound_sound.as_dict())
-            sound.save()
+        for freesound_sounds in iter_chunks(results, 500):
+            sounds_per_freesound_id = defaultdict(list)
+            for sound in Sound.objects.filter(freesound_id__in=[freesound_sound.id
+                                                                for freesound_sound in freesound_sounds]):
+                sounds_per_freesound_id[sound.freesound_id].append(sound)
+            for freesound_sound in freesound_sounds:
+                # several sounds can share a Freesound id
+                for sound in sounds_per_freesound_id[freesound_sound.id]:
+                    sound.extra_data.update(freesound_sound.as_dict())
+                    sound.save()
+    log_freesound_response_cache_stats()
     logger.info('Finished refreshing freesound sound extra data')
 
 
 @shared_task
-def compute_priority_score_candidate_annotations():
+def compute_priority_score_candidate_annotations(incremental=False):
+    """
+        Recomputes the priority score of the candidate annotations of FSD in the database. If incremental is True,
+        only the sounds that changed since the previous run are rescored
+    """
     logger.info('Start computing priority score of candidate annotations')
     dataset = Dataset.objects.get(short_name='fsd')
-    candidate_annotations = dataset.candidate_annotations.filter(ground_truth=None)\
-                                   .select_related('sound_dataset__sound')\
-                                   .annotate(num_present_votes=Count('votes',
-                                                                     filter=~Q(votes__test='FA')
-                                                                            & Q(votes__vote__in=('1', '0.5'))))
-    num_annotations = candidate_annotations.count()
-    count = 0
-    # Iterate all the sounds in chunks so we can do all transactions of a chunk atomically
-    for chunk in chunks(list(candidate_annotations), 500):
-        sys.stdout.write('\rUpdating priority score of candidate annotation %i of %i (%.2f%%)'
-                         % (count + 1, num_annotations, 100.0 * (count + 1) / num_annotations))
-        sys.stdout.flush()
-        with transaction.atomic():
-            for candidate_annotation in chunk:
-                count += 1
-                candidate_annotation.priority_score = candidate_annotation.return_priority_score()
-                candidate_annotation.save(update_fields=['priority_score'])
-    logger.info('Finished computing priority score of candidate annotations')
+    store_key = PRIORITY_SCORE_WATERMARK_KEY_TEMPLATE.format(dataset.id)
+    since = None
+    if incremental:
+        watermark = store.get(store_key).get('watermark')
+        if watermark is not None:
+            since = datetime.datetime.fromtimestamp(watermark, tz=pytz.utc) - PRIORITY_SCORE_WATERMARK_OVERLAP
+    watermark = timezone.now()
+    rescored = dataset.compute_priority_scores(since=since)
+    store.set(store_key, {'watermark': watermark.timestamp()})
+    # the scores are updated in SQL, without the signals that keep the pools up to date
+    CandidateAnnotationPools(dataset.id).update_priority_scores(rescored)
+    logger.info('Finished computing priority score of candidate annotations ({0} updated)'.format(len(rescored)))
+    return len(rescored)
 
 
 @shared_task
-def stem_dataset_sound_tags():
+def stem_dataset_sound_tags(chunk_size=1000):
+    """
+        Stores the stems of the tags of the FSD sounds in extra_data.stemmed_tags. The sounds are processed in chunks
+        of chunk_size, each one in its own transaction, and only the sounds whose stemmed tags are not up to date are
+        written. Returns the number of sounds updated
+    """
     logger.info('Start computing stem tags for FSD sounds')
     dataset = Dataset.objects.get(short_name='fsd')
+    sound_ids = list(Sound.objects.filter(sounddataset__dataset=dataset).distinct().order_by('id')
+                     .values_list('id', flat=True))
+    num_updated = 0
+    for chunk_sound_ids in chunks(sound_ids, chunk_size):
+        with transaction.atomic():
+            sounds = [sound for sound in Sound.objects.filter(id__in=chunk_sound_ids).select_for_update()
+                      .only('id', 'extra_data') if 'tags' in sound.extra_data]
+            stems = get_tag_stems(tag for sound in sounds for tag in sound.extra_data['tags'])
+            changed_sounds = []
+            for sound in sounds:
+                stemmed_tags = [stems[tag] for tag in sound.extra_data['tags']]
+                if sound.extra_data.get('stemmed_tags') != stemmed_tags:
+                    sound.extra_data['stemmed_tags'] = stemmed_tags
+                    changed_sounds.append(sound)
+            Sound.objects.bulk_update(changed_sounds, ['extra_data'])
+        num_updated += len(changed_sounds)
+    if num_updated:
+        # bulk_update does not send the signals that invalidate them
+        invalidate_sound_tag_indexes([dataset.id])
+    logger.info('Finished computing stem tags for FSD sounds ({0} updated)'.format(num_updated))
+    return num_updated
+
+
+def enqueue_ground_truth_propagation(sound_dataset_id, taxonomy_node_id):
+    """
+        Enqueues the propagation of the ground truth annotation of a sound for a taxonomy node, unless one is already
+        waiting in the queue. Returns False when the request was coalesced with the pending one or could not be
+        enqueued. It runs when the votes are already committed, so a broker failure is only logged: the propagation
+        is left to check_ground_truth_propagation
+    """
+    pending_key = GROUND_TRUTH_PROPAGATION_PENDING_KEY_TEMPLATE.format(sound_dataset_id, taxonomy_node_id)
+    if not store.set_if_absent(pending_key, GROUND_TRUTH_PROPAGATION_PENDING_TIMEOUT):
+        return False
+    try:
+        propagate_ground_truth_annotation.delay(sound_dataset_id, taxonomy_node_id)
+    except Exception:
+        # nothing was enqueued, do not drop the next requests until the flag expires
+        store.delete(pending_key)
+        logger.exception('Could not enqueue the ground truth propagation of sound dataset {0} for taxonomy node {1}'
+                         .format(sound_dataset_id, taxonomy_node_id))
+        return False
+    return True
+
+
+@shared_task
+def propagate_ground_truth_annotation(sound_dataset_id, taxonomy_node_id):
+    """
+        Brings the propagated ground truth annotations of a sound in line with its ground truth annotation for a
+        taxonomy node: propagates it if it exists, unpropagates its candidate annotations otherwise. It reads the
+        current state, so running it several times or late gives the same result
+    """
+    # clear the flag first so that changes made while running enqueue a new propagation
+    store.delete(GROUND_TRUTH_PROPAGATION_PENDING_KEY_TEMPLATE.format(sound_dataset_id, taxonomy_node_id))
     with transaction.atomic():
-        for sound in dataset.sounds.all():
-            tags = sound.extra_data['tags']
-            stemmed_tags = [stem(tag) for tag in tags]
-            sound.extra_data['stemmed_tags'] = stemmed_tags
-            sound.save()
-    logger.info('Finished computing stem tags for FSD sounds')
+        ground_truth_annotation = GroundTruthAnnotation.objects.filter(sound_dataset_id=sound_dataset_id,
+                                                                       taxonomy_node_id=taxonomy_node_id)\
+            .select_related('taxonomy_node').first()
+        if ground_truth_annotation is not None:
+            ground_truth_annotation.propagate_annotation()
+        else:
+            deleted_annotation = GroundTruthAnnotation(sound_dataset_id=sound_dataset_id,
+                                                       taxonomy_node_id=taxonomy_node_id)
+            for candidate_annotation in CandidateAnnotation.objects.filter(sound_dataset_id=sound_dataset_id,
+                                                                           taxonomy_node_id=taxonomy_node_id):
+                deleted_annotation.unpropagate_annotation(candidate_annotation)
+
+
+@shared_task
+def check_ground_truth_propagation(dataset_id, fix=True):
+    """
+        Finds the ground truth annotations of a dataset whose propagation is missing or incomplete and, if fix is
+        True, enqueues their propagation. Returns the number of ground truth annotations found
+    """
+    logger.info('Start checking ground truth propagation for dataset {0}'.format(dataset_id))
+    num_unpropagated = 0
+    try:
+        dataset = Dataset.objects.get(id=dataset_id)
+        unpropagated = dataset.get_unpropagated_ground_truth_annotations()\
+            .values_list('sound_dataset_id', 'taxonomy_node_id')
+        for sound_dataset_id, taxonomy_node_id in unpropagated:
+            num_unpropagated += 1
+            if fix:
+                enqueue_ground_truth_propagation(sound_dataset_id, taxonomy_node_id)
+    except Dataset.DoesNotExist:
+        pass
+    logger.info('Finished checking ground truth propagation for dataset {0}: {1} ground truth annotations {2}'
+                .format(dataset_id, num_unpropagated, 'enqueued for propagation' if fix else 'not propagated'))
+    return num_unpropagated
+
+
+@shared_task
+def rebuild_candidate_pools(dataset_id):
+    logger.info('Start building candidate annotation pools for dataset {0}'.format(dataset_id))
+    num_candidate_annotations = CandidateAnnotationPools(dataset_id).build()
+    logger.info('Finished building candidate annotation pools for dataset {0} ({1} candidate annotations)'
+                .format(dataset_id, num_candidate_annotations))
+    return num_candidate_annotations
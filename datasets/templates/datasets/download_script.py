@@ -1,143 +1,380 @@
-import urllib2
+"""
+Freesound Datasets download script (Python 3, no dependencies).
+
+Downloads the sounds of the dataset and optionally their metadata and audio features from the Freesound API with a
+pool of workers that keep their connections open, retrying the failed requests with exponential backoff. The
+downloaded sounds are recorded with their sha256 checksum in progress.json, so running the script again resumes the
+download and --verify checks the files already downloaded.
+
+Usage: python fs_download_script.py [-v] [--path fs_dataset] [--workers 4] [--rate 2] [--verify]
+"""
+import argparse
+import email.message
+import gzip
+import hashlib
+import http.client
 import json
-import sys
-import cgi
 import os
+import random
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import Request, urlopen
 
 dataset_url = '{{dataset_url}}'
 get_code_url = 'https://freesound.org/apiv2/oauth2/authorize/?response_type=code&client_id={{get_code_url}}'
 get_access_token_url = '{{access_token_url}}?'
+api_url = 'https://freesound.org/apiv2/'
 
-verbose = False
-tmp_path = "/tmp"
-download_path = "fs_dataset"
-progress = {"downloaded": [], "access_token": None}
-
-sys.stdout.write("FreesoundDataset download script\n")
-sys.stdout.write("--------------------------------\n")
-if len(sys.argv) > 1 and sys.argv[1] == '-v':
-    verbose = True
-
-if verbose:
-    sys.stdout.write("please, enter the location to place the downlaoded files: (default: ./fs_dataset)\n")
-    download_path = raw_input() or 'fs_dataset'
-
-if not os.path.exists(download_path):
-    os.makedirs(download_path+tmp_path)
-
-if os.path.exists(download_path+"/progress.json"):
-    progress = json.load(open(download_path+"/progress.json"))
-
-if not 'features' in progress:
-    sys.stdout.write("You have the option to download the dataset with the "\
-            + "sounds together with the audio features and/or the metadata."\
-            + "Please, Choose an option:\n"\
-            + "1) Download sound+features+metadata (default)\n"\
-            + "2) Download sound+features\n3) Download sound+metadata\n")
-    progress['features'] = raw_input() or '1'
-
-# First try to get access_token from progress.json, if it's expired try to refresh
-expired = True
-if progress["access_token"]:
-    expired = int(time.time())+5*60 > progress["curr_time"] + progress["access_token"]["expires_in"]
-    if expired:
-        progress["access_token"]["refresh_token"]
-        try:
-            refresh_url = get_access_token_url+"refresh_token="+progress["access_token"]["refresh_token"]
-            rsp = urllib2.urlopen(refresh_url)
-            access_token = json.load(rsp)
-            progress["access_token"] = access_token
-            progress["curr_time"] = int(time.time())
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 2 ** 16
 
-            if verbose:
-                sys.stdout.write("Refreshed access_token successfully  %s\n" % access_token["access_token"])
 
-            expired = False
-        except urllib2.HTTPError:
-                sys.stdout.write("Failed refreshing access_token, moving on...\n")
+class DownloadError(Exception):
+    def __init__(self, url, status, retry_after=None):
+        super(DownloadError, self).__init__('{0} returned {1}'.format(url, status))
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RetryableError(DownloadError):
+    pass
+
+
+class RateLimiter(object):
+    """ Spaces the requests made to each host by all the workers by at least 1 / rate seconds """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_request_times = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_times.get(host, now))
+            self.next_request_times[host] = request_time + self.interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+class Client(object):
+    """
+    HTTP client shared by the workers. Each thread keeps one keep-alive connection per host, redirects are followed
+    and the failed requests (connection errors and RETRY_STATUSES) are retried max_retries times waiting
+    backoff * 2 ** attempt seconds with jitter, or what the Retry-After header says. The Authorization header is only
+    sent to the host of the API
+    """
+
+    def __init__(self, access_token, rate_limiter, max_retries=5, backoff=1.0, timeout=60):
+        self.access_token = access_token
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self, scheme, host):
+        connections = self.local.__dict__.setdefault('connections', {})
+        if (scheme, host) not in connections:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connections[(scheme, host)] = connection_class(host, timeout=self.timeout)
+        return connections[(scheme, host)]
+
+    def close_connection(self, scheme, host):
+        connection = self.local.__dict__.get('connections', {}).pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def get(self, url, read_response):
+        """ GETs url and returns read_response(response), which must read the whole response body """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.get_once(url, read_response)
+            except (RetryableError, OSError, http.client.HTTPException) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = getattr(e, 'retry_after', None)
+                if delay is None:
+                    delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                time.sleep(delay)
+
+    def get_once(self, url, read_response):
+        for _ in range(MAX_REDIRECTS):
+            parts = urlsplit(url)
+            headers = {}
+            if self.access_token and parts.netloc == urlsplit(api_url).netloc:
+                headers['Authorization'] = 'Bearer {0}'.format(self.access_token)
+            self.rate_limiter.wait(parts.netloc)
+            connection = self.connection(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', parts.path + ('?' + parts.query if parts.query else ''), headers=headers)
+                response = connection.getresponse()
+                if response.status in REDIRECT_STATUSES:
+                    response.read()
+                    url = urljoin(url, response.getheader('Location'))
+                    continue
+                if response.status != 200:
+                    response.read()
+                    retry_after = response.getheader('Retry-After')
+                    retry_after = int(retry_after) if retry_after and retry_after.isdigit() else None
+                    error_class = RetryableError if response.status in RETRY_STATUSES else DownloadError
+                    raise error_class(url, response.status, retry_after)
+                return read_response(response)
+            except DownloadError:
+                raise
+            except Exception:
+                # the state of the connection is unknown, a new one is opened for the next request
+                self.close_connection(parts.scheme, parts.netloc)
+                raise
+        raise DownloadError(url, 'too many redirects')
+
+
+class Checkpoint(object):
+    """
+    Contents of progress.json: the access token, the chosen features and the downloaded sounds, which are a dict
+    of sound id to file name, size and sha256 checksum. It is saved atomically every flush_every sounds or
+    flush_interval seconds and when the download ends
+    """
+
+    def __init__(self, path, flush_every=100, flush_interval=10):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.data = {'downloaded': {}, 'access_token': None}
+        if os.path.exists(path):
+            self.data.update(json.load(open(path)))
+        if isinstance(self.data['downloaded'], list):
+            # progress.json written by the previous version of the script, which kept no checksums
+            self.data['downloaded'] = {str(sound_id): {} for sound_id in self.data['downloaded']}
+        self.num_pending = 0
+        self.last_flush = time.monotonic()
+
+    @property
+    def downloaded(self):
+        return self.data['downloaded']
+
+    def add(self, sound_id, sound_info):
+        self.downloaded[str(sound_id)] = sound_info
+        self.num_pending += 1
+        if self.num_pending >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
 
-# If access_token it's expired then get a new one using the code given by the user
-while expired:
-    sys.stdout.write("please, go to:\n")
-    sys.stdout.write(get_code_url)
-    sys.stdout.write("\nand copy the code here:\n")
-    code = raw_input()
+    def remove(self, sound_id):
+        self.downloaded.pop(str(sound_id), None)
 
-    if verbose:
-        sys.stdout.write("Requesting access_token using code: %s\n" % code)
+    def flush(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.data, f)
+        os.replace(self.path + '.tmp', self.path)
+        self.num_pending = 0
+        self.last_flush = time.monotonic()
 
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class Downloader(object):
+    """
+    Downloads sounds to download_path with a pool of workers threads. features is '1' for the sounds with their
+    metadata and audio features, '2' for the sounds with their audio features and '3' for the sounds with their metadata
+    """
+
+    def __init__(self, client, download_path, features='1', workers=4, verbose=False):
+        self.client = client
+        self.download_path = download_path
+        self.features = features
+        self.workers = workers
+        self.verbose = verbose
+        self.checkpoint = Checkpoint(os.path.join(download_path, 'progress.json'))
+
+    def save_response(self, path):
+        """ Returns a function that writes the response body to path and returns its size and sha256 checksum """
+        def read_response(response):
+            sha256 = hashlib.sha256()
+            size = 0
+            with open(path, 'wb') as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+            content_length = response.getheader('Content-Length')
+            if content_length is not None and int(content_length) != size:
+                raise http.client.IncompleteRead(b'', int(content_length) - size)
+            message = email.message.Message()
+            message['Content-Disposition'] = response.getheader('Content-Disposition', '')
+            return message.get_filename(), size, sha256.hexdigest()
+        return read_response
+
+    def download_sound(self, sound_id):
+        """ Downloads a sound and the requested metadata and features, and returns the info of the checkpoint """
+        sound_url = urljoin(api_url, 'sounds/{0}/'.format(sound_id))
+        part_path = os.path.join(self.download_path, '{0}.part'.format(sound_id))
+        file_name, size, sha256 = self.client.get(sound_url + 'download/', self.save_response(part_path))
+        file_name = os.path.basename(file_name or str(sound_id))
+        os.replace(part_path, os.path.join(self.download_path, file_name))
+
+        base_path = os.path.join(self.download_path, os.path.splitext(file_name)[0])
+        if self.features in ('1', '3'):
+            self.client.get(sound_url, self.save_response(base_path + '.json'))
+        if self.features in ('1', '2'):
+            self.client.get(sound_url + 'analysis/', self.save_response(base_path + '-analysis.json'))
+        return {'file': file_name, 'size': size, 'sha256': sha256}
+
+    def is_downloaded(self, sound_id, verify=False):
+        """ Checks that the file of a downloaded sound exists and has the right size, or checksum if verify """
+        sound_info = self.checkpoint.downloaded.get(str(sound_id))
+        if sound_info is None:
+            return False
+        if 'file' not in sound_info:
+            return True  # downloaded by the previous version of the script
+        path = os.path.join(self.download_path, sound_info['file'])
+        if not os.path.exists(path) or os.path.getsize(path) != sound_info['size']:
+            return False
+        return not verify or file_sha256(path) == sound_info['sha256']
+
+    def download(self, sound_ids, verify=False):
+        """
+        Downloads the sounds that are not downloaded yet, at most 2 * workers at a time so that the pending sounds are
+        not all queued. Returns the number of sounds downloaded, the ids of the sounds that failed and the elapsed time
+        """
+        pending_sound_ids = [sound_id for sound_id in sound_ids if not self.is_downloaded(sound_id, verify=verify)]
+        for sound_id in pending_sound_ids:
+            self.checkpoint.remove(sound_id)
+        sys.stdout.write('{0} sounds already downloaded, downloading {1} sounds\n'
+                         .format(len(sound_ids) - len(pending_sound_ids), len(pending_sound_ids)))
+
+        start = time.monotonic()
+        num_downloaded = 0
+        failed_sound_ids = []
+        sound_ids_iterator = iter(pending_sound_ids)
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                for sound_id in islice(sound_ids_iterator, 2 * self.workers - len(futures)):
+                    futures[executor.submit(self.download_sound, sound_id)] = sound_id
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sound_id = futures.pop(future)
+                    try:
+                        self.checkpoint.add(sound_id, future.result())
+                        num_downloaded += 1
+                    except (DownloadError, OSError, http.client.HTTPException) as e:
+                        failed_sound_ids.append(sound_id)
+                        if self.verbose:
+                            sys.stdout.write('\nFailed to download sound {0}: {1}\n'.format(sound_id, e))
+                elapsed_time = time.monotonic() - start
+                sys.stdout.write('\rDownloaded {0}/{1} sounds, {2} failed ({3:.1f} sounds/s)'
+                                 .format(num_downloaded, len(pending_sound_ids), len(failed_sound_ids),
+                                         num_downloaded / elapsed_time if elapsed_time else 0))
+                sys.stdout.flush()
+        self.checkpoint.flush()
+        sys.stdout.write('\n')
+        return num_downloaded, failed_sound_ids, time.monotonic() - start
+
+
+def get_sound_ids(url, path):
+    """ Gets the freesound ids of the sounds of the dataset, saved to path and revalidated with their ETag """
+    saved = json.load(open(path)) if os.path.exists(path) else None
+    request = Request(url, headers={'Accept-Encoding': 'gzip'})
+    if saved is not None:
+        request.add_header('If-None-Match', saved['etag'])
     try:
-        rsp = urllib2.urlopen(get_access_token_url+"code="+code)
-        access_token = json.load(rsp)
-        progress["access_token"] = access_token
-        progress["curr_time"] = int(time.time())
-
-        if verbose:
-            sys.stdout.write("Got access_token successfully  %s\n" % access_token["access_token"])
-
-        # Make to call to get list of all the sound ids to download
-        rsp = urllib2.urlopen(dataset_url)
-        progress["sound_ids"] = json.load(rsp)['sounds']
-
-        expired = False
-    except urllib2.HTTPError:
-            sys.stdout.write("Failed getting access_token, retrying...\n")
-
-sounds_dict = {sid: 'https://freesound.org/apiv2/sounds/%s/' % sid for sid in progress['sound_ids']}
-
-# Now start download of sounds on sounds_dict
-sys.stdout.write("Starting download of %d sounds\n" % len(sounds_dict.keys()))
-
-token = progress["access_token"]["access_token"]
-headers = {'Authorization': 'Bearer %s' % token}
-for i in sounds_dict.keys():
-    if i in progress["downloaded"]:
-        sys.stdout.write("Sound %s already downloaded, skipping\n" % i)
-        continue
-    response = 'y'
-    if verbose:
-        sys.stdout.write("Downloading sound: %s\n" % sounds_dict[i])
-        sys.stdout.write("Do you want to download this sound? (enter: yes(y) to download or no(n) to skip)\n")
-        response = raw_input()
-    if response in ('y', 'yes'):
-        sys.stdout.write("Downloading... [%d/%d]" % (len(progress["downloaded"])+1, len(sounds_dict.keys())))
+        with urlopen(request) as response:
+            body = response.read()
+            if response.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            saved = {'etag': response.headers.get('ETag'), 'sounds': json.loads(body.decode())['sounds']}
+    except HTTPError as e:
+        if e.code != 304 or saved is None:
+            raise
+    with open(path, 'w') as f:
+        json.dump(saved, f)
+    return saved['sounds']
 
+
+def get_access_token(checkpoint, verbose=False):
+    """ Refreshes the access token of the checkpoint if it is about to expire, or asks the user for a new one """
+    progress = checkpoint.data
+    if progress['access_token']:
+        expires_at = progress['curr_time'] + progress['access_token']['expires_in']
+        if int(time.time()) + 5 * 60 < expires_at:
+            return progress['access_token']['access_token']
+        try:
+            refresh_token = progress['access_token']['refresh_token']
+            with urlopen(get_access_token_url + urlencode({'refresh_token': refresh_token})) as response:
+                progress['access_token'] = json.loads(response.read().decode())
+            progress['curr_time'] = int(time.time())
+            if verbose:
+                sys.stdout.write('Refreshed access_token successfully\n')
+            return progress['access_token']['access_token']
+        except HTTPError:
+            sys.stdout.write('Failed refreshing access_token, moving on...\n')
+
+    while True:
+        sys.stdout.write('please, go to:\n{0}\nand copy the code here:\n'.format(get_code_url))
+        code = input()
         try:
-            req = urllib2.Request(sounds_dict[i]+"download/", headers=headers)
-            with open(str(i), 'wb') as output:
-                res = urllib2.urlopen(req)
-                output.write(res.read())
-            f_name = download_path + tmp_path + '/' + cgi.parse_header(res.headers['content-disposition'])[1]['filename']
-
-            os.rename(str(i), f_name)
-
-            if progress["features"] in ['1', '3']:
-                req = urllib2.Request(sounds_dict[i], headers=headers)
-                with open(os.path.splitext(f_name)[0]+'.json', 'wb') as output:
-                    output.write(urllib2.urlopen(req).read())
-
-            if progress["features"] in ['1', '2']:
-                req = urllib2.Request(sounds_dict[i]+"analysis/", headers=headers)
-                with open(os.path.splitext(f_name)[0]+'-analysis.json', 'wb') as output:
-                    output.write(urllib2.urlopen(req).read())
-
-        except urllib2.HTTPError:
-            sys.stdout.write("Failed to download %s, skipping\n" % sounds_dict[i])
-            continue
-    progress["downloaded"].append(i)
-    sys.stdout.write(("\rDone: %d/%d                                              "\
-            +"\n") % (len(progress["downloaded"]), len(sounds_dict.keys())))
-    sys.stdout.flush()
-
-    with open(download_path+"/progress.json", 'w') as outfile:
-        json.dump(progress, outfile)
-
-for i in os.listdir(download_path + tmp_path):
-    f_name_from = download_path + tmp_path + '/' + i
-    f_name_to = download_path + '/' + i
-    os.rename(f_name_from,f_name_to)
-
-os.rmdir(download_path + tmp_path)
-
-sys.stdout.write("Download finished!\n")
+            with urlopen(get_access_token_url + urlencode({'code': code})) as response:
+                progress['access_token'] = json.loads(response.read().decode())
+            progress['curr_time'] = int(time.time())
+            if verbose:
+                sys.stdout.write('Got access_token successfully\n')
+            return progress['access_token']['access_token']
+        except HTTPError:
+            sys.stdout.write('Failed getting access_token, retrying...\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FreesoundDataset download script')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print extra information on screen')
+    parser.add_argument('--path', default='fs_dataset', help='Location of the downloaded files')
+    parser.add_argument('--workers', type=int, default=4, help='Number of sounds downloaded at the same time')
+    parser.add_argument('--rate', type=float, default=2, help='Maximum number of requests per second to each host')
+    parser.add_argument('--verify', action='store_true', help='Check the checksums of the downloaded files')
+    args = parser.parse_args()
+
+    sys.stdout.write('FreesoundDataset download script\n')
+    sys.stdout.write('--------------------------------\n')
+    if not os.path.exists(args.path):
+        os.makedirs(args.path)
+
+    client = Client(None, RateLimiter(args.rate))
+    downloader = Downloader(client, args.path, workers=args.workers, verbose=args.verbose)
+    progress = downloader.checkpoint.data
+    if 'features' not in progress:
+        sys.stdout.write('You have the option to download the dataset with the sounds together with the audio '
+                         'features and/or the metadata. Please, Choose an option:\n'
+                         '1) Download sound+features+metadata (default)\n'
+                         '2) Download sound+features\n3) Download sound+metadata\n')
+        progress['features'] = input() or '1'
+    downloader.features = progress['features']
+    client.access_token = get_access_token(downloader.checkpoint, verbose=args.verbose)
+    downloader.checkpoint.flush()
+
+    sound_ids = get_sound_ids(dataset_url, os.path.join(args.path, 'sound_ids.json'))
+    num_downloaded, failed_sound_ids, elapsed_time = downloader.download(sound_ids, verify=args.verify)
+    sys.stdout.write('Downloaded {0} sounds in {1:.1f} seconds ({2:.1f} sounds/s)\n'
+                     .format(num_downloaded, elapsed_time, num_downloaded / elapsed_time if elapsed_time else 0))
+    if failed_sound_ids:
+        sys.stdout.write('{0} sounds could not be downloaded, run the script again to retry them\n'
+                         .format(len(failed_sound_ids)))
+    else:
+        sys.stdout.write('Download finished!\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from django import template
 from urllib.parse import quote
+from datasets.models import get_release_snapshot
 
 
 register = template.Library()
@@ -121,8 +122,13 @@ def display_taxonomy_node_mini_info(dataset, node_id):
 
 @register.inclusion_tag('datasets/dataset_release_taxonomy_node_info.html')
 def display_release_taxonomy_node_info(dataset, release, node_id):
-    all_node_stats = release.taxonomy_node_stats
-    node_stats = next((d for d in all_node_stats if d["node_id"] == node_id), None)
+    snapshot = get_release_snapshot(release)
+    if snapshot is not None:
+        num_sounds = snapshot.num_annotations(node_id)
+        node_stats = {'node_id': node_id, 'num_sounds': num_sounds} if num_sounds else None
+    else:
+        all_node_stats = release.taxonomy_node_stats
+        node_stats = next((d for d in all_node_stats if d["node_id"] == node_id), None)
     node = dataset.taxonomy.get_element_at_id(node_id).as_dict()
     hierarchy_paths = dataset.taxonomy.get_hierarchy_paths(node_id)
     node['hierarchy_paths'] = hierarchy_paths if hierarchy_paths is not None else []
@@ -63,7 +63,7 @@ def load_sound_player_files():
 @register.inclusion_tag('datasets/player.html')
 def sound_player(dataset, freesound_sound_id, player_size, normalization=None):
     sound = dataset.sounds.get(freesound_id=freesound_sound_id)
-    sound_url = sound.extra_data['previews'].replace('https:', '').replace('http:', '')
+    sound_url = sound.preview_url.replace('https:', '').replace('http:', '')
     spec_size = 'M' if player_size in ("mini", "small") else 'L'
     spectrogram_url = sound.get_image_url('spectrogram', spec_size)
     waveform_url = sound.get_image_url('waveform', 'M')
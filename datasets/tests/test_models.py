@@ -1,7 +1,50 @@
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
 from datasets import models
 from datasets.management.commands.generate_fake_data import create_sounds, create_users, create_candidate_annotations, \
-    add_taxonomy_nodes, VALID_FS_IDS, get_dataset
+    create_votes, add_taxonomy_nodes, VALID_FS_IDS, get_dataset
+from datasets.management.commands.benchmark_dataset_taxonomy_stats import per_node_annotation_stats
+from datasets.management.commands.benchmark_load_sounds_for_dataset import generate_sounds_data, \
+    load_sounds_one_by_one
+from datasets.management.commands.benchmark_download_script import FakeFreesoundServer
+from datasets.management.commands.load_sounds_for_dataset import load_sounds
+from datasets.tasks import compute_annotators_ranking, enqueue_ground_truth_propagation, \
+    propagate_ground_truth_annotation, stem_dataset_sound_tags, refresh_sound_deleted_state, refresh_sound_extra_data, \
+    compute_priority_score_candidate_annotations
+from datasets.utils import run_and_measure, stem, iter_json_object_items, query_freesound_by_id, \
+    iter_chunks
+from datasets import freesound
+from django.db.models import Count, Q
+from functools import reduce
+from utils.redis_store import store
+import datetime
+import itertools
+import tempfile
+import types
+import time
+import json
+import io
+import os
+from unittest import mock
+
+
+class SameEffectMixin(object):
+
+    def assertSameEffect(self, reference_fn, fn, snapshot):
+        """
+            Runs reference_fn in a transaction that is rolled back, then fn, and checks that both leave the same
+            snapshot() of the database. Returns the results of reference_fn and fn
+        """
+        with transaction.atomic():
+            reference_result = reference_fn()
+            expected = snapshot()
+            transaction.set_rollback(True)
+        result = fn()
+        self.assertDictEqual(snapshot(), expected)
+        return reference_result, result
 
 
 class TaxonomyTest(TestCase):
@@ -132,6 +175,51 @@ class TaxonomyTestAdvanced(TestCase):
         paths = sorted(self.taxobj.get_hierarchy_paths("3"))
         self.assertListEqual(expected, paths)
 
+    def test_ancestry_closure_depth(self):
+        depths = {(link.ancestor.node_id, link.relation): link.depth
+                  for link in models.TaxonomyNodeAncestor.objects.filter(descendant__node_id="3")}
+        self.assertDictEqual(depths, {("1", "P"): 2, ("2", "P"): 1, ("5", "P"): 1, ("5", "PP"): 1})
+
+    def test_ancestry_closure_has_no_depth_limit(self):
+        edges = [(str(i + 1), str(i)) for i in range(20)] + [("20", "5")]
+        closure = models.ancestry_closure(edges)
+        self.assertEqual(closure[("19", "0")], 19)
+        self.assertEqual(closure[("20", "5")], 1)
+        self.assertEqual(closure[("20", "0")], 6)  # shortest path goes through "5"
+        self.assertEqual(len([key for key in closure if key[0] == "20"]), 20)
+
+    def test_taxonomy_graph_lookups_do_not_query_the_database(self):
+        models.get_taxonomy_graph(self.taxobj.id)
+        with self.assertNumQueries(0):
+            node = self.taxobj.get_element_at_id("3")
+            self.assertListEqual(sorted(node.hierarchy_paths), sorted([["1", "2", "3"], ["5", "3"]]))
+            self.assertListEqual([n.node_id for n in node.get_siblings()], [])
+            self.assertListEqual(sorted(n.node_id for n in self.taxobj.get_element_at_id("2").get_siblings()), ["4"])
+            self.assertListEqual([n.node_id for n in self.taxobj.get_all_propagate_to_parents("3")], ["5"])
+
+    def test_taxonomy_graph_invalidated_on_change(self):
+        graph = models.get_taxonomy_graph(self.taxobj.id)
+        self.assertIs(models.get_taxonomy_graph(self.taxobj.id), graph)
+
+        node = self.taxobj.get_element_at_id("4")
+        node.name = "renamed"
+        node.save()
+        self.assertEqual(self.taxobj.get_element_at_id("4").name, "renamed")
+
+        node.parents.add(self.taxobj.get_element_at_id("5"))
+        self.assertListEqual(sorted(self.taxobj.graph.parent_ids("4")), ["1", "5"])
+
+    def test_taxonomy_graph_version_checked_once_per_interval(self):
+        graph = models.get_taxonomy_graph(self.taxobj.id)
+        with mock.patch.object(models.store, 'get_version', wraps=models.store.get_version) as get_version:
+            for _ in range(3):
+                self.assertIs(models.get_taxonomy_graph(self.taxobj.id), graph)
+            get_version.assert_not_called()
+            with mock.patch('datasets.models.time.monotonic',
+                            return_value=time.monotonic() + models.TAXONOMY_GRAPH_VERSION_CHECK_INTERVAL):
+                self.assertIs(models.get_taxonomy_graph(self.taxobj.id), graph)
+            self.assertEqual(get_version.call_count, 1)
+
     def test_get_nodes_at_level_0(self):
         expected = sorted(["1", "5"])  # first level
         nodes = sorted([n.node_id for n in self.taxobj.get_nodes_at_level(0)])
@@ -148,7 +236,7 @@ class TaxonomyTestAdvanced(TestCase):
         self.assertListEqual(expected, nodes)
 
 
-class DatasetTest(TestCase):
+class DatasetTest(SameEffectMixin, TestCase):
     fixtures = ['datasets/fixtures/initial.json']
 
     def setUp(self):
@@ -218,10 +306,234 @@ class DatasetTest(TestCase):
         node = models.CandidateAnnotation.objects.first().taxonomy_node
         self.assertEqual(self.dataset.num_votes_with_value(node.node_id, 1.0), 2)
 
+    def test_annotation_stats_per_taxonomy_node(self):
+        node = models.CandidateAnnotation.objects.first().taxonomy_node
+        stats = self.dataset.annotation_stats_per_taxonomy_node()
+        self.assertListEqual(list(stats.keys()), [node.node_id])
+        self.assertEqual(stats[node.node_id]['num_annotations'], 1)
+        self.assertEqual(stats[node.node_id]['num_sounds'], 1)
+        self.assertEqual(stats[node.node_id]['num_missing_votes'], 0)
+        self.assertDictEqual(stats[node.node_id]['votes_stats'], {'num_present_and_predominant': 2,
+                                                                  'num_present_not_predominant': 0,
+                                                                  'num_not_present': 0,
+                                                                  'num_unsure': 0})
+
+    def test_annotation_stats_per_taxonomy_node_equals_per_node_queries(self):
+        create_sounds('fsd', 10)
+        create_candidate_annotations('fsd', 30)
+        create_votes(40)
+        models.Vote.objects.filter(id__in=models.Vote.objects.values('id')[:5]).update(test='FA')
+        self.assertDictEqual(self.dataset.annotation_stats_per_taxonomy_node(),
+                             per_node_annotation_stats(self.dataset))
+
+    def test_add_candidate_annotations_equals_creating_them_one_by_one(self):
+        create_sounds('fsd', 12)
+        create_candidate_annotations('fsd', 30)
+        create_votes(40)
+        user = models.User.objects.first()
+        node = models.CandidateAnnotation.objects.first().taxonomy_node
+        skipped_node = models.CandidateAnnotation.objects.exclude(taxonomy_node=node).first().taxonomy_node
+        sounds = self.dataset.sounds.exclude(freesound_id__in=node.candidate_annotations
+                                             .values_list('sound_dataset__sound__freesound_id', flat=True))
+
+        def snapshot():
+            return {
+                'candidate_annotations': sorted(node.candidate_annotations.values_list(
+                    'sound_dataset_id', 'type', 'algorithm', 'created_by_id', 'priority_score')),
+                'counters': models.annotation_counter_values(self.dataset.annotation_counters.all())
+            }
+
+        def create_one_by_one():
+            num_created = 0
+            for sound in sounds:
+                if models.CandidateAnnotation.objects.filter(taxonomy_node__in=[skipped_node],
+                                                             sound_dataset__sound=sound).count() == 0:
+                    models.CandidateAnnotation.objects.create(
+                        sound_dataset=sound.sounddataset_set.filter(dataset=self.dataset).first(),
+                        type='AU', algorithm='test', taxonomy_node=node, created_by=user).update_priority_score()
+                    num_created += 1
+            return num_created
+
+        num_created_one_by_one, num_created = self.assertSameEffect(
+            create_one_by_one,
+            lambda: self.dataset.add_candidate_annotations(node, sounds, skip_taxonomy_nodes=[skipped_node],
+                                                           type='AU', algorithm='test', created_by=user),
+            snapshot)
+        self.assertLess(0, num_created)
+        self.assertEqual(num_created, num_created_one_by_one)
+
     def test_user_is_maintainer(self):
         user = models.User.objects.first()
         self.assertEqual(self.dataset.user_is_maintainer(user), True)
 
+    def test_annotation_counters_updated_on_write(self):
+        create_sounds('fsd', 10)
+        create_candidate_annotations('fsd', 30)
+        create_votes(40)
+        models.Vote.objects.create(candidate_annotation=models.CandidateAnnotation.objects.last(), vote=1.0,
+                                   from_expert=True)
+        models.CandidateAnnotation.objects.first().delete()
+
+        counters = models.annotation_counter_values(self.dataset.annotation_counters.all())
+        counters = {node_id: values for node_id, values in counters.items() if any(values.values())}
+        self.assertDictEqual(counters, self.dataset.compute_annotation_counters())
+
+        totals = self.dataset.get_annotation_counters()
+        self.assertEqual(totals['num_annotations'], self.dataset.num_annotations)
+        self.assertEqual(totals['num_validated_annotations'], self.dataset.num_validated_annotations)
+        self.assertEqual(totals['num_verified_annotations'], self.dataset.num_verified_annotations)
+        self.assertEqual(totals['num_ground_truth_annotations'], self.dataset.num_ground_truth_annotations)
+        self.assertEqual(totals['num_user_contributions'], self.dataset.num_user_contributions)
+
+    def test_open_annotation_counters_updated_on_write(self):
+        create_sounds('fsd', 10)
+        create_candidate_annotations('fsd', 30)
+        create_votes(40)
+        candidate_annotation = self.dataset.candidate_annotations.filter(ground_truth=None).last()
+        candidate_annotation.taxonomy_node.freesound_examples.add(candidate_annotation.sound_dataset.sound)
+        self.dataset.candidate_annotations.filter(ground_truth=None).first().delete()
+        models.Sound.objects.filter(id=models.Sound.objects.first().id).update(extra_data={'duration': 45}, duration=45)
+        self.dataset.compute_priority_scores()
+
+        expected_counters = self.dataset.compute_annotation_counters()
+        for taxonomy_node_id, counter in self.dataset.get_annotation_counters_per_taxonomy_node().items():
+            self.assertEqual(expected_counters.get(taxonomy_node_id, {}).get('num_open_annotations', 0),
+                             counter.num_open_annotations)
+
+    def test_get_categories_to_validate_equals_user_can_annotate(self):
+        create_sounds('fsd', 10)
+        create_candidate_annotations('fsd', 30)
+        create_votes(40)
+        for user in models.User.objects.all():
+            categories_to_validate = set(self.dataset.get_categories_to_validate(user))
+            for node in self.dataset.taxonomy.taxonomynode_set.filter(candidate_annotations__isnull=False).distinct():
+                self.assertEqual(self.dataset.user_can_annotate(node.node_id, user), node in categories_to_validate)
+
+    def test_reconcile_annotation_counters(self):
+        node = models.CandidateAnnotation.objects.first().taxonomy_node
+        self.dataset.annotation_counters.update(num_user_contributions=0, num_annotations=5)
+        call_command('reconcile_annotation_counters', 'fsd')
+        counter = self.dataset.annotation_counters.get(taxonomy_node=node)
+        self.assertEqual(counter.num_user_contributions, 2)
+        self.assertEqual(counter.num_annotations, 1)
+
+    def test_compute_priority_scores_equals_return_priority_score(self):
+        create_sounds('fsd', 10)
+        create_candidate_annotations('fsd', 40)
+        create_votes(60)
+        models.Sound.objects.filter(id=models.Sound.objects.first().id).update(extra_data={'duration': 45}, duration=45)
+        models.CandidateAnnotation.objects.update(priority_score=-1)
+
+        rescored = self.dataset.compute_priority_scores()
+        self.assertLess(0, len(rescored))
+        for candidate_annotation in self.dataset.candidate_annotations.filter(ground_truth=None):
+            self.assertEqual(candidate_annotation.return_priority_score(), candidate_annotation.priority_score)
+        self.assertSetEqual(set(rescored), set(self.dataset.candidate_annotations.filter(ground_truth=None)
+                                               .values_list('id', 'taxonomy_node_id', 'priority_score')))
+        self.assertListEqual([], self.dataset.compute_priority_scores())
+
+    def test_compute_priority_scores_incremental(self):
+        create_sounds('fsd', 10)
+        create_candidate_annotations('fsd', 40)
+        models.CandidateAnnotation.objects.update(priority_score=-1)
+        watermark = timezone.now()
+        candidate_annotation = self.dataset.candidate_annotations.filter(ground_truth=None).last()
+        models.Vote.objects.create(created_by=models.User.objects.first(), vote=1.0,
+                                   candidate_annotation=candidate_annotation)
+        models.CandidateAnnotation.objects.update(priority_score=-1)
+
+        self.dataset.compute_priority_scores(since=watermark)
+        rescored = self.dataset.candidate_annotations.exclude(priority_score=-1)
+        self.assertSetEqual({candidate_annotation.sound_dataset_id},
+                            set(rescored.values_list('sound_dataset_id', flat=True)))
+
+    def test_compute_annotators_ranking(self):
+        candidate_annotation = models.CandidateAnnotation.objects.first()
+        create_users(2)  # username_2 votes against the other users, username_3 does not contribute
+        models.Vote.objects.create(
+            created_by=models.User.objects.get(username='username_2'),
+            vote=-1.0,
+            visited_sound=False,
+            candidate_annotation_id=candidate_annotation.id,
+        )
+        # the vote of username_0 is old but still counts for the agreement of the votes made today
+        models.Vote.objects.filter(created_by__username='username_0')\
+            .update(created_at=timezone.now() - datetime.timedelta(days=10))
+
+        compute_annotators_ranking('test_annotators_ranking', self.dataset.id)
+        annotators_ranking = store.get('test_annotators_ranking')
+        self.assertListEqual(sorted(annotators_ranking['ranking']),
+                             [['username_0', 1], ['username_1', 1], ['username_2', 1]])
+        self.assertListEqual(sorted(annotators_ranking['ranking_last_week']), [['username_1', 1], ['username_2', 1]])
+        self.assertListEqual(sorted(annotators_ranking['ranking_today']), [['username_1', 1], ['username_2', 1]])
+        self.assertListEqual(annotators_ranking['ranking_agreement_today'], [['username_1', 1.0], ['username_2', 0.0]])
+
+    def test_retrieve_sound_by_tags_equals_json_filters(self):
+        create_sounds('fsd', 12)
+        vocabulary = ['dog', 'dogs', 'bark', 'barking', 'cat', 'meow', 'field-recording']
+        for count, sound in enumerate(models.Sound.objects.all()):
+            sound.extra_data['tags'] = vocabulary[count % 5:count % 5 + 3]
+            sound.extra_data['stemmed_tags'] = [stem(tag) for tag in sound.extra_data['tags']]
+            sound.save()
+
+        def json_filter(positive_tags, negative_tags, preproc_positive, preproc_negative):
+            sounds = self.dataset.sounds.all()
+            positive_field = 'extra_data__stemmed_tags__contains' if preproc_positive else 'extra_data__tags__contains'
+            negative_field = 'extra_data__stemmed_tags__contains' if preproc_negative else 'extra_data__tags__contains'
+            if positive_tags:
+                sounds = sounds.filter(reduce(lambda x, y: x | y,
+                                              [reduce(lambda w, z: w & z, [Q(**{positive_field: tag}) for tag in tags])
+                                               for tags in positive_tags]))
+            for tag in negative_tags:
+                sounds = sounds.exclude(**{negative_field: tag})
+            return set(sounds.values_list('id', flat=True))
+
+        for positive_tags, negative_tags, preproc_positive, preproc_negative in (
+                ([['dog']], [], True, False),
+                ([['dog', 'bark']], [], False, False),
+                ([['dog', 'bark'], ['cat']], ['meow'], True, False),
+                ([['bark'], ['meow']], ['barking'], False, True),
+                ([], ['dog', 'cat'], True, False),
+                ([['unknown']], [], True, False)):
+            self.assertSetEqual(set(self.dataset.retrieve_sound_by_tags(positive_tags, negative_tags, preproc_positive,
+                                                                        preproc_negative).values_list('id', flat=True)),
+                                json_filter(positive_tags, negative_tags, preproc_positive, preproc_negative))
+
+        # the indexes are built again when the tags change
+        sound = models.Sound.objects.first()
+        sound.extra_data['stemmed_tags'] = ['unknown']
+        sound.save()
+        self.assertSetEqual(set(self.dataset.retrieve_sound_by_tags([['unknown']], []).values_list('id', flat=True)),
+                            {sound.id})
+
+    def test_quality_estimate_mapping(self):
+        create_sounds('fsd', 10)
+        create_candidate_annotations('fsd', 30)
+        create_votes(60)
+        for count, sound in enumerate(models.Sound.objects.all()):
+            sound.extra_data['tags'] = ['tag{0}'.format(count % 3), 'common']
+            sound.save()
+        node = models.CandidateAnnotation.objects.values('taxonomy_node__node_id')\
+            .annotate(num_votes=Count('votes')).order_by('-num_votes')[0]['taxonomy_node__node_id']
+        results = self.dataset.sounds.filter(id__in=models.Sound.objects.values('id')[:7])
+
+        votes = models.Vote.objects.filter(candidate_annotation__sound_dataset__dataset=self.dataset,
+                                           candidate_annotation__taxonomy_node__node_id=node,
+                                           candidate_annotation__sound_dataset__sound__in=results)\
+            .exclude(test='FA')
+        tags_in_NP = [tag for vote in votes if vote.vote == -1
+                      for tag in vote.candidate_annotation.sound_dataset.sound.extra_data['tags']]
+
+        with self.assertNumQueries(2):
+            quality_estimate = self.dataset.quality_estimate_mapping(results, node)
+        self.assertEqual(quality_estimate['num_votes'], votes.count())
+        for key, value in (('num_PP', 1.0), ('num_PNP', 0.5), ('num_NP', -1.0), ('num_U', 0.0)):
+            self.assertEqual(quality_estimate[key], votes.filter(vote=value).count())
+        self.assertDictEqual(dict(quality_estimate['tags_in_NP']),
+                             {tag: tags_in_NP.count(tag) for tag in tags_in_NP})
+        counts = [count for _, count in quality_estimate['tags_in_NP']]
+        self.assertListEqual(counts, sorted(counts, reverse=True))
+
 
 class GroundTruthAnnotationTest(TestCase):
 
@@ -378,6 +690,20 @@ class GroundTruthAnnotationTest(TestCase):
         self.assertEqual(0, models.GroundTruthAnnotation.objects.filter(
                                 taxonomy_node=self.taxonomy_node_to_propagate_to).count())
 
+    def test_nb_ground_truth_updated_without_invalidating_the_taxonomy_graph(self):
+        version_key = models.TAXONOMY_VERSION_KEY_TEMPLATE.format(self.taxonomy_node.taxonomy_id)
+        version = store.get_version(version_key)
+        graph = self.taxonomy_node.taxonomy_graph
+        node_id = self.taxonomy_node_to_propagate_to.node_id
+
+        self.gt_annotation.propagate_annotation()
+        self.assertEqual(graph.node(node_id).nb_ground_truth, 1)
+        self.gt_annotation.unpropagate_annotation(self.candidate_annotation)
+        self.assertEqual(graph.node(node_id).nb_ground_truth, 0)
+
+        self.assertEqual(store.get_version(version_key), version)
+        self.assertIs(self.taxonomy_node.taxonomy_graph, graph)
+
     def test_unpropagate_ground_truth_annotation_does_not_remove_ground_truth_if_multiple_children_annotations(self):
         # first create candidate
         second_candidate_annotation = models.CandidateAnnotation.objects.create(
@@ -406,6 +732,42 @@ class GroundTruthAnnotationTest(TestCase):
             models.GroundTruthAnnotation.objects.filter(taxonomy_node=self.taxonomy_node_to_propagate_to).count()
         )
 
+    def test_ground_truth_propagation_requests_are_coalesced(self):
+        sound_dataset_id = self.gt_annotation.sound_dataset_id
+        with mock.patch.object(propagate_ground_truth_annotation, 'delay') as delay:
+            self.assertTrue(enqueue_ground_truth_propagation(sound_dataset_id, self.taxonomy_node.id))
+            self.assertFalse(enqueue_ground_truth_propagation(sound_dataset_id, self.taxonomy_node.id))
+            delay.assert_called_once_with(sound_dataset_id, self.taxonomy_node.id)
+
+            # running the task clears the pending propagation, running it again changes nothing
+            propagate_ground_truth_annotation(sound_dataset_id, self.taxonomy_node.id)
+            propagate_ground_truth_annotation(sound_dataset_id, self.taxonomy_node.id)
+            self.assertEqual(1, self.taxonomy_node_to_propagate_to.num_ground_truth_annotations)
+            self.assertTrue(enqueue_ground_truth_propagation(sound_dataset_id, self.taxonomy_node.id))
+        propagate_ground_truth_annotation(sound_dataset_id, self.taxonomy_node.id)
+
+    def test_ground_truth_propagation_request_is_not_coalesced_when_enqueueing_fails(self):
+        sound_dataset_id = self.gt_annotation.sound_dataset_id
+        with mock.patch.object(propagate_ground_truth_annotation, 'delay', side_effect=ConnectionError) as delay:
+            self.assertFalse(enqueue_ground_truth_propagation(sound_dataset_id, self.taxonomy_node.id))
+            delay.side_effect = None
+            self.assertTrue(enqueue_ground_truth_propagation(sound_dataset_id, self.taxonomy_node.id))
+            self.assertEqual(2, delay.call_count)
+        propagate_ground_truth_annotation(sound_dataset_id, self.taxonomy_node.id)
+
+    def test_propagation_task_unpropagates_deleted_ground_truth_annotation(self):
+        self.gt_annotation.propagate_annotation()
+        self.gt_annotation.delete()
+        propagate_ground_truth_annotation(self.gt_annotation.sound_dataset_id, self.taxonomy_node.id)
+        self.assertEqual(0, self.taxonomy_node_to_propagate_to.num_ground_truth_annotations)
+
+    def test_check_ground_truth_propagation(self):
+        self.assertListEqual([self.gt_annotation],
+                             list(self.dataset.get_unpropagated_ground_truth_annotations()))
+        call_command('check_ground_truth_propagation', 'fsd')
+        self.assertFalse(self.dataset.get_unpropagated_ground_truth_annotations().exists())
+        self.assertEqual(1, self.taxonomy_node_to_propagate_to.num_ground_truth_annotations)
+
 
 class VoteTest(TestCase):
     fixtures = ['datasets/fixtures/initial.json']
@@ -437,6 +799,46 @@ class VoteTest(TestCase):
         # check that the candidate annotation has ground truth field set
         self.assertEqual(1.0, self.candidate_annotation.ground_truth)
 
+    def test_save_votes_enqueues_ground_truth_propagation_on_commit(self):
+        # TestCase never commits, run the on_commit callbacks by hand
+        with mock.patch('django.db.transaction.on_commit') as on_commit, \
+                mock.patch.object(propagate_ground_truth_annotation, 'delay') as delay:
+            for user in self.users:
+                models.Vote.objects.create(
+                    created_by=user,
+                    vote=1.0,
+                    candidate_annotation=self.candidate_annotation,
+                )
+            delay.assert_not_called()
+            for args, kwargs in on_commit.call_args_list:
+                args[0]()
+        delay.assert_called_once_with(self.candidate_annotation.sound_dataset_id,
+                                      self.candidate_annotation.taxonomy_node_id)
+        propagate_ground_truth_annotation(self.candidate_annotation.sound_dataset_id,
+                                          self.candidate_annotation.taxonomy_node_id)
+
+    def test_save_votes_keeps_the_votes_when_enqueueing_fails(self):
+        with mock.patch('django.db.transaction.on_commit') as on_commit, \
+                mock.patch.object(propagate_ground_truth_annotation, 'delay', side_effect=ConnectionError) as delay:
+            for user in self.users:
+                models.Vote.objects.create(
+                    created_by=user,
+                    vote=1.0,
+                    candidate_annotation=self.candidate_annotation,
+                )
+            with self.assertLogs('tasks', level='ERROR'):
+                for args, kwargs in on_commit.call_args_list:
+                    args[0]()
+            self.assertEqual(1, delay.call_count)
+            self.assertEqual(len(self.users), self.candidate_annotation.votes.count())
+
+            # the flag was cleared, the propagation can be enqueued again by check_ground_truth_propagation
+            delay.side_effect = None
+            self.assertTrue(enqueue_ground_truth_propagation(self.candidate_annotation.sound_dataset_id,
+                                                             self.candidate_annotation.taxonomy_node_id))
+        propagate_ground_truth_annotation(self.candidate_annotation.sound_dataset_id,
+                                          self.candidate_annotation.taxonomy_node_id)
+
     def test_save_one_expert_vote_creates_ground_truth_annotation(self):
         user = self.users.first()
         models.Vote.objects.create(
@@ -512,6 +914,178 @@ class VoteTest(TestCase):
         # TODO: this test needs more controllable data such as the one in GroundTruthAnnotationTest setUp taxonomy
 
 
+class SaveVotesTest(SameEffectMixin, TestCase):
+
+    def setUp(self):
+        taxonomy = {
+            "1": {
+                "id": "1",
+                "name": "1",
+                "description": "This is a root category",
+                "child_ids": ["2", "3"],
+                "restrictions": [],
+                "citation_uri": "",
+            },
+            "2": {
+                "id": "2",
+                "name": "2",
+                "description": "This is a leaf category",
+                "child_ids": [],
+                "parent_ids": ["1"],
+                "propagate_to_parent_ids": ["1"],
+                "restrictions": [],
+                "citation_uri": "",
+            },
+            "3": {
+                "id": "3",
+                "name": "3",
+                "description": "This is a leaf category",
+                "child_ids": [],
+                "parent_ids": ["1"],
+                "propagate_to_parent_ids": ["1"],
+                "restrictions": [],
+                "citation_uri": "",
+            },
+        }
+        self.taxobj = models.Taxonomy.objects.create(data=taxonomy)
+        add_taxonomy_nodes(self.taxobj)
+        self.dataset = models.Dataset.objects.create(short_name='fsd', taxonomy=self.taxobj)
+        create_sounds('fsd', 6)
+        create_users(3)
+        self.users = models.User.objects.order_by('id')
+        sound_datasets = models.SoundDataset.objects.order_by('id')
+        node_2 = self.taxobj.get_element_at_id("2")
+        node_3 = self.taxobj.get_element_at_id("3")
+
+        # previous votes of each candidate annotation, voted again below by the last user
+        previous_votes = [
+            (sound_datasets[0], node_2, [(1.0, 'UN')]),  # a ground truth annotation is created and propagated
+            (sound_datasets[1], node_3, []),  # no agreement yet
+            (sound_datasets[2], node_2, [(-1.0, 'UN')]),  # agreement on not present
+            (sound_datasets[3], node_3, [(1.0, 'UN'), (1.0, 'UN')]),  # existing ground truth annotation
+            (sound_datasets[4], node_2, [(1.0, 'FA')]),  # failed test votes do not count
+            (sound_datasets[5], node_3, [(0.5, 'UN')]),  # joins the ground truth annotation propagated from node 2
+        ]
+        models.GroundTruthAnnotation.objects.create(ground_truth=1.0, sound_dataset=sound_datasets[5],
+                                                    taxonomy_node=node_2, from_propagation=False)\
+            .propagate_annotation()
+        models.GroundTruthAnnotation.objects.create(ground_truth=1.0, sound_dataset=sound_datasets[5],
+                                                    taxonomy_node=node_3, from_propagation=True)
+        self.candidate_annotations = []
+        for sound_dataset, taxonomy_node, votes in previous_votes:
+            candidate_annotation = models.CandidateAnnotation.objects.create(
+                sound_dataset=sound_dataset, type='AU', algorithm='Fake algorithm name', taxonomy_node=taxonomy_node)
+            for user, (vote, test) in zip(self.users, votes):
+                models.Vote.objects.create(created_by=user, vote=vote, test=test,
+                                           candidate_annotation=candidate_annotation)
+            self.candidate_annotations.append(candidate_annotation)
+
+    def new_votes(self):
+        user = self.users.last()
+        return [models.Vote(created_by=user, vote=vote, test='AP', candidate_annotation_id=candidate_annotation.id)
+                for candidate_annotation, vote in zip(self.candidate_annotations, (1.0, 1.0, -1.0, 0.5, 1.0, 0.5))]
+
+    def snapshot(self):
+        return {
+            'candidate_annotations': sorted(models.CandidateAnnotation.objects
+                                            .values_list('id', 'ground_truth', 'priority_score')),
+            'ground_truth_annotations': sorted(
+                (gt.sound_dataset_id, gt.taxonomy_node_id, gt.ground_truth, gt.from_propagation,
+                 sorted(gt.from_candidate_annotations.values_list('id', flat=True)))
+                for gt in models.GroundTruthAnnotation.objects.all()),
+            'votes': sorted(models.Vote.objects.values_list('candidate_annotation_id', 'created_by_id', 'vote', 'test')),
+            'counters': sorted(models.AnnotationCounter.objects
+                               .values_list('taxonomy_node_id', *models.AnnotationCounter.COUNTER_FIELDS)),
+            'nb_ground_truth': sorted(models.TaxonomyNode.objects.values_list('id', 'nb_ground_truth')),
+        }
+
+    def test_save_votes_equals_saving_votes_one_by_one(self):
+        (_, num_queries_one_by_one, _), (_, num_queries, _) = self.assertSameEffect(
+            lambda: run_and_measure(lambda: [vote.save() for vote in self.new_votes()]),
+            lambda: run_and_measure(models.save_votes, self.new_votes()),
+            self.snapshot)
+        self.assertLess(num_queries, num_queries_one_by_one)
+
+    def test_save_votes_falls_back_to_vote_save_for_expert_votes(self):
+        votes = self.new_votes()
+        votes[3].vote = -1.0
+        votes[3].from_expert = True
+        models.save_votes(votes)
+        self.assertFalse(models.GroundTruthAnnotation.objects
+                         .filter(sound_dataset=self.candidate_annotations[3].sound_dataset,
+                                 taxonomy_node=self.candidate_annotations[3].taxonomy_node).exists())
+
+
+class CandidateAnnotationPoolsTest(TestCase):
+    fixtures = ['datasets/fixtures/initial.json']
+
+    def setUp(self):
+        add_taxonomy_nodes(models.Taxonomy.objects.get())
+        create_sounds('fsd', 10)
+        create_users(2)
+        create_candidate_annotations('fsd', 40)
+        self.dataset = models.Dataset.objects.get(short_name='fsd')
+        self.user = models.User.objects.first()
+        self.candidate_annotation = models.CandidateAnnotation.objects.first()
+        self.node = self.candidate_annotation.taxonomy_node
+        self.pools = models.CandidateAnnotationPools(self.dataset.id)
+        self.pools.build()
+
+    def tearDown(self):
+        self.pools.delete()
+
+    def candidate_annotation_ids_to_validate(self, user):
+        return self.pools.get_candidate_annotation_ids_to_validate(self.node, user, 1000)
+
+    def test_candidate_annotation_ids_to_validate(self):
+        expected_ids = self.dataset.non_ground_truth_annotations_per_taxonomy_node(self.node.node_id)\
+            .order_by('-priority_score').values_list('id', 'priority_score')
+        candidate_annotation_ids = self.candidate_annotation_ids_to_validate(self.user)
+        self.assertSetEqual({candidate_annotation_id for candidate_annotation_id, _ in expected_ids},
+                            set(candidate_annotation_ids))
+        priority_scores = dict(expected_ids)
+        self.assertListEqual(sorted([priority_scores[candidate_annotation_id]
+                                     for candidate_annotation_id in candidate_annotation_ids], reverse=True),
+                             [priority_scores[candidate_annotation_id]
+                              for candidate_annotation_id in candidate_annotation_ids])
+
+    def test_candidate_annotation_pools_updated_on_vote(self):
+        models.Vote.objects.create(created_by=self.user, vote=1.0, candidate_annotation=self.candidate_annotation)
+        self.assertNotIn(self.candidate_annotation.id, self.candidate_annotation_ids_to_validate(self.user))
+        other_user = models.User.objects.last()
+        self.assertIn(self.candidate_annotation.id, self.candidate_annotation_ids_to_validate(other_user))
+
+        models.Vote.objects.create(created_by=other_user, vote=1.0, candidate_annotation=self.candidate_annotation)
+        self.assertEqual(1.0, models.CandidateAnnotation.objects.get(id=self.candidate_annotation.id).ground_truth)
+        self.assertIsNone(store.r.zscore(self.pools.pool_key(self.node.id), self.candidate_annotation.id))
+
+    def test_stale_candidate_annotations_removed_from_pool(self):
+        # a queryset update does not send the signals that keep the pools up to date
+        models.CandidateAnnotation.objects.filter(id=self.candidate_annotation.id).update(ground_truth=1.0)
+        self.assertIsNotNone(store.r.zscore(self.pools.pool_key(self.node.id), self.candidate_annotation.id))
+        self.assertNotIn(self.candidate_annotation.id, self.candidate_annotation_ids_to_validate(self.user))
+        self.assertIsNone(store.r.zscore(self.pools.pool_key(self.node.id), self.candidate_annotation.id))
+
+    def test_user_can_annotate(self):
+        node_candidate_annotations = self.dataset.non_ground_truth_annotations_per_taxonomy_node(self.node.node_id)
+        self.assertTrue(self.dataset.user_can_annotate(self.node.node_id, self.user))
+        node_candidate_annotations.update(priority_score=0)
+        self.pools.build()
+        self.assertFalse(self.dataset.user_can_annotate(self.node.node_id, self.user))
+
+    def test_rescored_candidate_annotations_updated_in_pool(self):
+        self.dataset.compute_priority_scores()
+        rescored_candidate_annotation = self.dataset.non_ground_truth_annotations_per_taxonomy_node(
+            self.node.node_id).first()
+        models.CandidateAnnotation.objects.filter(id=rescored_candidate_annotation.id).update(priority_score=-1)
+        with mock.patch.object(models.CandidateAnnotationPools, 'build') as build:
+            self.assertEqual(1, compute_priority_score_candidate_annotations())
+            build.assert_not_called()
+        rescored_candidate_annotation.refresh_from_db()
+        self.assertEqual(store.r.zscore(self.pools.pool_key(self.node.id), rescored_candidate_annotation.id),
+                         rescored_candidate_annotation.priority_score)
+
+
 class CandidateAnnotationTest(TestCase):
     fixtures = ['datasets/fixtures/initial.json']
 
@@ -577,3 +1151,367 @@ class CandidateAnnotationTest(TestCase):
         self.assertEqual(1.0, self.candidate_annotation.ground_truth_state)
 
     # TODO: add test priority score
+
+
+class SoundTest(TestCase):
+    fixtures = ['datasets/fixtures/initial.json']
+
+    def test_save_updates_extra_data_columns(self):
+        sound = models.Sound.objects.create(name='Sound', freesound_id=384240, extra_data={
+            'duration': 3,
+            'license': 'http://creativecommons.org/licenses/by/3.0/',
+            'previews': 'https://freesound.org/data/previews/188/188440_3399958-hq.ogg'})
+        sound.refresh_from_db()
+        self.assertEqual(sound.duration, 3.0)
+        self.assertEqual(sound.license, 'http://creativecommons.org/licenses/by/3.0/')
+        self.assertEqual(sound.preview_url, 'https://freesound.org/data/previews/188/188440_3399958-hq.ogg')
+
+        sound.extra_data = {'duration': 'unknown'}
+        sound.save()
+        sound.refresh_from_db()
+        self.assertEqual((sound.duration, sound.license, sound.preview_url), (None, None, None))
+
+    def test_priority_score_of_sound_without_duration(self):
+        add_taxonomy_nodes(models.Taxonomy.objects.get())
+        create_sounds('fsd', 1)
+        create_users(1)
+        create_candidate_annotations('fsd', 1)
+        models.Sound.objects.update(extra_data={}, duration=None)
+        candidate_annotation = models.CandidateAnnotation.objects.first()
+        self.assertEqual(candidate_annotation.return_priority_score(), 0)
+        models.Dataset.objects.get(short_name='fsd').compute_priority_scores()
+        candidate_annotation.refresh_from_db()
+        self.assertEqual(candidate_annotation.priority_score, 0)
+
+    def test_get_tag_stems(self):
+        self.assertDictEqual(models.get_tag_stems(['barking', 'dogs', 'barking']),
+                             {'barking': stem('barking'), 'dogs': stem('dogs')})
+        with self.assertNumQueries(1):
+            self.assertDictEqual(models.get_tag_stems(['dogs']), {'dogs': stem('dogs')})
+        self.assertEqual(models.TagStem.objects.count(), 2)
+
+    def test_stem_dataset_sound_tags_only_updates_sounds_with_changed_tags(self):
+        create_sounds('fsd', 5)
+        for sound in models.Sound.objects.all():
+            sound.extra_data['tags'] = ['barking', 'dogs', 'Field-Recording']
+            sound.save()
+        self.assertEqual(stem_dataset_sound_tags(chunk_size=2), 5)
+        for sound in models.Sound.objects.all():
+            self.assertListEqual(sound.extra_data['stemmed_tags'], [stem(tag) for tag in sound.extra_data['tags']])
+
+        sound = models.Sound.objects.first()
+        sound.extra_data['tags'].append('cats')
+        sound.save()
+        self.assertEqual(stem_dataset_sound_tags(chunk_size=2), 1)
+        sound.refresh_from_db()
+        self.assertListEqual(sound.extra_data['stemmed_tags'], [stem(tag) for tag in sound.extra_data['tags']])
+
+
+class LoadSoundsForDatasetTest(SameEffectMixin, TestCase):
+    fixtures = ['datasets/fixtures/initial.json']
+
+    def setUp(self):
+        add_taxonomy_nodes(models.Taxonomy.objects.get())
+        self.dataset = models.Dataset.objects.get(short_name='fsd')
+        self.sounds_data = generate_sounds_data(self.dataset, 9)
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.json')
+        json.dump(self.sounds_data, self.file, indent=2)
+        self.file.flush()
+
+    def tearDown(self):
+        self.file.close()
+
+    def snapshot(self):
+        return {
+            'sounds': sorted(models.Sound.objects.values_list('freesound_id', 'name', 'extra_data', 'duration',
+                                                              'license', 'preview_url')),
+            'candidate_annotations': sorted(self.dataset.candidate_annotations.values_list(
+                'sound_dataset__sound__freesound_id', 'taxonomy_node_id', 'type', 'algorithm', 'priority_score')),
+            'counters': models.annotation_counter_values(self.dataset.annotation_counters.all())
+        }
+
+    def test_iter_json_object_items(self):
+        for read_size in (1, 7, 2 ** 16):
+            self.file.seek(0)
+            with open(self.file.name) as f:
+                self.assertListEqual(list(iter_json_object_items(f, read_size=read_size)),
+                                     list(self.sounds_data.items()))
+        self.assertListEqual(list(iter_json_object_items(io.StringIO(' {}'))), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_object_items(io.StringIO('{"1": {"name": ')))
+
+    def test_load_sounds_equals_loading_them_one_by_one(self):
+        self.assertSameEffect(
+            lambda: load_sounds_one_by_one(self.dataset, self.file.name, 'test'),
+            lambda: call_command('load_sounds_for_dataset', 'fsd', self.file.name, 'test', batch_size=4),
+            self.snapshot)
+        self.assertFalse(os.path.exists(self.file.name + '.checkpoint'))
+
+    def test_load_sounds_resumes_from_checkpoint(self):
+        def resume_from_checkpoint():
+            # the sounds of the batch after the checkpoint were committed but the checkpoint was not written
+            load_sounds(self.dataset, list(self.sounds_data.items())[:6], 'test', batch_size=2)
+            with open(self.file.name + '.checkpoint', 'w') as f:
+                json.dump({'num_sounds': 4, 'num_candidate_annotations': 0,
+                           'started_at': timezone.now().isoformat()}, f)
+            call_command('load_sounds_for_dataset', 'fsd', self.file.name, 'test', batch_size=2)
+
+        self.assertSameEffect(
+            lambda: call_command('load_sounds_for_dataset', 'fsd', self.file.name, 'test'),
+            resume_from_checkpoint,
+            self.snapshot)
+
+
+class LoadDatasetReleaseTest(TestCase):
+    fixtures = ['datasets/fixtures/initial.json']
+
+    def setUp(self):
+        add_taxonomy_nodes(models.Taxonomy.objects.get())
+        create_sounds('fsd', 4)
+        self.dataset = models.Dataset.objects.get(short_name='fsd')
+        self.sounds = list(models.Sound.objects.order_by('id'))
+        self.nodes = list(self.dataset.taxonomy.taxonomynode_set.order_by('id')[:2])
+        sound_datasets = [sound.sounddataset_set.get() for sound in self.sounds]
+        candidate_annotation = models.CandidateAnnotation.objects.create(
+            sound_dataset=sound_datasets[0], taxonomy_node=self.nodes[0], type='AU', ground_truth=1.0)
+        ground_truth_annotation = models.GroundTruthAnnotation.objects.create(
+            sound_dataset=sound_datasets[0], taxonomy_node=self.nodes[0], ground_truth=1.0, partition='dev')
+        ground_truth_annotation.from_candidate_annotations.add(candidate_annotation)
+        models.CandidateAnnotation.objects.create(sound_dataset=sound_datasets[1], taxonomy_node=self.nodes[0],
+                                                  type='AU', ground_truth=0.5)
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.json')
+        self.release_files_folder = tempfile.TemporaryDirectory()
+        self.release_files_settings = override_settings(DATASET_RELEASE_FILES_FOLDER=self.release_files_folder.name)
+        self.release_files_settings.enable()
+
+    def tearDown(self):
+        self.file.close()
+        self.release_files_settings.disable()
+        self.release_files_folder.cleanup()
+
+    def load_release(self, rows):
+        self.file.seek(0)
+        self.file.truncate()
+        json.dump(rows, self.file)
+        self.file.flush()
+        call_command('load_dataset_release', 'v1', self.file.name)
+        return models.DatasetRelease.objects.get(release_tag='v1')
+
+    def test_load_dataset_release(self):
+        # an open candidate annotation of a sound that gets a new ground truth annotation
+        open_candidate_annotation = models.CandidateAnnotation.objects.create(
+            sound_dataset=self.sounds[2].sounddataset_set.get(), taxonomy_node=self.nodes[0], type='AU')
+        self.dataset.compute_priority_scores()
+        pools = models.CandidateAnnotationPools(self.dataset.id)
+        pools.build()
+        self.addCleanup(pools.delete)
+
+        release = self.load_release([
+            (self.nodes[0].node_id, self.sounds[0].freesound_id, 'eval'),
+            (self.nodes[0].node_id, self.sounds[1].freesound_id, 'dev'),
+            (self.nodes[1].node_id, self.sounds[2].freesound_id, 'eval'),
+            (self.nodes[1].node_id, self.sounds[2].freesound_id, 'dev'),
+        ])
+
+        self.assertEqual(release.num_annotations, 3)
+        self.assertEqual(release.num_sounds, 3)
+        self.assertEqual(release.num_nodes, 2)
+        self.assertListEqual(sorted(release.iter_index()), sorted([
+            (self.sounds[0].freesound_id, [self.nodes[0].node_id]),
+            (self.sounds[1].freesound_id, [self.nodes[0].node_id]),
+            (self.sounds[2].freesound_id, [self.nodes[1].node_id]),
+        ]))
+        self.assertListEqual(sorted(release.ground_truth_annotations.values_list(
+            'sound_dataset__sound_id', 'taxonomy_node_id', 'partition', 'ground_truth')), [
+            (self.sounds[0].id, self.nodes[0].id, 'eval', 1.0),
+            (self.sounds[1].id, self.nodes[0].id, 'dev', 0.5),
+            (self.sounds[2].id, self.nodes[1].id, 'dev', 1.0),
+        ])
+        created_candidate_annotation = models.CandidateAnnotation.objects.get(taxonomy_node=self.nodes[1])
+        self.assertEqual((created_candidate_annotation.type, created_candidate_annotation.ground_truth), ('MA', 1))
+        for ground_truth_annotation in release.ground_truth_annotations.all():
+            self.assertListEqual(
+                list(ground_truth_annotation.from_candidate_annotations.values_list('sound_dataset_id',
+                                                                                    'taxonomy_node_id')),
+                [(ground_truth_annotation.sound_dataset_id, ground_truth_annotation.taxonomy_node_id)])
+
+        counters = models.annotation_counter_values(self.dataset.annotation_counters.all())
+        for taxonomy_node_id, expected_counters in self.dataset.compute_annotation_counters().items():
+            self.assertDictEqual(counters[taxonomy_node_id], expected_counters)
+
+        for node in models.TaxonomyNode.objects.filter(id__in=[node.id for node in self.nodes]):
+            self.assertEqual(node.nb_ground_truth, node.num_ground_truth_annotations)
+        open_candidate_annotation.refresh_from_db()
+        self.assertEqual(open_candidate_annotation.priority_score, open_candidate_annotation.return_priority_score())
+        self.assertEqual(store.r.zscore(pools.pool_key(self.nodes[0].id), open_candidate_annotation.id),
+                         open_candidate_annotation.priority_score)
+
+    def test_load_dataset_release_with_unknown_sound(self):
+        with self.assertRaises(CommandError):
+            self.load_release([(self.nodes[0].node_id, self.sounds[0].freesound_id, 'eval'),
+                               (self.nodes[0].node_id, 1, 'eval')])
+        self.assertFalse(models.DatasetRelease.objects.exists())
+        self.assertEqual(models.GroundTruthAnnotation.objects.get().partition, 'dev')
+
+    def test_load_dataset_release_with_unknown_partition(self):
+        with self.assertRaises(CommandError):
+            self.load_release([(self.nodes[0].node_id, self.sounds[0].freesound_id, 'eval'),
+                               (self.nodes[0].node_id, self.sounds[1].freesound_id, 'test')])
+        self.assertFalse(models.DatasetRelease.objects.exists())
+
+        # blank partitions are stored as None
+        release = self.load_release([(self.nodes[0].node_id, self.sounds[0].freesound_id, ''),
+                                     (self.nodes[0].node_id, self.sounds[1].freesound_id, None)])
+        self.assertListEqual(list(release.ground_truth_annotations.values_list('partition', flat=True)),
+                             [None, None])
+
+        # partitions written by other means: blank ones are stored as None in the snapshot, unknown ones refused
+        ground_truth_annotation_ids = list(release.ground_truth_annotations.order_by('id').values_list('id', flat=True))
+        models.GroundTruthAnnotation.objects.filter(id=ground_truth_annotation_ids[0]).update(partition='')
+        release.write_snapshot()
+        models.GroundTruthAnnotation.objects.filter(id=ground_truth_annotation_ids[1]).update(partition='test')
+        with self.assertRaises(ValueError):
+            release.write_snapshot()
+
+
+class BatchFreesoundClientTest(TestCase):
+
+    def setUp(self):
+        # the stand-in API knows the even ids, and the first request of each url fails and is retried
+        self.server = FakeFreesoundServer(list(range(0, 240, 2)), num_errors=1).__enter__()
+        self.base_url = mock.patch.object(freesound.URIS, 'BASE', self.server.api_url.rstrip('/'))
+        self.base_url.start()
+
+    def tearDown(self):
+        self.base_url.stop()
+        self.server.__exit__()
+
+    def test_get_sounds_by_id(self):
+        client = freesound.BatchFreesoundClient(workers=3, requests_per_minute=6000, backoff=0.01)
+        client.set_token('token')
+        sounds = client.get_sounds_by_id(range(240), chunk_size=50, fields='id,name')
+        self.assertIsInstance(sounds, types.GeneratorType)
+        self.assertListEqual([(sound.id, sound.name) for sound in sounds],
+                             [(sound_id, 'Sound {0}'.format(sound_id)) for sound_id in range(0, 240, 2)])
+        # 5 chunks requested twice, through at most one connection per worker
+        self.assertEqual(self.server.num_requests, 10)
+        self.assertLessEqual(len(self.server.client_ports), 3)
+
+    def test_retries_exhausted(self):
+        client = freesound.BatchFreesoundClient(max_retries=0)
+        client.set_token('token')
+        with self.assertRaises(freesound.FreesoundException):
+            list(client.get_sounds_by_id([2]))
+
+    def test_token_bucket(self):
+        token_bucket = freesound.TokenBucket(100, capacity=2)
+        start = time.time()
+        for _ in range(12):
+            token_bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    @override_settings(FS_API_REQUESTS_PER_MINUTE=6000)
+    def test_refresh_sound_deleted_state(self):
+        for freesound_id in range(1, 11):
+            models.Sound.objects.create(name='Sound', freesound_id=freesound_id, extra_data={})
+        refresh_sound_deleted_state()
+        self.assertListEqual(list(models.Sound.objects.filter(deleted_in_freesound=True)
+                                  .order_by('freesound_id').values_list('freesound_id', flat=True)), [1, 3, 5, 7, 9])
+
+    @override_settings(FS_API_REQUESTS_PER_MINUTE=6000)
+    def test_refresh_sound_extra_data(self):
+        for freesound_id in list(range(1, 11)) + [2]:
+            models.Sound.objects.create(name='Sound', freesound_id=freesound_id, extra_data={})
+        refresh_sound_extra_data()
+        self.assertListEqual(sorted(models.Sound.objects.filter(extra_data__name__startswith='Sound ')
+                                    .values_list('freesound_id', flat=True)), [2, 2, 4, 6, 8, 10])
+
+    @override_settings(FS_API_REQUESTS_PER_MINUTE=6000)
+    def test_refresh_sound_extra_data_is_atomic(self):
+        for freesound_id in range(1, 11):
+            models.Sound.objects.create(name='Sound', freesound_id=freesound_id, extra_data={})
+
+        def failing_query(*args, **kwargs):
+            yield from itertools.islice(query_freesound_by_id(*args, **kwargs), 3)
+            raise ConnectionError
+
+        # the results are written in chunks of one sound
+        with mock.patch('datasets.tasks.query_freesound_by_id', side_effect=failing_query), \
+                mock.patch('datasets.tasks.iter_chunks', side_effect=lambda results, n: iter_chunks(results, 1)):
+            with self.assertRaises(ConnectionError):
+                refresh_sound_extra_data()
+        self.assertFalse(models.Sound.objects.exclude(extra_data={}).exists())
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeFreesoundServer(list(range(0, 240, 2))).__enter__()
+        self.base_url = mock.patch.object(freesound.URIS, 'BASE', self.server.api_url.rstrip('/'))
+        self.base_url.start()
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+        self.base_url.stop()
+        self.server.__exit__()
+
+    def freesound_client(self, client_class=freesound.FreesoundClient, ttls=None, token='token'):
+        client = client_class()
+        client.set_token(token)
+        client.set_response_cache(freesound.ResponseCache(self.folder.name, ttls=ttls))
+        return client
+
+    def test_endpoint_type(self):
+        self.assertEqual(freesound.ResponseCache.endpoint_type(freesound.URIS.uri(freesound.URIS.TEXT_SEARCH)),
+                         'search')
+        self.assertEqual(freesound.ResponseCache.endpoint_type(freesound.URIS.uri(freesound.URIS.SOUND, 6)), 'sound')
+        self.assertEqual(freesound.ResponseCache.endpoint_type(freesound.URIS.uri(freesound.URIS.SOUND_ANALYSIS, 6)),
+                         'analysis')
+        self.assertEqual(freesound.ResponseCache.endpoint_type(freesound.URIS.uri(freesound.URIS.ME)), 'other')
+
+    def test_hits_and_misses(self):
+        client = self.freesound_client()
+        self.assertEqual(client.get_sound(2).name, 'Sound 2')
+        self.assertEqual(client.get_sound(2).name, 'Sound 2')
+        self.assertEqual(client.get_sound(2, fields='id').name, 'Sound 2')  # the params are part of the key
+        self.assertEqual(self.server.num_requests, 2)
+        self.assertEqual(client.response_cache.stats['hits'], 1)
+        self.assertEqual(client.response_cache.stats['misses'], 2)
+        self.assertGreater(client.response_cache.stats['bytes_saved'], 0)
+
+        # the cache is kept on disk, and the errors are not cached
+        client = self.freesound_client()
+        self.assertEqual(client.get_sound(2).name, 'Sound 2')
+        for _ in range(2):
+            with self.assertRaises(freesound.FreesoundException):
+                client.get_sound(1)
+        self.assertEqual(self.server.num_requests, 4)
+        self.assertEqual(client.response_cache.stats['misses'], 0)
+        self.assertEqual(client.response_cache.stats['errors'], 2)
+
+    def test_tokens_do_not_share_responses(self):
+        self.freesound_client().get_sound(2)
+        client = self.freesound_client(token='other token')
+        self.assertEqual(client.get_sound(2).name, 'Sound 2')
+        self.assertEqual(self.server.num_requests, 2)
+        self.assertEqual(client.response_cache.stats['hits'], 0)
+        for name in os.listdir(self.folder.name):
+            with open(os.path.join(self.folder.name, name), 'rb') as f:
+                self.assertNotIn(b'token', f.readline())
+
+    def test_revalidation(self):
+        client = self.freesound_client(ttls={'sound': 0})
+        client.get_sound(2)
+        self.assertEqual(client.get_sound(2).name, 'Sound 2')
+        self.assertEqual(self.server.num_requests, 2)
+        self.assertEqual(client.response_cache.stats['hits'], 0)
+        self.assertEqual(client.response_cache.stats['revalidations'], 1)
+        self.assertGreater(client.response_cache.stats['bytes_saved'], 0)
+
+    def test_batch_client(self):
+        for _ in range(2):
+            client = self.freesound_client(client_class=freesound.BatchFreesoundClient)
+            self.assertListEqual([sound.id for sound in client.get_sounds_by_id(range(100))], list(range(0, 100, 2)))
+        self.assertEqual(self.server.num_requests, 2)
+        self.assertEqual(client.response_cache.stats['hits'], 2)
@@ -1,10 +1,17 @@
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from datasets.models import *
 from datasets.views import *
 from datasets.forms import *
 from datasets.management.commands.generate_fake_data import create_sounds, create_users, create_candidate_annotations, \
     add_taxonomy_nodes, VALID_FS_IDS, get_dataset
+from datasets.management.commands.benchmark_download_script import FakeFreesoundServer, load_download_script, \
+    sound_content
 from datasets.tasks import generate_release_index
+import tempfile
+import hashlib
+import gzip
+import io
+from unittest import mock
 
 
 class ContributeTest(TestCase):
@@ -159,6 +166,18 @@ class AdvancedContributeTest(TestCase):
         self.assertListEqual(expected_annotation_ids, selected_candidates)
 
 
+class AdvancedContributeCandidatePoolsTest(AdvancedContributeTest):
+    # same pages served from the candidate annotation pools
+
+    def setUp(self):
+        super(AdvancedContributeCandidatePoolsTest, self).setUp()
+        self.pools = CandidateAnnotationPools(Dataset.objects.get(short_name='fsd').id)
+        self.pools.build()
+
+    def tearDown(self):
+        self.pools.delete()
+
+
 def create_release():
     release = DatasetRelease.objects.create(release_tag='test', type='IN')
     release.dataset = Dataset.objects.get(short_name='fsd')
@@ -198,6 +217,14 @@ class DatasetReleaseTests(TestCase):
 
         self.client.login(username='username_0', password='123456')
 
+        self.release_files_folder = tempfile.TemporaryDirectory()
+        self.release_files_settings = override_settings(DATASET_RELEASE_FILES_FOLDER=self.release_files_folder.name)
+        self.release_files_settings.enable()
+
+    def tearDown(self):
+        self.release_files_settings.disable()
+        self.release_files_folder.cleanup()
+
     def test_create_release_launch(self):
         # create release
         form_data = {
@@ -227,6 +254,87 @@ class DatasetReleaseTests(TestCase):
         self.assertSetEqual(set(release.ground_truth_annotations.all()),
                             set(GroundTruthAnnotation.objects.all()))
 
+        release.refresh_from_db()
+        self.assertNotIn('sounds_info', release.release_data)
+        sounds_info = {}
+        for freesound_id, node_id in GroundTruthAnnotation.objects.values_list('sound_dataset__sound__freesound_id',
+                                                                               'taxonomy_node__node_id'):
+            sounds_info.setdefault(freesound_id, []).append(node_id)
+        self.assertDictEqual({freesound_id: sorted(node_ids) for freesound_id, node_ids in release.iter_index()},
+                             {freesound_id: sorted(node_ids) for freesound_id, node_ids in sounds_info.items()})
+        self.assertEqual(release.num_sounds, len(sounds_info))
+
+    def test_release_index(self):
+        create_release()
+        release = DatasetRelease.objects.get(release_tag='test')
+        generate_release_index(release.dataset_id, release.id)
+        release.refresh_from_db()
+        url = reverse('release-index', kwargs={'short_name': 'fsd', 'release_tag': 'test'})
+        with open(release.index_file_path, 'rb') as f:
+            index = f.read()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), index)
+        self.assertEqual(len(gzip.decompress(index).splitlines()), release.num_sounds)
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-{0}/{1}'.format(len(index) - 1, len(index)))
+        self.assertEqual(b''.join(response.streaming_content), index[10:])
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), index[-5:])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), index)
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes={0}-'.format(len(index))).status_code, 416)
+
+        # as the download page, the index requires to log in
+        self.client.logout()
+        self.assertRedirects(self.client.get(url), '{0}?next={1}'.format(settings.LOGIN_URL, url),
+                             fetch_redirect_response=False)
+
+        # internal releases are only available to the maintainers
+        create_users(1)
+        self.client.login(username='username_1', password='123456')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_dataset_sounds(self):
+        create_release()
+        release = DatasetRelease.objects.get(release_tag='test')
+        dataset = Dataset.objects.get(short_name='fsd')
+        url = reverse('dataset-sounds', kwargs={'short_name': 'fsd'})
+        freesound_ids = sorted(dataset.sounds.values_list('freesound_id', flat=True))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(json.loads(b''.join(response.streaming_content)), {'sounds': freesound_ids})
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertDictEqual(json.loads(gzip.decompress(b''.join(response.streaming_content))),
+                             {'sounds': freesound_ids})
+
+        response = self.client.get(url, {'release': 'test'})
+        release_freesound_ids = sorted(set(release.ground_truth_annotations
+                                           .values_list('sound_dataset__sound__freesound_id', flat=True)))
+        self.assertDictEqual(json.loads(b''.join(response.streaming_content)), {'sounds': release_freesound_ids})
+        self.assertEqual(self.client.get(url, {'release': 'unknown'}).status_code, 404)
+
+        # the ETag changes with the sounds of the dataset
+        sound = Sound.objects.create(name='New sound', freesound_id=max(freesound_ids) + 1, extra_data={})
+        SoundDataset.objects.create(dataset=dataset, sound=sound)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['sounds'][-1], sound.freesound_id)
+
     def test_release_explore(self):
         create_release()
 
@@ -306,6 +414,35 @@ class DatasetReleaseTests(TestCase):
                                            }))
         self.assertEqual(response.status_code, 200)
 
+    def test_release_taxonomy_node_from_snapshot(self):
+        create_release()
+        release = DatasetRelease.objects.get(release_tag='test')
+        generate_release_index(release.dataset_id, release.id)
+        node = TaxonomyNode.objects.annotate(num=Count('ground_truth_annotations')).order_by('-num').first()
+        ground_truth_annotation = node.ground_truth_annotations.first()
+        ErrorReport.objects.create(created_by=User.objects.first(), annotation=ground_truth_annotation)
+        url = reverse('release-taxonomy-node', kwargs={'short_name': 'fsd', 'release_tag': 'test',
+                                                       'node_id': node.url_id})
+
+        expected_annotations = list(release.get_ground_truth_annotations_taxonomy_node(node.node_id)
+                                    .annotate(num_reports=Count('errorreport', distinct=True),
+                                              user_reported=Count('errorreport',
+                                                                  filter=Q(errorreport__created_by__username='username_0')))
+                                    .values('num_reports', 'partition', 'user_reported',
+                                            'sound_dataset__sound__freesound_id', 'pk')
+                                    .order_by('pk'))
+        self.assertTrue(os.path.exists(release.snapshot_file_path))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(list(response.context['annotations']), expected_annotations[:10])
+        self.assertEqual(response.context['annotations'].paginator.count, len(expected_annotations))
+        self.assertContains(response, 'reported by')
+
+        # the annotations of the release are not queried
+        with mock.patch('datasets.models.DatasetRelease.get_ground_truth_annotations_taxonomy_node') as query:
+            self.assertEqual(self.client.get(url).status_code, 200)
+            query.assert_not_called()
+
     def test_report_ground_truth_annotation(self):
         create_release()
         ground_truth_annotation = GroundTruthAnnotation.objects.first()
@@ -330,6 +467,87 @@ class DatasetReleaseTests(TestCase):
         self.assertEqual(GroundTruthAnnotation.objects.get(pk=ground_truth_annotation_pk).errorreport_set.count(), 1)
 
 
+class DownloadScriptTest(TestCase):
+    fixtures = ['datasets/fixtures/initial.json']
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.sound_ids = list(range(1, 21))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def downloader(self, server, **kwargs):
+        download_script = load_download_script(os.path.join(self.folder.name, 'fs_download_script.py'),
+                                               server.dataset_url, server.api_url)
+        client = download_script.Client('token', download_script.RateLimiter(0), backoff=0.01)
+        return download_script.Downloader(client, self.folder.name, **kwargs)
+
+    def test_generated_script(self):
+        dataset = Dataset.objects.get(short_name='fsd')
+        compile(utils.generate_download_script(dataset), 'fs_download_script.py', 'exec')
+
+    @mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_download(self, stdout):
+        # the first request of each url fails and is retried
+        with FakeFreesoundServer(self.sound_ids, sound_size=1000, num_errors=1) as server:
+            downloader = self.downloader(server, workers=4)
+            num_downloaded, failed_sound_ids, _ = downloader.download(self.sound_ids + [1000])
+            self.assertEqual(num_downloaded, len(self.sound_ids))
+            self.assertListEqual(failed_sound_ids, [1000])
+            self.assertIn('sounds/s', stdout.getvalue())
+            # the connections are kept open by the workers
+            self.assertLessEqual(len(server.client_ports), 4)
+
+            progress = json.load(open(os.path.join(self.folder.name, 'progress.json')))
+            self.assertSetEqual(set(progress['downloaded']), {str(sound_id) for sound_id in self.sound_ids})
+            for sound_id in self.sound_ids:
+                with open(os.path.join(self.folder.name, '{0}.wav'.format(sound_id)), 'rb') as f:
+                    content = f.read()
+                self.assertEqual(content, sound_content(sound_id, 1000))
+                self.assertEqual(progress['downloaded'][str(sound_id)]['sha256'], hashlib.sha256(content).hexdigest())
+                self.assertTrue(os.path.exists(os.path.join(self.folder.name, '{0}.json'.format(sound_id))))
+                self.assertTrue(os.path.exists(os.path.join(self.folder.name, '{0}-analysis.json'.format(sound_id))))
+
+            # the download is resumed, and the corrupted files are downloaded again when verifying the checksums
+            num_requests = server.num_requests
+            num_downloaded, _, _ = self.downloader(server).download(self.sound_ids)
+            self.assertEqual(num_downloaded, 0)
+            self.assertEqual(server.num_requests, num_requests)
+            with open(os.path.join(self.folder.name, '3.wav'), 'r+b') as f:
+                f.write(b'corrupted')
+            num_downloaded, _, _ = self.downloader(server, features='2').download(self.sound_ids, verify=True)
+            self.assertEqual(num_downloaded, 1)
+
+    def test_sound_ids(self):
+        with FakeFreesoundServer(self.sound_ids) as server:
+            download_script = load_download_script(os.path.join(self.folder.name, 'fs_download_script.py'),
+                                                   server.dataset_url, server.api_url)
+            path = os.path.join(self.folder.name, 'sound_ids.json')
+            self.assertListEqual(download_script.get_sound_ids(server.dataset_url, path), self.sound_ids)
+            # the saved list is revalidated
+            self.assertListEqual(download_script.get_sound_ids(server.dataset_url, path), self.sound_ids)
+            self.assertEqual(server.num_requests, 2)
+
+    def test_rate_limiter(self):
+        download_script = load_download_script(os.path.join(self.folder.name, 'fs_download_script.py'),
+                                               'http://localhost/dataset-sounds/', 'http://localhost/apiv2/')
+        rate_limiter = download_script.RateLimiter(50)
+        # fake clock, sleeping moves it forward
+        now = [100.0]
+        clock = mock.Mock()
+        clock.monotonic.side_effect = lambda: now[0]
+        clock.sleep.side_effect = lambda seconds: now.__setitem__(0, now[0] + seconds)
+        with mock.patch.object(download_script, 'time', clock):
+            for _ in range(6):
+                rate_limiter.wait('freesound.org')
+            rate_limiter.wait('cdn.freesound.org')
+        self.assertEqual(clock.sleep.call_count, 5)
+        for args, _ in clock.sleep.call_args_list:
+            self.assertAlmostEqual(args[0], 0.02)
+        self.assertAlmostEqual(now[0], 100.1)
+
+
 class Basic200ResponseTest(TestCase):
     fixtures = ['datasets/fixtures/initial.json']
 
@@ -429,6 +647,20 @@ class Basic200ResponseTest(TestCase):
                                            }))
         self.assertEquals(response.status_code, 200)
 
+    def test_contribute_validate_annotations_category_siblings_tip(self):
+        taxonomy = Dataset.objects.get(short_name='fsd').taxonomy
+        node = next(node for node in taxonomy.get_all_nodes()
+                    if node.get_siblings() and node.get_children() and node.get_parents())
+        node.advanced_task = True  # the tip is only shown in the advanced task
+        node.save()
+        response = self.client.get(reverse('contribute-validate-annotations-category',
+                                           kwargs={
+                                               'short_name': 'fsd',
+                                               'node_id': node.url_id
+                                           }))
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, 'parents, siblings and direct children')
+
     def test_choose_category(self):
         response = self.client.get(reverse('choose_category',
                                            kwargs={
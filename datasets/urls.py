@@ -32,6 +32,7 @@ urlpatterns = [
          name='release-taxonomy-table'),
     path('<short_name>/release/<release_tag>/report_annotation/', report_ground_truth_annotation,
          name='report-ground-truth-annotation'),
+    path('<short_name>/release/<release_tag>/index/', release_index, name='release-index'),
     # this url needs to be after the ones above to unsure a correct mapping
     path('<short_name>/release/<release_tag>/<node_id>/', release_taxonomy_node, name='release-taxonomy-node'),
 
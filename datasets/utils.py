@@ -1,16 +1,25 @@
 import os
-from urllib.parse import urljoin
+import re
+import json
+import time
+from itertools import islice
+from functools import lru_cache
+from urllib.parse import urljoin, urlencode
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.template.loader import render_to_string
 import datasets.freesound as fs
 from nltk import PorterStemmer
 
 
-def generate_download_script(dataset):
+def generate_download_script(dataset, release=None):
     access_token_url = urljoin(settings.BASE_URL, reverse('get_access_token'))
     dataset_url = urljoin(settings.BASE_URL, reverse('dataset-sounds',
         kwargs={"short_name": dataset.short_name}))
+    if release is not None:
+        dataset_url += '?' + urlencode({'release': release.release_tag})
 
     tvars = {
         'access_token_url': access_token_url,
@@ -26,20 +35,180 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
+def iter_chunks(iterable, n):
+    """Yield successive n-sized lists from any iterable, consuming it lazily."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, n))
+
+
+def iter_json_list_object(key, values, chunk_size=10000):
+    """ Yields the JSON encoding of {key: [value, ...]} in pieces of chunk_size values, so that a streaming response
+        can send a list that is never fully in memory. The result is the same as json.dumps """
+    yield '{{{0}: ['.format(json.dumps(key))
+    separator = ''
+    for chunk in iter_chunks(values, chunk_size):
+        yield separator + ', '.join(json.dumps(value) for value in chunk)
+        separator = ', '
+    yield ']}'
+
+
+def values_list_digest(queryset):
+    """ Returns the md5 hex digest of the values of a flat values_list queryset of a single field, computed by the
+        database in their order so that they do not need to be fetched """
+    sql, params = queryset.query.sql_with_params()
+    column = connection.ops.quote_name(queryset.query.values_select[0])
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT md5(coalesce(string_agg(values_list.{0}::text, \',\' ORDER BY values_list.{0}), \'\')) '
+                       'FROM ({1}) AS values_list'.format(column, sql), params)
+        return cursor.fetchone()[0]
+
+
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_object_items(file, read_size=2 ** 16):
+    """ Yield the (key, value) pairs of the JSON object stored in file one by one, reading the file read_size
+        characters at a time. Only one value is kept in memory, so it can parse files that are too big for json.load.
+        The values themselves are decoded with the json module """
+    decoder = json.JSONDecoder()
+    state = {'buffer': '', 'position': 0, 'eof': False}
+
+    def read():
+        data = file.read(read_size)
+        state['eof'] = not data
+        state['buffer'] = state['buffer'][state['position']:] + data
+        state['position'] = 0
+
+    def peek():
+        """ Returns the next non whitespace character, or '' at the end of the file """
+        while True:
+            state['position'] = JSON_WHITESPACE.match(state['buffer'], state['position']).end()
+            if state['position'] < len(state['buffer']) or state['eof']:
+                return state['buffer'][state['position']:state['position'] + 1]
+            read()
+
+    def expect(characters):
+        character = peek()
+        if character not in characters:
+            raise ValueError('Expected one of {0!r} at character {1!r}'.format(characters, character))
+        state['position'] += 1
+        return character
+
+    def decode():
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['buffer'], state['position'])
+            except ValueError:
+                if state['eof']:
+                    raise
+                read()
+                continue
+            # a value that ends with the buffer (e.g. a number) could go on in the rest of the file
+            if end == len(state['buffer']) and not state['eof']:
+                read()
+                continue
+            state['position'] = end
+            return value
+
+    read()
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = decode()
+        expect(':')
+        yield key, decode()
+        if expect(',}') == '}':
+            return
+
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_byte_range(range_header, size):
+    """ Returns the first and last byte positions requested by the Range header of a request for a content of size
+        bytes, or None when there is no header or it is not a single byte range, so that the whole content is served.
+        Raises ValueError when the range is not satisfiable """
+    match = BYTE_RANGE.match(range_header or '')
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # suffix range, the last end bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError('Range {0} not satisfiable for {1} bytes'.format(range_header, size))
+    return start, end
+
+
+def iter_file_range(file, start, end, chunk_size=2 ** 16):
+    """ Yields the bytes of the open binary file from position start to end (included) in chunks, then closes it """
+    with file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+_freesound_response_caches = {}
+
+
+def get_freesound_response_cache():
+    """ Returns the response cache of the Freesound API of the process, None when FS_API_CACHE_FOLDER is not set.
+        Its stats count the requests of the process """
+    folder = settings.FS_API_CACHE_FOLDER
+    if not folder:
+        return None
+    if folder not in _freesound_response_caches:
+        _freesound_response_caches[folder] = fs.ResponseCache(folder, ttls=settings.FS_API_CACHE_TTLS)
+    return _freesound_response_caches[folder]
+
+
 def query_freesound_by_id(list_ids, fields="id,name", descriptors=""):
-    """ Query Freesound by chunk of 50 sounds
-        Retrieves only id of sounds """
-    client = fs.FreesoundClient()
+    """ Query Freesound by chunk of 50 sounds, with FS_API_WORKERS concurrent requests limited to
+        FS_API_REQUESTS_PER_MINUTE (see datasets.freesound.BatchFreesoundClient) and served from the response cache
+        when FS_API_CACHE_FOLDER is set
+        Yields the sounds that exist as they are retrieved """
+    client = fs.BatchFreesoundClient(workers=settings.FS_API_WORKERS,
+                                     requests_per_minute=settings.FS_API_REQUESTS_PER_MINUTE)
     client.set_token(settings.FS_CLIENT_SECRET)
-    results = []
-    for sub_list_ids in chunks(list_ids, 50):
-        filter_str = 'id:(' + ' OR '.join([str(i) for i in sub_list_ids]) + ')'
-        page_result = client.text_search(query="", fields=fields, page_size=50, filter=filter_str,
-                                         descriptors=descriptors)
-        results += [s for s in page_result]
-    return results
+    response_cache = get_freesound_response_cache()
+    if response_cache is not None:
+        client.set_response_cache(response_cache)
+    return client.get_sounds_by_id(list_ids, chunk_size=50, fields=fields, descriptors=descriptors)
+
+
+def run_and_measure(func, *args, **kwargs):
+    """ Run func and return its result together with the number of database
+        queries it made and the elapsed wall time in seconds """
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        result = func(*args, **kwargs)
+        elapsed_time = time.time() - start
+    return result, len(queries), elapsed_time
+
 
+STEM_CACHE_SIZE = 2 ** 16
+_stemmer = PorterStemmer()
 
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
 def stem(word):
-    ps = PorterStemmer()
-    return ps.stem(word)
+    """ Porter stem of word. The stemmer is shared and the stems of the most recently used words are kept, tag
+        vocabularies are very repetitive (see stem.cache_info()) """
+    return _stemmer.stem(word)
+
+
+def stem_words(words):
+    """ Returns a dictionary with the stem of each distinct word of the iterable """
+    return {word: stem(word) for word in set(words)}
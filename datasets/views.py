@@ -1,8 +1,11 @@
 from urllib.request import urlopen
 from urllib.error import HTTPError
 from urllib.parse import urlencode, unquote, quote
-from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, HttpResponseNotAllowed, HttpResponseRedirect
-from django.views.decorators.cache import cache_page
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, HttpResponseNotAllowed, HttpResponseRedirect, \
+    HttpResponseForbidden, StreamingHttpResponse, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.gzip import gzip_page
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity, TrigramDistance
@@ -12,7 +15,8 @@ from django.db.models import Count, Case, When, BooleanField, CharField, Value,
 from django.db import transaction, connection
 from django.forms import formset_factory
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from datasets.models import Dataset, DatasetRelease, CandidateAnnotation, Vote, TaxonomyNode, SoundDataset, Sound, User, ErrorReport
+from datasets.models import Dataset, DatasetRelease, CandidateAnnotation, Vote, TaxonomyNode, SoundDataset, Sound, User, ErrorReport, \
+    CandidateAnnotationPools, save_votes, get_release_snapshot
 from datasets import utils
 from django.utils import timezone
 from datasets.forms import DatasetReleaseForm, PresentNotPresentUnsureForm, CategoryCommentForm
@@ -240,12 +244,12 @@ def contribute_validate_annotations_easy(request, short_name):
     node_id = request.GET.get('url_id')
     if not node_id:
         request.session['nb_task1_pages'] = 0
-        nodes = TaxonomyNode.objects.filter(beginner_task=True).order_by('?')
-        if nodes:
-            for node in nodes:
-                if dataset.user_can_annotate(node.node_id, request.user):
-                    node_id = node.url_id
-                    break
+        nodes = list(TaxonomyNode.objects.filter(beginner_task=True))
+        random.shuffle(nodes)
+        for node in nodes:
+            if dataset.user_can_annotate(node.node_id, request.user):
+                node_id = node.url_id
+                break
     if not node_id:
         return contribute(request, short_name, beginner_task_finished=True)
     return contribute_validate_annotations_category(request, short_name, node_id,
@@ -333,9 +337,9 @@ def contribute_validate_annotations_category(request, short_name, node_id, html_
     if node.negative_verification_examples_activated:
         # Get negative examples and add one if user has failed the test
         if user_test == 'FA':
-            negative_sound_examples = node.freesound_false_examples.filter(deleted_in_freesound=False).order_by('?')
+            negative_sound_examples = list(node.freesound_false_examples.filter(deleted_in_freesound=False))
             if negative_sound_examples:
-                negative_sound_example = negative_sound_examples[0]
+                negative_sound_example = random.choice(negative_sound_examples)
                 # create "dummy" annotation example for the false example of id 0 (the corresponding annotation does
                 # not exist in the Annotation table because it is a false irrelevant example)
                 negative_annotation_example = CandidateAnnotation(sound_dataset=SoundDataset(
@@ -343,37 +347,45 @@ def contribute_validate_annotations_category(request, short_name, node_id, html_
                 annotation_ids += [None]  # count as an added annotation but does not retrieve any annotation later,
                 #  the false annotation "negative_annotation_example" is added manually
 
-    # Get non ground truth annotations, never voted by the user (with positive test),
-    # exclude test examples, order by priority score & random,
-    # exclude candidate outside of [0.3, 30] sec and with 0 votes
-    # TODO: put this in a class method and do a test
-    annotations = dataset.non_ground_truth_annotations_per_taxonomy_node(node_id)\
-                         .exclude(id__in=Vote.objects.filter(candidate_annotation__taxonomy_node=node,
-                                                             created_by=user,
-                                                             test__in=('UN', 'AP', 'PP', 'NA', 'NP'))
-                                  .values('candidate_annotation_id'))\
-                         .exclude(id__in=annotation_examples_verification_ids)\
-                         .exclude(id__in=annotation_examples_ids)\
-                         .filter(sound_dataset__sound__deleted_in_freesound=False)\
-                         .order_by('-priority_score', '?')
-
-    # Exclude annotations that have votes (for kaggle dataset) and that have nc and sampling+ licenses
-    if new_annotations == '1':
-        # this will discard the annotations with no votes
-        # out of [0.3, 30] secondes
-        # and with NC licenses
-        annotations = annotations\
-            .exclude(priority_score__gte=1000)\
-            .exclude(priority_score__lte=100)\
-            .exclude(sound_dataset__sound__extra_data__license__in=('http://creativecommons.org/licenses/by-nc/3.0/',
-                                                                    'http://creativecommons.org/licenses/sampling+/1.0/'
-                                                                    ))
-
     N_ANNOTATIONS_TO_VALIDATE = NB_TOTAL_ANNOTATIONS - len(annotation_ids)
-    annotation_ids += annotations[:N_ANNOTATIONS_TO_VALIDATE].values_list('id', flat=True)
+    candidate_annotation_pools = CandidateAnnotationPools(dataset.id)
+    if candidate_annotation_pools.is_built() and new_annotations != '1':
+        # Same selection as below, served from the candidate annotation pools kept in redis
+        candidate_annotation_ids = candidate_annotation_pools.get_candidate_annotation_ids_to_validate(
+            node, user, N_ANNOTATIONS_TO_VALIDATE)
+        annotation_ids += candidate_annotation_ids
+        num_annotations_left = len(candidate_annotation_ids)
+    else:
+        # Get non ground truth annotations, never voted by the user (with positive test),
+        # exclude test examples, order by priority score & random,
+        # exclude candidate outside of [0.3, 30] sec and with 0 votes
+        annotations = dataset.non_ground_truth_annotations_per_taxonomy_node(node_id)\
+                             .exclude(id__in=Vote.objects.filter(candidate_annotation__taxonomy_node=node,
+                                                                 created_by=user,
+                                                                 test__in=Vote.PASSED_TESTS)
+                                      .values('candidate_annotation_id'))\
+                             .exclude(id__in=annotation_examples_verification_ids)\
+                             .exclude(id__in=annotation_examples_ids)\
+                             .filter(sound_dataset__sound__deleted_in_freesound=False)\
+                             .order_by('-priority_score', '?')
+
+        # Exclude annotations that have votes (for kaggle dataset) and that have nc and sampling+ licenses
+        if new_annotations == '1':
+            # this will discard the annotations with no votes
+            # out of [0.3, 30] secondes
+            # and with NC or unknown licenses
+            annotations = annotations\
+                .exclude(priority_score__gte=1000)\
+                .exclude(priority_score__lte=100)\
+                .exclude(sound_dataset__sound__license=None)\
+                .exclude(sound_dataset__sound__license__in=('http://creativecommons.org/licenses/by-nc/3.0/',
+                                                             'http://creativecommons.org/licenses/sampling+/1.0/'))
+
+        annotation_ids += annotations[:N_ANNOTATIONS_TO_VALIDATE].values_list('id', flat=True)
+        num_annotations_left = annotations.count()
 
     # If not candidate annotations left, remove test annotations
-    if annotations.count() == 0:
+    if num_annotations_left == 0:
         annotation_ids = list()
         negative_annotation_example = list()
 
@@ -474,17 +486,20 @@ def save_contribute_validate_annotations_category(request):
             # get from which task (beginner or advanced) the user submitted his votes
             from_task = request.POST.get('from_task')
 
+            # skip the annotations voted by the user in the last seconds (e.g. double submission)
+            recently_voted_annotations_id = set(Vote.objects.filter(created_by=request.user,
+                                                                    candidate_annotation_id__in=annotations_id,
+                                                                    created_at__gt=timezone.now()
+                                                                                   - datetime.timedelta(seconds=5))
+                                                .values_list('candidate_annotation_id', flat=True))
+            votes = []
             for form in formset:
                 if 'vote' in form.cleaned_data:  # This is to skip last element of formset which is empty
                     annotation_id = form.cleaned_data['annotation_id']
                     if annotation_id not in test_annotations_id and annotation_id != 0:  # store only the votes for non test annotations
-                        check = Vote.objects.filter(created_by=request.user,
-                                                    candidate_annotation_id=annotation_id,
-                                                    created_at__gt=timezone.now()
-                                                                   - datetime.timedelta(seconds=5))
-                        if not check.exists():
-                            # Save votes for annotations
-                            Vote.objects.create(
+                        if annotation_id not in recently_voted_annotations_id:
+                            recently_voted_annotations_id.add(annotation_id)
+                            votes.append(Vote(
                                 created_by=request.user,
                                 vote=float(form.cleaned_data['vote']),
                                 visited_sound=form.cleaned_data['visited_sound'],
@@ -492,7 +507,9 @@ def save_contribute_validate_annotations_category(request):
                                 test=request.user.profile.test,
                                 from_test_page=from_test_page,
                                 from_task=from_task,
-                            )
+                            ))
+            # Save votes for annotations
+            save_votes(votes)
 
             if comment_form.cleaned_data['comment'].strip():  # If there is a comment
                 comment = comment_form.save(commit=False)
@@ -542,25 +559,26 @@ def dataset_taxonomy_table_choose(request, short_name):
 
         # choose a category at the given node_id level
         if node_id != str(0):
+            if add_label_or_choose_category == 'choose_category':
+                node_ids_to_validate = set(dataset.get_categories_to_validate(request.user)
+                                           .values_list('node_id', flat=True))
             if node_id in [node.node_id for node in taxonomy.get_nodes_at_level(0)]:
-                # remove node that them and all their children are omitted.
-                # Here we should remove also the categories which all its children have no more annotations tu validate.
-                # Doing it with dataset.get_categories_to_validate() or with dataset.user_can_annotated() on all
-                # children would be too slow
+                # remove node that them and all their children are omitted or have no more annotations to validate
                 if add_label_or_choose_category == 'choose_category':
-                    nodes = [node for node in taxonomy.get_children(node_id) if node.self_and_children_advanced_task
-                             and not node.self_and_children_omitted]
+                    nodes = [node for node in taxonomy.graph.nodes(taxonomy.graph.child_ids(node_id))
+                             if node.self_and_children_advanced_task and not node.self_and_children_omitted
+                             and node_ids_to_validate.intersection([node.node_id] +
+                                                                   taxonomy.graph.all_children_ids(node.node_id))]
                 else:
-                    nodes = [node for node in taxonomy.get_children(node_id)]
+                    nodes = taxonomy.graph.nodes(taxonomy.graph.child_ids(node_id))
             else:
                 end_of_table = True  # end of continue, now the user will choose a category to annotate
                 nodes = list(taxonomy.get_all_children(node_id)) + [taxonomy.get_element_at_id(node_id)] \
                     + list(taxonomy.get_all_parents(node_id))
-                # we should remove the nodes that have no more annotations to validate for the user
-                # by using dataset.user_can_annotate(), but it is too slow
+                # remove the nodes that have no more annotations to validate for the user
                 if add_label_or_choose_category == 'choose_category':
                     nodes = [node for node in nodes
-                             if node.advanced_task and not node.omitted]
+                             if node.advanced_task and not node.omitted and node.node_id in node_ids_to_validate]
                 else:
                     pass
             hierarchy_paths = dataset.taxonomy.get_hierarchy_paths(node_id)
@@ -570,6 +588,11 @@ def dataset_taxonomy_table_choose(request, short_name):
             nodes = taxonomy.get_nodes_at_level(0)
             nodes = [node for node in nodes if node.self_and_children_advanced_task
                      and not node.self_and_children_omitted]
+        # the nodes of the taxonomy graph do not hold nb_ground_truth, fetch it for all of them at once
+        nb_ground_truth = dict(TaxonomyNode.objects.filter(id__in=[node.id for node in nodes])
+                               .values_list('id', 'nb_ground_truth'))
+        for node in nodes:
+            node.nb_ground_truth = nb_ground_truth[node.id]
         nodes = sorted(nodes, key=lambda n: n.nb_ground_truth)
 
     # GET request, nodes for Our priority table
@@ -587,7 +610,7 @@ def dataset_taxonomy_table_search(request, short_name):
     if not request.user.is_authenticated:
         return HttpResponse('Unauthorized', status=401)
     dataset = get_object_or_404(Dataset, short_name=short_name)
-    nodes = dataset.get_categories().filter(advanced_task=True)  # sould use get_categories_to_validate() but it is too slow
+    nodes = dataset.get_categories_to_validate(request.user).filter(advanced_task=True)
     return render(request, 'datasets/dataset_taxonomy_table_search.html',
                   {'dataset': dataset, 'nodes': nodes, 'maintainer_task': 0, 'new_annotations': 0})
 
@@ -751,19 +774,43 @@ def get_access_token(request):
         return HttpResponseBadRequest()
 
 
-@cache_page(60 * 60 * 24)
+@gzip_page
 def dataset_sounds(request, short_name):
+    """
+        Streams the freesound ids of the sounds of the dataset, or of the sounds of one of its releases with
+        ?release=<release_tag>, as {"sounds": [freesound_id, ...]} read from a server side cursor. The ETag is a digest
+        of the ids computed by the database, so it changes with the sounds of the dataset and unchanged lists are
+        revalidated without being sent again
+    """
     dataset = get_object_or_404(Dataset, short_name=short_name)
-    return JsonResponse({'sounds': [s.id for s in dataset.sounds.all()]})
+    release_tag = request.GET.get('release')
+    if release_tag:
+        release = get_object_or_404(DatasetRelease, dataset=dataset, release_tag=release_tag)
+        if release.type != 'PU' and not dataset.user_is_maintainer(request.user):
+            return HttpResponseForbidden()
+        sounds = Sound.objects.filter(sounddataset__ground_truth_annotations__dataset_release=release).distinct()
+    else:
+        sounds = dataset.sounds.all()
+    freesound_ids = sounds.order_by('freesound_id').values_list('freesound_id', flat=True)
+
+    etag = '"{0}"'.format(utils.values_list_digest(freesound_ids))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = StreamingHttpResponse(utils.iter_json_list_object('sounds', freesound_ids.iterator()),
+                                         content_type='application/json')
+    response['ETag'] = etag
+    return response
 
 
 @login_required
 @user_passes_test(lambda u: u.is_staff)  # Restrict download to admins (this is a temporal thing)
 def download_script(request, short_name):
     dataset = get_object_or_404(Dataset, short_name=short_name)
+    release_tag = request.GET.get('release')
+    release = get_object_or_404(DatasetRelease, dataset=dataset, release_tag=release_tag) if release_tag else None
     response = HttpResponse(content_type='text/plain')
     response['Content-Disposition'] = 'attachment; filename="fs_download_script.py"'
-    script = utils.generate_download_script(dataset)
+    script = utils.generate_download_script(dataset, release=release)
     response.write(script)
     return response
 
@@ -787,7 +834,10 @@ def release_taxonomy_node(request, short_name, release_tag, node_id):
     node_id = unquote(node_id)
     node = dataset.taxonomy.get_element_at_id(node_id)
 
-    if user_connected:
+    snapshot = get_release_snapshot(release)
+    if snapshot is not None:
+        ground_truth_annotations = snapshot.ground_truth_annotations(node_id)
+    elif user_connected:
         ground_truth_annotations = release.get_ground_truth_annotations_taxonomy_node(node_id)\
             .annotate(
                 num_reports=Count('errorreport', distinct=True),
@@ -816,6 +866,19 @@ def release_taxonomy_node(request, short_name, release_tag, node_id):
         # If page is out of range (e.g. 9999), deliver last page of results.
         annotations = paginator.page(paginator.num_pages)
 
+    if snapshot is not None:
+        # only the error reports of the annotations of the page are read from the database
+        reports = ErrorReport.objects.filter(annotation_id__in=[annotation['pk'] for annotation in annotations])\
+            .values('annotation_id')\
+            .annotate(num_reports=Count('id'),
+                      user_reported=Count('id', filter=Q(created_by_id=request.user.id)))
+        reports = {report['annotation_id']: report for report in reports}
+        for annotation in annotations:
+            report = reports.get(annotation['pk'], {})
+            annotation['num_reports'] = report.get('num_reports', 0)
+            if user_connected:
+                annotation['user_reported'] = report.get('user_reported', 0)
+
     return render(request, 'datasets/dataset_release_taxonomy_node.html', {
         'dataset': dataset,
         'node': node,
@@ -832,7 +895,7 @@ def download_release(request, short_name, release_tag):
     if release.type is not 'PU' and not dataset.user_is_maintainer(request.user):
         raise HttpResponseNotAllowed
 
-    script = utils.generate_download_script(dataset)
+    script = utils.generate_download_script(dataset, release=release)
     formatted_script = highlight(script, PythonLexer(), HtmlFormatter())
     highlighting_styles = HtmlFormatter().get_style_defs('.highlight')
     return render(request, 'datasets/download.html', {'dataset': dataset,
@@ -841,6 +904,56 @@ def download_release(request, short_name, release_tag):
                                                       'highlighting_styles': highlighting_styles})
 
 
+@login_required
+def release_index(request, short_name, release_tag):
+    """
+        Streams the index file of the release (see DatasetRelease.write_index) as it is stored, gzip compressed.
+        Supports conditional requests with its ETag and resuming with single byte ranges
+    """
+    dataset = get_object_or_404(Dataset, short_name=short_name)
+    release = get_object_or_404(DatasetRelease, dataset=dataset, release_tag=release_tag)
+    if release.type != 'PU' and not dataset.user_is_maintainer(request.user):
+        return HttpResponseForbidden()
+
+    try:
+        index_file = open(release.index_file_path, 'rb')
+    except FileNotFoundError:
+        raise Http404('The index of this release has not been written')
+    stat = os.fstat(index_file.fileno())
+    etag = '"{0:x}-{1:x}"'.format(stat.st_mtime_ns, stat.st_size)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    byte_range = None
+    if response is None and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = utils.parse_byte_range(request.META.get('HTTP_RANGE'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(stat.st_size)
+    if response is not None:
+        index_file.close()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    start, end = byte_range or (0, stat.st_size - 1)
+    response = StreamingHttpResponse(utils.iter_file_range(index_file, start, end), content_type='application/gzip',
+                                     status=206 if byte_range else 200)
+    for header, value in headers.items():
+        response[header] = value
+    response['Content-Length'] = end - start + 1
+    if byte_range:
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, stat.st_size)
+    response['Content-Disposition'] = 'attachment; filename="{0}_{1}.jsonl.gz"'.format(dataset.short_name,
+                                                                                         release.release_tag)
+    return response
+
+
 @login_required
 def change_release_type(request, short_name, release_tag):
     dataset = get_object_or_404(Dataset, short_name=short_name)
@@ -865,10 +978,11 @@ def delete_release(request, short_name, release_tag):
 
     # Remove related files and db object
     for release in DatasetRelease.objects.filter(dataset=dataset, release_tag=release_tag):
-        try:
-            os.remove(release.index_file_path)
-        except FileNotFoundError:
-            pass
+        for file_path in (release.index_file_path, release.snapshot_file_path):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
         release.delete()
 
     return HttpResponseRedirect(reverse('dataset-explore', args=[dataset.short_name]))
@@ -210,6 +210,13 @@ except OSError as exc:
     else:
         raise Exception('DATASET_RELEASE_FILES_FOLDER does not exist and could not be created (%s)' % str(exc))
 
+# Freesound API requests of the batched client (see datasets.utils.query_freesound_by_id)
+FS_API_WORKERS = 4
+FS_API_REQUESTS_PER_MINUTE = 60
+# Folder of the on-disk cache of the API responses, disabled if not set (see datasets.freesound.ResponseCache)
+FS_API_CACHE_FOLDER = os.getenv('FS_API_CACHE_FOLDER')
+FS_API_CACHE_TTLS = {}  # seconds per endpoint type, overriding ResponseCache.DEFAULT_TTLS
+
 # Celery
 CELERY_BROKER_URL = "redis://redis"
 CELERY_RESULT_BACKEND = "redis://redis"
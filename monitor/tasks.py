@@ -1,9 +1,15 @@
-from datasets.models import Dataset, Vote, GroundTruthAnnotation, CandidateAnnotation
+from datasets.models import Dataset, Vote, GroundTruthAnnotation, CandidateAnnotation, TaxonomyNode
+from datasets.utils import chunks
 from celery import shared_task
-from utils.redis_store import store
-from statistics import mean, StatisticsError
-from django.db.models.functions import TruncDay
-from django.db.models import Count
+from utils.redis_store import store, SOUND_TAG_INDEX_VERSION_KEY_TEMPLATE, MAPPING_RUN_KEY_TEMPLATE, \
+    MAPPING_RUN_SOUNDS_KEY_TEMPLATE
+from django.db import connection
+from statistics import mean, median
+from django.db.models.functions import TruncDay, Coalesce
+from django.db.models import Count, Q, Subquery, OuterRef, Case, When, IntegerField, BooleanField
+from collections import defaultdict
+from random import shuffle
+import hashlib
 import json
 import logging
 import datetime
@@ -11,6 +17,20 @@ import datetime
 
 logger = logging.getLogger('tasks')
 
+MAPPING_RUN_EXPIRE = 60*60
+MAPPING_RUN_PENDING_TIMEOUT = 60*10
+
+
+def counts_per_taxonomy_node(queryset, taxonomy_node_field, **counts):
+    """
+        Counts the rows of queryset per taxonomy node in a single grouped query. Each keyword argument gives the name
+        and the filter (a Q object, or None to count all the rows) of a count.
+        Returns {taxonomy_node_id: {count_name: value}}, taxonomy nodes without rows are not included
+    """
+    rows = queryset.values(taxonomy_node_field)\
+        .annotate(**{name: Count('id', filter=condition) for name, condition in counts.items()})
+    return {row.pop(taxonomy_node_field): row for row in rows}
+
 
 @shared_task
 def compute_dataset_top_contributed_categories(store_key, dataset_id, N=15):
@@ -22,11 +42,18 @@ def compute_dataset_top_contributed_categories(store_key, dataset_id, N=15):
         top_categories = list()
         top_categories_last_week = list()
 
+        num_votes = counts_per_taxonomy_node(
+            Vote.objects.filter(candidate_annotation__taxonomy_node__taxonomy=dataset.taxonomy),
+            'candidate_annotation__taxonomy_node_id',
+            num_votes=None,
+            num_votes_last_week=Q(created_at__gt=reference_date))
+        no_votes = {'num_votes': 0, 'num_votes_last_week': 0}
+
         for node in nodes:
-            num_votes = Vote.objects.filter(candidate_annotation__taxonomy_node=node).count()
-            top_categories.append((node.url_id, node.name, num_votes, node.omitted))
-            num_votes_last_week = Vote.objects.filter(candidate_annotation__taxonomy_node=node, created_at__gt=reference_date).count()
-            top_categories_last_week.append((node.url_id, node.name, num_votes_last_week, node.omitted))
+            node_num_votes = num_votes.get(node.id, no_votes)
+            top_categories.append((node.url_id, node.name, node_num_votes['num_votes'], node.omitted))
+            top_categories_last_week.append((node.url_id, node.name, node_num_votes['num_votes_last_week'],
+                                             node.omitted))
 
         top_categories = sorted(top_categories, key=lambda x: x[2], reverse=True)  # Sort by number of votes
         top_categories_last_week = sorted(top_categories_last_week, key=lambda x: x[2], reverse=True)
@@ -50,20 +77,27 @@ def compute_dataset_bad_mapping(store_key, dataset_id):
         bad_mapping_categories = list()
         bad_mapping_categories_last_month = list()
 
+        vote_values = {'PP': 1.0, 'PNP': 0.5, 'NP': -1.0, 'U': 0.0}
+        counts = {'num_{0}'.format(name): Q(vote=value) for name, value in vote_values.items()}
+        counts.update({'num_{0}_last_month'.format(name): Q(vote=value, created_at__gt=reference_date)
+                       for name, value in vote_values.items()})
+        num_votes = counts_per_taxonomy_node(
+            Vote.objects.filter(candidate_annotation__sound_dataset__dataset=dataset).exclude(test='FA'),
+            'candidate_annotation__taxonomy_node_id',
+            **counts)
+        no_votes = dict.fromkeys(counts, 0)
+
         for node in nodes:
-            num_PP = dataset.num_votes_with_value(node.node_id, 1.0)
-            num_PNP = dataset.num_votes_with_value(node.node_id, 0.5)
-            num_NP = dataset.num_votes_with_value(node.node_id, -1.0)
-            num_U = dataset.num_votes_with_value(node.node_id, 0.0)
+            node_num_votes = num_votes.get(node.id, no_votes)
+            num_PP, num_PNP, num_NP, num_U = [node_num_votes['num_{0}'.format(name)]
+                                              for name in ('PP', 'PNP', 'NP', 'U')]
             try:
                 bad_mapping_score = (num_NP + num_U) / (num_PP + num_PNP + num_NP + num_U)
             except ZeroDivisionError:
                 bad_mapping_score = 0
 
-            num_PP_last_month = dataset.num_votes_with_value_after_date(node.node_id, 1.0, reference_date)
-            num_PNP_last_month = dataset.num_votes_with_value_after_date(node.node_id, 0.5, reference_date)
-            num_NP_last_month = dataset.num_votes_with_value_after_date(node.node_id, -1.0, reference_date)
-            num_U_last_month = dataset.num_votes_with_value_after_date(node.node_id, 0.0, reference_date)
+            num_PP_last_month, num_PNP_last_month, num_NP_last_month, num_U_last_month = \
+                [node_num_votes['num_{0}_last_month'.format(name)] for name in ('PP', 'PNP', 'NP', 'U')]
             try:
                 bad_mapping_score_last_month = (num_NP_last_month + num_U_last_month) / \
                                                (num_PP_last_month + num_PNP_last_month + num_NP_last_month + num_U_last_month)
@@ -73,13 +107,9 @@ def compute_dataset_bad_mapping(store_key, dataset_id):
             bad_mapping_categories.append((node.url_id, node.name, bad_mapping_score, node.omitted))
             bad_mapping_categories_last_month.append((node.url_id, node.name, bad_mapping_score_last_month, node.omitted))
 
-            bad_mapping_categories = sorted(bad_mapping_categories, key=lambda x: x[2], reverse=True)  # Sort by mapping score
-            bad_mapping_categories = [category_name_score for category_name_score in bad_mapping_categories]
-
-            bad_mapping_categories_last_month = sorted(bad_mapping_categories_last_month,
-                                                       key=lambda x: x[2], reverse=True)
-            bad_mapping_categories_last_month = [category_name_score for category_name_score
-                                                 in bad_mapping_categories_last_month]
+        bad_mapping_categories = sorted(bad_mapping_categories, key=lambda x: x[2], reverse=True)  # Sort by mapping score
+        bad_mapping_categories_last_month = sorted(bad_mapping_categories_last_month,
+                                                   key=lambda x: x[2], reverse=True)
 
         store.set(store_key, {'bad_mapping_categories': bad_mapping_categories,
                               'bad_mapping_categories_last_month': bad_mapping_categories_last_month})
@@ -90,6 +120,28 @@ def compute_dataset_bad_mapping(store_key, dataset_id):
         pass
 
 
+def percentile(values, fraction):
+    """
+        Returns the percentile of the sorted list of values at the given fraction (between 0 and 1), interpolating
+        linearly between the closest ranks (like Postgres percentile_cont)
+    """
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def votes_until_agreement_stats(num_votes):
+    """
+        Returns the (mean, median, 90th percentile) of a list with the number of votes each ground truth annotation
+        needed, or (0, 0, 0) if the list is empty
+    """
+    if not num_votes:
+        return 0, 0, 0
+    num_votes = sorted(num_votes)
+    return mean(num_votes), median(num_votes), percentile(num_votes, 0.9)
+
+
 @shared_task
 def compute_dataset_difficult_agreement(store_key, dataset_id):
     logger.info('Start computing data for {0}'.format(store_key))
@@ -100,23 +152,40 @@ def compute_dataset_difficult_agreement(store_key, dataset_id):
         difficult_agreement_categories = list()
         difficult_agreement_categories_last_month = list()
 
-        for node in nodes:
-            ground_truth_annotations = node.ground_truth_annotations.filter(from_propagation=False)
-            ground_truth_annotations_last_month = node.ground_truth_annotations.filter(from_propagation=False,
-                                                                                       created_at__gt=reference_date)
-            try:
-                mean_votes_agreement = mean([annotation.from_candidate_annotations.first().votes.exclude(test='FA').count()
-                                             for annotation in ground_truth_annotations])
-            except StatisticsError:
-                mean_votes_agreement = 0
-            try:
-                mean_votes_agreement_last_month = mean([annotation.from_candidate_annotations.first().votes.exclude(test='FA').count()
-                                                        for annotation in ground_truth_annotations_last_month])
-            except StatisticsError:
-                mean_votes_agreement_last_month = 0
+        # Number of (non test) votes of the first candidate annotation that generated each ground truth annotation,
+        # fetched in a single query
+        first_candidate_annotation = CandidateAnnotation.objects\
+            .filter(generated_ground_truth_annotations=OuterRef('pk'))\
+            .order_by('id')\
+            .values('id')[:1]
+        num_votes = Vote.objects\
+            .filter(candidate_annotation_id=OuterRef('first_candidate_annotation_id'))\
+            .exclude(test='FA')\
+            .order_by()\
+            .values('candidate_annotation_id')\
+            .annotate(num_votes=Count('id'))\
+            .values('num_votes')
+        ground_truth_annotations = GroundTruthAnnotation.objects\
+            .filter(taxonomy_node__taxonomy=dataset.taxonomy, from_propagation=False)\
+            .annotate(first_candidate_annotation_id=Subquery(first_candidate_annotation))\
+            .annotate(num_votes=Coalesce(Subquery(num_votes, output_field=IntegerField()), 0),
+                      last_month=Case(When(created_at__gt=reference_date, then=True),
+                                      default=False, output_field=BooleanField()))\
+            .values_list('taxonomy_node_id', 'num_votes', 'last_month')
+
+        num_votes_per_node = defaultdict(list)
+        num_votes_per_node_last_month = defaultdict(list)
+        for taxonomy_node_id, num_votes, last_month in ground_truth_annotations:
+            num_votes_per_node[taxonomy_node_id].append(num_votes)
+            if last_month:
+                num_votes_per_node_last_month[taxonomy_node_id].append(num_votes)
 
-            difficult_agreement_categories.append((node.url_id, node.name, mean_votes_agreement, node.omitted))
-            difficult_agreement_categories_last_month.append((node.url_id, node.name, mean_votes_agreement_last_month, node.omitted))
+        for node in nodes:
+            difficult_agreement_categories.append(
+                (node.url_id, node.name, *votes_until_agreement_stats(num_votes_per_node[node.id]), node.omitted))
+            difficult_agreement_categories_last_month.append(
+                (node.url_id, node.name, *votes_until_agreement_stats(num_votes_per_node_last_month[node.id]),
+                 node.omitted))
 
         difficult_agreement_categories = [category_name_votes for category_name_votes in difficult_agreement_categories
                                           if category_name_votes[2] > 2]
@@ -144,17 +213,20 @@ def compute_remaining_annotations_with_duration(store_key, dataset_id):
         nodes = dataset.taxonomy.taxonomynode_set.all()
         remaining_categories = list()
 
+        num_candidate_annotations = counts_per_taxonomy_node(
+            dataset.candidate_annotations.filter(ground_truth=None),
+            'taxonomy_node_id',
+            num_non_gt=None,
+            num_non_gt_max_10_sec=Q(sound_dataset__sound__duration__lte=10),
+            num_non_gt_max_20_sec=Q(sound_dataset__sound__duration__lte=20, sound_dataset__sound__duration__gt=10))
+        no_candidate_annotations = {'num_non_gt': 0, 'num_non_gt_max_10_sec': 0, 'num_non_gt_max_20_sec': 0}
+
         for node in nodes:
-            non_gt_annotations = dataset.non_ground_truth_annotations_per_taxonomy_node(node.node_id)
-            num_candidate_annotations_non_gt = non_gt_annotations.count()
-            num_candidate_annotations_non_gt_max_10_sec = non_gt_annotations.\
-                filter(sound_dataset__sound__extra_data__duration__lte=10).count()
-            num_candidate_annotations_non_gt_max_20_sec = non_gt_annotations.\
-                filter(sound_dataset__sound__extra_data__duration__lte=20,
-                       sound_dataset__sound__extra_data__duration__gt=10).count()
-            remaining_categories.append((node.url_id, node.name, num_candidate_annotations_non_gt,
-                                         num_candidate_annotations_non_gt_max_10_sec,
-                                         num_candidate_annotations_non_gt_max_20_sec,
+            node_num_candidate_annotations = num_candidate_annotations.get(node.id, no_candidate_annotations)
+            remaining_categories.append((node.url_id, node.name,
+                                         node_num_candidate_annotations['num_non_gt'],
+                                         node_num_candidate_annotations['num_non_gt_max_10_sec'],
+                                         node_num_candidate_annotations['num_non_gt_max_20_sec'],
                                          node.omitted))
 
         remaining_categories = sorted(remaining_categories, key=lambda x: x[3])
@@ -264,3 +336,93 @@ def compute_dataset_num_ground_truth_per_day(store_key, dataset_id):
 
     except Dataset.DoesNotExist:
         pass
+
+
+def mapping_run_id(dataset, node, positive_tags, negative_tags, preproc_positive, preproc_negative):
+    """
+        Returns the id of the run of a mapping rule. Identical rules share the id (and the stored results) until the
+        sounds of the dataset or their tags change
+    """
+    rule = json.dumps([connection.settings_dict['NAME'], dataset.id, node.id, positive_tags, negative_tags,
+                       preproc_positive, preproc_negative,
+                       store.get_version(SOUND_TAG_INDEX_VERSION_KEY_TEMPLATE.format(dataset.id))])
+    return hashlib.sha1(rule.encode('utf-8')).hexdigest()
+
+
+def request_mapping_run(dataset, node, positive_tags, negative_tags, preproc_positive, preproc_negative):
+    """
+        Starts the run of a mapping rule in the background, unless its results are already stored or it is already
+        running. Returns the id of the run, to get its results with get_mapping_run
+    """
+    run_id = mapping_run_id(dataset, node, positive_tags, negative_tags, preproc_positive, preproc_negative)
+    store_key = MAPPING_RUN_KEY_TEMPLATE.format(node.id, run_id)
+    if store.get(store_key).get('status') in (None, 'failed'):
+        store.set(store_key, {'status': 'queued'}, expire=MAPPING_RUN_PENDING_TIMEOUT)
+        run_mapping_rule.delay(run_id, dataset.id, node.id, positive_tags, negative_tags, preproc_positive,
+                               preproc_negative)
+    return run_id
+
+
+def get_mapping_run(node, run_id, offset=0, limit=20):
+    """
+        Returns the status of a mapping run ('queued', 'stats', 'done' or 'failed', None if unknown), its stats once
+        they are computed and, when it is done, limit of the retrieved freesound ids (in random order) from offset
+    """
+    data = store.get(MAPPING_RUN_KEY_TEMPLATE.format(node.id, run_id))
+    freesound_ids = []
+    if data.get('status') == 'done':
+        freesound_ids = [int(freesound_id) for freesound_id in store.r.lrange(
+            MAPPING_RUN_SOUNDS_KEY_TEMPLATE.format(node.id, run_id), offset, offset + limit - 1)]
+    return {'status': data.get('status'), 'stats': data.get('stats'), 'freesound_ids': freesound_ids}
+
+
+def delete_mapping_runs(node):
+    """ Deletes the stored mapping runs of the node, e.g. after its candidate annotations change """
+    store.delete_keys(MAPPING_RUN_KEY_TEMPLATE.format(node.id, '*'))
+    store.delete_keys(MAPPING_RUN_SOUNDS_KEY_TEMPLATE.format(node.id, '*'))
+
+
+@shared_task
+def run_mapping_rule(run_id, dataset_id, taxonomy_node_id, positive_tags, negative_tags, preproc_positive,
+                     preproc_negative):
+    """
+        Retrieves the sounds of a mapping rule and stores the stats of the retrieval, and then the shuffled list of
+        the retrieved freesound ids, under the id of the run
+    """
+    store_key = MAPPING_RUN_KEY_TEMPLATE.format(taxonomy_node_id, run_id)
+    logger.info('Start computing data for {0}'.format(store_key))
+    try:
+        dataset = Dataset.objects.get(id=dataset_id)
+        node = TaxonomyNode.objects.get(id=taxonomy_node_id)
+        results = dataset.retrieve_sound_by_tags(positive_tags, negative_tags, preproc_positive, preproc_negative)
+        sounds = list(results.values_list('id', 'freesound_id'))
+        candidates = set(node.candidate_annotations.values_list('sound_dataset__sound_id', flat=True))
+
+        quality_estimate = dataset.quality_estimate_mapping(results, node.node_id)
+        quality_estimate['num_sounds'] = len(sounds)
+        stats = {
+            'retrieved': quality_estimate,
+            'mapping': node.quality_estimate,
+            'num_common_sounds': len([sound_id for sound_id, _ in sounds if sound_id in candidates])
+        }
+        store.set(store_key, {'status': 'stats', 'stats': stats}, expire=MAPPING_RUN_EXPIRE)
+
+        freesound_ids = [freesound_id for _, freesound_id in sounds]
+        shuffle(freesound_ids)
+        sounds_key = MAPPING_RUN_SOUNDS_KEY_TEMPLATE.format(taxonomy_node_id, run_id)
+        pipe = store.r.pipeline()
+        pipe.delete(sounds_key)
+        for chunk in chunks(freesound_ids, 10000):
+            pipe.rpush(sounds_key, *chunk)
+        pipe.expire(sounds_key, MAPPING_RUN_EXPIRE)
+        pipe.execute()
+        store.set(store_key, {'status': 'done', 'stats': stats}, expire=MAPPING_RUN_EXPIRE)
+
+        logger.info('Finished computing data for {0}'.format(store_key))
+
+    except (Dataset.DoesNotExist, TaxonomyNode.DoesNotExist):
+        store.delete(store_key)
+
+    except Exception:
+        store.set(store_key, {'status': 'failed'}, expire=MAPPING_RUN_PENDING_TIMEOUT)
+        raise
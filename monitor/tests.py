@@ -1,3 +1,225 @@
 from django.test import TestCase
+from django.urls import reverse
+from datasets import models
+from datasets.management.commands.generate_fake_data import create_sounds, create_users, create_candidate_annotations, \
+    create_votes, add_taxonomy_nodes
+from monitor.tasks import compute_dataset_top_contributed_categories, compute_dataset_bad_mapping, \
+    compute_remaining_annotations_with_duration, compute_dataset_difficult_agreement, percentile, \
+    delete_mapping_runs, run_mapping_rule
+from statistics import mean, median
+from unittest import mock
+import datetime
 
-# Create your tests here.
+
+class MonitorTasksTest(TestCase):
+    fixtures = ['datasets/fixtures/initial.json']
+
+    def setUp(self):
+        add_taxonomy_nodes(models.Taxonomy.objects.get())
+        create_sounds('fsd', 10)
+        create_users(3)
+        create_candidate_annotations('fsd', 30)
+        create_votes(40)
+        models.Vote.objects.filter(id__in=models.Vote.objects.values('id')[:5]).update(test='FA')
+        models.Vote.objects.filter(id__in=models.Vote.objects.values('id')[5:15])\
+            .update(created_at=datetime.datetime.today() - datetime.timedelta(days=60))
+        self.dataset = models.Dataset.objects.get(short_name='fsd')
+        self.nodes = self.dataset.taxonomy.taxonomynode_set.all()
+
+    def run_task(self, task):
+        with mock.patch('monitor.tasks.store') as store:
+            task('key', self.dataset.id)
+        return store.set.call_args[0][1]
+
+    def test_top_contributed_categories_equals_per_node_counts(self):
+        reference_date = datetime.datetime.today() - datetime.timedelta(days=7)
+        top_categories = sorted([(node.url_id, node.name, models.Vote.objects.filter(
+                                    candidate_annotation__taxonomy_node=node).count(), node.omitted)
+                                 for node in self.nodes], key=lambda x: x[2], reverse=True)
+        top_categories_last_week = sorted([(node.url_id, node.name, models.Vote.objects.filter(
+                                              candidate_annotation__taxonomy_node=node,
+                                              created_at__gt=reference_date).count(), node.omitted)
+                                           for node in self.nodes], key=lambda x: x[2], reverse=True)
+
+        self.assertEqual(self.run_task(compute_dataset_top_contributed_categories),
+                         {'top_categories': top_categories[:15],
+                          'top_categories_last_week': top_categories_last_week[:15]})
+
+    def test_bad_mapping_equals_per_node_counts(self):
+        reference_date = datetime.datetime.today() - datetime.timedelta(days=31)
+
+        def bad_mapping_score(node_id, num_votes_with_value):
+            num_PP, num_PNP, num_NP, num_U = [num_votes_with_value(node_id, value) for value in (1.0, 0.5, -1.0, 0.0)]
+            try:
+                return (num_NP + num_U) / (num_PP + num_PNP + num_NP + num_U)
+            except ZeroDivisionError:
+                return 0
+
+        def num_votes_with_value_last_month(node_id, value):
+            return self.dataset.num_votes_with_value_after_date(node_id, value, reference_date)
+
+        bad_mapping_categories = sorted([(node.url_id, node.name,
+                                          bad_mapping_score(node.node_id, self.dataset.num_votes_with_value),
+                                          node.omitted)
+                                         for node in self.nodes], key=lambda x: x[2], reverse=True)
+        bad_mapping_categories_last_month = sorted([(node.url_id, node.name,
+                                                     bad_mapping_score(node.node_id, num_votes_with_value_last_month),
+                                                     node.omitted)
+                                                    for node in self.nodes], key=lambda x: x[2], reverse=True)
+
+        self.assertEqual(self.run_task(compute_dataset_bad_mapping),
+                         {'bad_mapping_categories': bad_mapping_categories,
+                          'bad_mapping_categories_last_month': bad_mapping_categories_last_month})
+
+    def test_remaining_annotations_with_duration_equals_per_node_counts(self):
+        remaining_categories = []
+        for node in self.nodes:
+            non_gt_annotations = self.dataset.candidate_annotations.filter(taxonomy_node=node, ground_truth=None)
+            remaining_categories.append((
+                node.url_id, node.name, non_gt_annotations.count(),
+                non_gt_annotations.filter(sound_dataset__sound__extra_data__duration__lte=10).count(),
+                non_gt_annotations.filter(sound_dataset__sound__extra_data__duration__lte=20,
+                                          sound_dataset__sound__extra_data__duration__gt=10).count(),
+                node.omitted))
+        remaining_categories = sorted(remaining_categories, key=lambda x: x[3])
+
+        self.assertEqual(self.run_task(compute_remaining_annotations_with_duration),
+                         {'remaining_categories': remaining_categories})
+
+    def test_difficult_agreement_equals_per_annotation_counts(self):
+        # make some ground truth annotations need more votes so that their category has a mean above 2
+        for ground_truth_annotation in models.GroundTruthAnnotation.objects.filter(from_propagation=False)[:10]:
+            candidate_annotation = ground_truth_annotation.from_candidate_annotations.first()
+            for user in models.User.objects.all():
+                models.Vote.objects.create(created_by=user, vote=-1.0, visited_sound=False,
+                                           candidate_annotation=candidate_annotation, test='AP')
+        reference_date = datetime.datetime.today() - datetime.timedelta(days=31)
+
+        def stats(ground_truth_annotations):
+            num_votes = sorted(annotation.from_candidate_annotations.first().votes.exclude(test='FA').count()
+                               for annotation in ground_truth_annotations)
+            if not num_votes:
+                return 0, 0, 0
+            return mean(num_votes), median(num_votes), percentile(num_votes, 0.9)
+
+        difficult_agreement_categories = []
+        difficult_agreement_categories_last_month = []
+        for node in self.nodes:
+            ground_truth_annotations = node.ground_truth_annotations.filter(from_propagation=False)
+            difficult_agreement_categories.append((node.url_id, node.name, *stats(ground_truth_annotations),
+                                                   node.omitted))
+            difficult_agreement_categories_last_month.append(
+                (node.url_id, node.name, *stats(ground_truth_annotations.filter(created_at__gt=reference_date)),
+                 node.omitted))
+
+        payload = self.run_task(compute_dataset_difficult_agreement)
+        self.assertTrue(payload['difficult_agreement_categories'])
+        self.assertEqual(payload, {
+            'difficult_agreement_categories': sorted([category for category in difficult_agreement_categories
+                                                      if category[2] > 2], key=lambda x: x[2], reverse=True),
+            'difficult_agreement_categories_last_month': sorted([category for category
+                                                                 in difficult_agreement_categories_last_month
+                                                                 if category[2] > 2], key=lambda x: x[2], reverse=True)
+        })
+
+    def test_percentile(self):
+        self.assertEqual(percentile([3], 0.9), 3)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 0.5), 3)
+        self.assertAlmostEqual(percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 0.9), 9.1)
+
+
+class MappingRunTest(TestCase):
+    fixtures = ['datasets/fixtures/initial.json']
+
+    def setUp(self):
+        add_taxonomy_nodes(models.Taxonomy.objects.get())
+        create_sounds('fsd', 30)
+        create_users(1)
+        self.dataset = models.Dataset.objects.get(short_name='fsd')
+        self.dataset.maintainers.add(models.User.objects.get())
+        for count, sound in enumerate(models.Sound.objects.all()):
+            sound.extra_data['tags'] = ['dog'] if count < 25 else ['cat']
+            sound.extra_data['stemmed_tags'] = sound.extra_data['tags']
+            sound.save()
+        self.node = self.dataset.taxonomy.taxonomynode_set.first()
+        self.url = reverse('mapping-category', args=[self.dataset.short_name, self.node.url_id])
+        self.client.login(username='username_0', password='123456')
+        # Run the mapping task in the request instead of queueing it, whatever the celery settings are
+        delay = mock.patch('monitor.tasks.run_mapping_rule.delay', side_effect=run_mapping_rule)
+        delay.start()
+        self.addCleanup(delay.stop)
+
+    def tearDown(self):
+        delete_mapping_runs(self.node)
+
+    def run_mapping(self, tags):
+        response = self.client.post(self.url, {'positive-tags': tags, 'run-or-submit': 'run'})
+        return response.json()['run_id']
+
+    def get_run(self, run_id, **params):
+        return self.client.get(reverse('mapping-category-run', args=[self.dataset.short_name, self.node.url_id,
+                                                                     run_id]), params)
+
+    def test_mapping_run_results_are_paginated(self):
+        run_id = self.run_mapping('dog')
+        response = self.get_run(run_id, offset=0, limit=20)
+        self.assertEqual(response.status_code, 200)
+        first_page = response.json()
+        self.assertEqual(first_page['status'], 'done')
+        self.assertEqual(first_page['stats']['retrieved']['num_sounds'], 25)
+        self.assertEqual(first_page['stats']['mapping']['num_sounds'], self.node.candidate_annotations.count())
+        self.assertEqual(len(first_page['freesound_ids']), 20)
+
+        second_page = self.get_run(run_id, offset=20, limit=20).json()
+        self.assertListEqual(sorted(first_page['freesound_ids'] + second_page['freesound_ids']),
+                             sorted(models.Sound.objects.filter(extra_data__tags__contains='dog')
+                                    .values_list('freesound_id', flat=True)))
+
+        self.assertEqual(self.get_run('0123abcd').status_code, 404)
+
+    def test_identical_rules_reuse_the_run_until_the_sounds_change(self):
+        run_id = self.run_mapping('dog')
+        with mock.patch('monitor.tasks.run_mapping_rule.delay') as run_mapping_rule:
+            self.assertEqual(self.run_mapping('dog'), run_id)
+            run_mapping_rule.assert_not_called()
+
+            self.assertNotEqual(self.run_mapping('cat'), run_id)
+            sound = models.Sound.objects.first()
+            sound.extra_data['analysis'] = {'ebur128': -20}
+            sound.save()
+            self.assertEqual(self.run_mapping('dog'), run_id)
+
+            sound.extra_data['stemmed_tags'] = ['cat']
+            sound.save()
+            self.assertNotEqual(self.run_mapping('dog'), run_id)
+            self.assertEqual(run_mapping_rule.call_count, 2)
+
+    def test_submit_deletes_the_runs_of_the_node(self):
+        run_id = self.run_mapping('dog')
+        response = self.client.post(self.url, {'positive-tags': 'dog', 'run-or-submit': 'submit',
+                                               'add-or-replace': 'add', 'freesound-ids': 'false'})
+        self.assertFalse(response.json()['error'])
+        self.assertEqual(self.node.candidate_annotations.count(), 25)
+        self.assertEqual(self.get_run(run_id).status_code, 404)
+
+    def test_submit_replace_deletes_the_candidates_not_retrieved(self):
+        self.client.post(self.url, {'positive-tags': 'dog', 'run-or-submit': 'submit', 'add-or-replace': 'add',
+                                    'freesound-ids': 'false'})
+        dog_candidate_ids = list(self.node.candidate_annotations.values_list('id', flat=True))
+        models.Vote.objects.create(created_by=models.User.objects.get(), vote=1.0,
+                                   candidate_annotation_id=dog_candidate_ids[0])
+        pools = models.CandidateAnnotationPools(self.dataset.id)
+        pools.build()
+        self.addCleanup(pools.delete)
+
+        response = self.client.post(self.url, {'positive-tags': 'cat', 'run-or-submit': 'submit',
+                                               'add-or-replace': 'replace', 'freesound-ids': 'false'})
+        self.assertEqual(response.json()['num_candidates_deleted'], 24)
+        # the voted candidate annotation is kept
+        tags = self.node.candidate_annotations.values_list('sound_dataset__sound__extra_data__tags', flat=True)
+        self.assertListEqual(sorted(tags), [['cat']] * 5 + [['dog']])
+        self.assertDictEqual(models.annotation_counter_values(self.dataset.annotation_counters.all()),
+                             self.dataset.compute_annotation_counters())
+        pool_ids = {int(candidate_annotation_id)
+                    for candidate_annotation_id in models.store.r.zrange(pools.pool_key(self.node.id), 0, -1)}
+        self.assertFalse(pool_ids.intersection(dog_candidate_ids[1:]))
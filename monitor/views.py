@@ -6,17 +6,17 @@ from django.db.models import Count
 from django.db.models.functions import TruncDay
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.urls import reverse
-from datasets.models import Dataset, User, CandidateAnnotation, Sound
+from datasets.models import Dataset, User, Sound
 from datasets.utils import stem
 from datasets.templatetags.general_templatetags import sound_player
 from monitor.tasks import compute_dataset_top_contributed_categories, compute_dataset_bad_mapping, \
     compute_dataset_difficult_agreement, compute_remaining_annotations_with_duration, \
-    compute_dataset_num_contributions_per_day, compute_dataset_num_ground_truth_per_day
+    compute_dataset_num_contributions_per_day, compute_dataset_num_ground_truth_per_day, request_mapping_run, \
+    get_mapping_run, delete_mapping_runs
 from utils.async_tasks import data_from_async_task
 from utils.redis_store import DATASET_TOP_CONTRIBUTED_CATEGORIES, DATASET_BAD_MAPPING_CATEGORIES, \
     DATASET_DIFFICULT_AGREEMENT_CATEGORIES, DATASET_REMAINING_CANDIDATE_ANNOTATIONS_PER_CATEGORIES, \
     DATASET_CONTRIBUTIONS_PER_DAY, DATASET_GROUND_TRUTH_PER_DAY
-from random import shuffle
 
 
 @login_required
@@ -152,27 +152,18 @@ def mapping_category(request, short_name, node_id):
                          for tags in negative_tags_raw
                          for tag in tags.split(',') if tags != '']
 
+        # Run the mapping strategy in the background, the retrieved sounds and some statistics are then
+        # fetched from mapping_category_run
+        if run_or_submit == 'run':
+            run_id = request_mapping_run(dataset, node, positive_tags, negative_tags, preproc_positive,
+                                         preproc_negative)
+            return JsonResponse({'run_id': run_id})
+
         results = dataset.retrieve_sound_by_tags(positive_tags, negative_tags, preproc_positive, preproc_negative)
         candidates = list(node.candidate_annotations.values_list('sound_dataset__sound__freesound_id', flat=True))
 
-        # Run the mapping strategy and return the retrieved sounds and some statistics
-        if run_or_submit == 'run':
-            quality_estimate = dataset.quality_estimate_mapping(results, node_id)
-            freesound_ids = list(results.values_list('freesound_id', flat=True))
-            shuffle(freesound_ids)
-            quality_estimate['freesound_ids'] = freesound_ids
-            quality_estimate['num_sounds'] = len(freesound_ids)
-            num_common_sounds = len(list(set(candidates).intersection(set(freesound_ids))))
-
-            stats = {
-                'retrieved': quality_estimate,
-                'mapping': node.quality_estimate,
-                'num_common_sounds': num_common_sounds
-            }
-            return JsonResponse(stats)
-
         # Submit the retrieved sounds
-        elif run_or_submit == 'submit':
+        if run_or_submit == 'submit':
             freesound_ids_str = dict(request.POST).get('freesound-ids', ['false'])[0]
             children_node = dataset.taxonomy.get_all_propagate_from_children(node.node_id)
             num_candidates_added = 0
@@ -185,22 +176,16 @@ def mapping_category(request, short_name, node_id):
                     new_sounds = results.exclude(freesound_id__in=candidates)
                     num_new_sounds = new_sounds.count()
                     with transaction.atomic():
-                        for sound in new_sounds:
-                            # add the candidate only if it does not exist in a child
-                            if CandidateAnnotation.objects.filter(taxonomy_node__in=children_node,
-                                                                  sound_dataset__sound=sound).count() == 0:
-                                c = CandidateAnnotation.objects.create(
-                                    sound_dataset=sound.sounddataset_set.filter(dataset=dataset).first(),
-                                    type='MA',
-                                    algorithm='platform_manual: By Freesound ID',
-                                    taxonomy_node=node,
-                                    created_by=request.user
-                                )
-                                c.update_priority_score()
-                                num_candidates_added += 1
+                        # add the candidates only if they do not exist in a child
+                        num_candidates_added = dataset.add_candidate_annotations(
+                            node, new_sounds, skip_taxonomy_nodes=children_node,
+                            type='MA',
+                            algorithm='platform_manual: By Freesound ID',
+                            created_by=request.user)
                 except:
                     return JsonResponse({'error': True})
 
+                delete_mapping_runs(node)
                 return JsonResponse({'error': False,
                                      'num_candidates_added': num_new_sounds,
                                      'num_candidates_deleted': 0})
@@ -220,19 +205,12 @@ def mapping_category(request, short_name, node_id):
                     num_new_sounds = new_sounds.count()
                     try:
                         with transaction.atomic():
-                            for sound in new_sounds:
-                                # add the candidate only if it does not exist in a child
-                                if CandidateAnnotation.objects.filter(taxonomy_node__in=children_node,
-                                                                      sound_dataset__sound=sound).count() == 0:
-                                    c = CandidateAnnotation.objects.create(
-                                        sound_dataset=sound.sounddataset_set.filter(dataset=dataset).first(),
-                                        type='AU',
-                                        algorithm='platform_mapping: {}'.format(name_algorithm),
-                                        taxonomy_node=node,
-                                        created_by=request.user
-                                    )
-                                    c.update_priority_score()
-                                    num_candidates_added += 1
+                            # add the candidates only if they do not exist in a child
+                            num_candidates_added = dataset.add_candidate_annotations(
+                                node, new_sounds, skip_taxonomy_nodes=children_node,
+                                type='AU',
+                                algorithm='platform_mapping: {}'.format(name_algorithm),
+                                created_by=request.user)
                     except:
                         return JsonResponse({'error': True})
 
@@ -241,27 +219,19 @@ def mapping_category(request, short_name, node_id):
                     try:
                         with transaction.atomic():
                             new_sounds = results.exclude(freesound_id__in=candidates)
-                            num_deleted = node.candidate_annotations.exclude(sound_dataset__sound__in=results)\
-                                                                    .annotate(num_votes=Count('votes'))\
-                                                                    .filter(num_votes=0)\
-                                                                    .delete()[0]
+                            num_deleted = dataset.delete_candidate_annotations(
+                                node.candidate_annotations.exclude(sound_dataset__sound__in=results))
                             num_new_sounds = new_sounds.count()
-                            for sound in new_sounds:
-                                # add the candidate only if it does not exist in a child
-                                if CandidateAnnotation.objects.filter(taxonomy_node__in=children_node,
-                                                                      sound_dataset__sound=sound).count() == 0:
-                                    c = CandidateAnnotation.objects.create(
-                                        sound_dataset=sound.sounddataset_set.filter(dataset=dataset).first(),
-                                        type='AU',
-                                        algorithm='platform_mapping: {}'.format(name_algorithm),
-                                        taxonomy_node=node,
-                                        created_by=request.user
-                                    )
-                                    c.update_priority_score()
-                                    num_candidates_added += 1
+                            # add the candidates only if they do not exist in a child
+                            num_candidates_added = dataset.add_candidate_annotations(
+                                node, new_sounds, skip_taxonomy_nodes=children_node,
+                                type='AU',
+                                algorithm='platform_mapping: {}'.format(name_algorithm),
+                                created_by=request.user)
                     except:
                         return JsonResponse({'error': True})
 
+                delete_mapping_runs(node)
                 return JsonResponse({'error': False,
                                      'num_candidates_added': num_candidates_added,
                                      'num_candidates_deleted': num_deleted})
@@ -287,6 +257,24 @@ def mapping_category(request, short_name, node_id):
         })
 
 
+@login_required
+def mapping_category_run(request, short_name, node_id, run_id):
+    dataset = get_object_or_404(Dataset, short_name=short_name)
+    if not dataset.user_is_maintainer(request.user):
+        return HttpResponseRedirect(reverse('dataset', args=[dataset.short_name]))
+    node = dataset.taxonomy.get_element_at_id(unquote(node_id))
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 1000)
+    except ValueError:
+        return JsonResponse({'error': True}, status=400)
+
+    mapping_run = get_mapping_run(node, run_id, offset, limit)
+    if mapping_run['status'] is None:
+        return JsonResponse({'error': True}, status=404)
+    return JsonResponse(mapping_run)
+
+
 def monitor_sound(request, short_name, freesound_id):
     dataset = get_object_or_404(Dataset, short_name=short_name)
     if not dataset.user_is_maintainer(request.user):
@@ -16,9 +16,9 @@ class RedisStore(object):
         self.r = redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0)
         self.verbose = verbose
 
-    def set(self, key, data):
+    def set(self, key, data, expire=None):
         data.update({TIMESTAMP_FIELDNAME: int(time.time())})
-        self.r.set(key, json.dumps(data))
+        self.r.set(key, json.dumps(data), ex=expire)
         if self.verbose:
             print('Set data at key {0}'.format(key))
 
@@ -57,6 +57,22 @@ class RedisStore(object):
     def delete_compute_keys(self):
         return self.delete_keys('computing-*')
 
+    def set_if_absent(self, key, expire):
+        """ Sets a flag at key that expires after expire seconds, returns False if it was already set """
+        created = self.r.set(key, 1, nx=True, ex=expire)
+        if self.verbose:
+            print('Set flag at key {0}'.format(key) if created else 'Flag at key {0} already set'.format(key))
+        return bool(created)
+
+    def get_version(self, key):
+        version = self.r.get(key)
+        return int(version) if version is not None else 0
+
+    def increment_version(self, key):
+        if self.verbose:
+            print('Incrementing version at key {0}'.format(key))
+        return self.r.incr(key)
+
 
 store = RedisStore(verbose=False)
 
@@ -66,7 +82,18 @@ DATASET_TAXONOMY_STATS_KEY_TEMPLATE = 'dataset_taxonomy_stats_{0}'
 DATASET_ANNOTATORS_RANKING_TEMPLATE = 'dataset_annotators_ranking_{0}'
 DATASET_TOP_CONTRIBUTED_CATEGORIES = 'dataset_top_contributed_categories_{0}'
 DATASET_BAD_MAPPING_CATEGORIES = 'dataset_bad_mapping_categoies_{0}'
-DATASET_DIFFICULT_AGREEMENT_CATEGORIES = 'dataset_difficult_agreement_categories_{0}'
+DATASET_DIFFICULT_AGREEMENT_CATEGORIES = 'dataset_difficult_agreement_categories_distribution_{0}'
 DATASET_REMAINING_CANDIDATE_ANNOTATIONS_PER_CATEGORIES = 'dataset_remaining_candidate_annotations_per_categories_{0}'
 DATASET_CONTRIBUTIONS_PER_DAY = 'dataset_num_contributions_per_day_{0}'
 DATASET_GROUND_TRUTH_PER_DAY = 'dataset_num_ground_truth_per_day_{0}'
+TAXONOMY_VERSION_KEY_TEMPLATE = 'taxonomy_version_{0}'
+# starts with 'computing-' so that python manage.py clear_computing_keys also clears the stuck ones
+GROUND_TRUTH_PROPAGATION_PENDING_KEY_TEMPLATE = 'computing-propagation-{0}-{1}'
+PRIORITY_SCORE_WATERMARK_KEY_TEMPLATE = 'priority_score_watermark_{0}'
+CANDIDATE_POOLS_VERSION_KEY_TEMPLATE = 'candidate_pools_version_{0}'
+CANDIDATE_POOLS_GENERATION_KEY_TEMPLATE = 'candidate_pools_generation_{0}'
+CANDIDATE_POOL_KEY_TEMPLATE = 'candidate_pool_{0}_{1}_{2}'
+VOTED_CANDIDATES_KEY_TEMPLATE = 'voted_candidates_{0}_{1}_{2}_{3}'
+SOUND_TAG_INDEX_VERSION_KEY_TEMPLATE = 'sound_tag_index_version_{0}'
+MAPPING_RUN_KEY_TEMPLATE = 'mapping_run_{0}_{1}'
+MAPPING_RUN_SOUNDS_KEY_TEMPLATE = 'mapping_run_sounds_{0}_{1}'